@@ -0,0 +1,63 @@
+import typing as tp
+
+import torch
+
+
+class BatchedMetadata:
+    """
+    Metadata of a batch, built by collation_fn inside the DataLoader workers.
+
+    Tensor values that every sample has with the same shape and dtype (conditioning features, video_exist, ...)
+    are stacked into one contiguous tensor per key in .tensors, so pinning, device transfer and conditioning
+    work on whole batches. The other values stay per sample. Indexing and iteration still give per-sample
+    dicts (tensor values are views into the stacked ones), like the tuple of dicts collation used to return.
+
+    DataLoader(pin_memory=True) calls pin_memory() and Lightning moves the batch with to(device). It is not a
+    Sequence subclass on purpose: the DataLoader pins Sequences element by element and only falls back to
+    pin_memory() for other objects, and Lightning passes non_blocking only to plain tensors, so to() sets it.
+    """
+    def __init__(self, samples: tp.Sequence[dict] = (), tensors: tp.Optional[tp.Dict[str, torch.Tensor]] = None,
+                 rest: tp.Optional[tp.List[dict]] = None):
+        if tensors is None:
+            tensors = {}
+            keys = set(samples[0]).intersection(*samples[1:]) if len(samples) > 0 else set()
+            for key in keys:
+                values = [sample[key] for sample in samples]
+                if all(isinstance(v, torch.Tensor) and v.shape == values[0].shape and v.dtype == values[0].dtype for v in values):
+                    tensors[key] = torch.stack(values)
+            rest = [{k: v for k, v in sample.items() if k not in tensors} for sample in samples]
+        self.tensors = tensors
+        self.rest = rest
+
+    def __len__(self) -> int:
+        return len(self.rest)
+
+    def __iter__(self) -> tp.Iterator[dict]:
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return BatchedMetadata(tensors={k: v[idx] for k, v in self.tensors.items()}, rest=self.rest[idx])
+        sample = dict(self.rest[idx])
+        sample.update({k: v[idx] for k, v in self.tensors.items()})
+        return sample
+
+    def stack(self, key: str) -> torch.Tensor:
+        if key in self.tensors:
+            return self.tensors[key]
+        return torch.stack([sample[key] for sample in self.rest])
+
+    def pin_memory(self) -> "BatchedMetadata":
+        return BatchedMetadata(tensors={k: v.pin_memory() for k, v in self.tensors.items()}, rest=self.rest)
+
+    def to(self, *args, **kwargs) -> "BatchedMetadata":
+        # asynchronous from the pinned tensors, the stream orders the copies before the conditioners use them
+        kwargs.setdefault("non_blocking", True)
+        return BatchedMetadata(tensors={k: v.to(*args, **kwargs) for k, v in self.tensors.items()}, rest=self.rest)
+
+
+def stack_metadata(metadata: tp.Union[BatchedMetadata, tp.Sequence[dict]], key: str) -> torch.Tensor:
+    """One tensor of key for the batch: the pre-stacked one of a BatchedMetadata, else stacked from the per-sample dicts."""
+    if isinstance(metadata, BatchedMetadata):
+        return metadata.stack(key)
+    return torch.stack([md[key] for md in metadata], dim=0)
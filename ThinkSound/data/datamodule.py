@@ -1,6 +1,10 @@
 import lightning as L
 from .dataset import LatentDataset, SampleDataset, VideoDataset, AudioDataset, MultiModalDataset, LocalDatasetConfig, collation_fn
+from .dataset import VideoFeatureWebDataset, S3DatasetConfig, LocalWebDatasetConfig
+from .sampler import DurationBucketBatchSampler
 import importlib
+import torch
+import webdataset as wds
 from torch.utils.data import DataLoader
 
 
@@ -32,9 +36,22 @@ def get_configs(audio_configs):
         )
     return configs
 
+def get_wds_configs(wds_dir_configs):
+    configs = []
+    for config in wds_dir_configs:
+        if "s3_path" in config:
+            configs.append(S3DatasetConfig(id=config["id"], s3_path=config["s3_path"], profile=config.get("profile", None)))
+        else:
+            # a local directory of tar shards, the stand-in for object storage
+            assert config.get("path", None) is not None, "path or s3_path must be set for a shard dataset configuration"
+            configs.append(LocalWebDatasetConfig(id=config["id"], path=config["path"]))
+    return configs
+
 class DataModule(L.LightningDataModule):
-    def __init__(self, dataset_config, batch_size, test_batch_size, sample_size, sample_rate, audio_channels=2, num_workers=4,repeat_num=5,latent_length=194):
+    def __init__(self, dataset_config, batch_size, test_batch_size, sample_size, sample_rate, audio_channels=2, num_workers=4,repeat_num=5,latent_length=194,keys=None):
         super().__init__()
+        # metadata keys the model consumes (get_conditioning_keys), the datasets load only these features
+        self.keys = keys
         dataset_type = dataset_config.get("dataset_type", None)
         self.batch_size = batch_size
         self.num_workers = num_workers
@@ -60,9 +77,13 @@ class DataModule(L.LightningDataModule):
             configs = get_configs(audio_dir_configs)
             val_configs = get_configs(val_dir_configs)
             test_configs = get_configs(test_dir_configs)
-        elif dataset_type == "latent_dir" or dataset_type == "video_dataset":
+        elif dataset_type == "latent_dir" or dataset_type == "video_dataset" or dataset_type == "video_feature_wds":
             audio_dir_configs = dataset_config.get("datasets", None)
             assert audio_dir_configs is not None, "Directory configuration must be specified in datasets[\"dataset\"]"
+            if dataset_type == "video_feature_wds":
+                # training streams tar shards, validation and test read feature directories like video_dataset
+                self.wds_configs = get_wds_configs(audio_dir_configs)
+                audio_dir_configs = []
             for i, dataset in enumerate((audio_dir_configs, val_dir_configs, test_dir_configs)):
                 for config in dataset:
                     data_dir_path = config.get("path", None)
@@ -121,6 +142,11 @@ class DataModule(L.LightningDataModule):
         self.input_type = dataset_config.get("input_type", "video")
         self.fps = dataset_config.get("fps", 4)
         self.force_channels = force_channels
+        self.epoch_steps = dataset_config.get("epoch_steps", 2000)
+        self.shuffle_buffer = dataset_config.get("shuffle_buffer", 1000)
+        self.resampled = dataset_config.get("resampled", True)
+        # batch samples of equal sequence lengths for mixed-duration data, see DurationBucketBatchSampler
+        self.bucket_by_duration = dataset_config.get("bucket_by_duration", False)
         
 
     def setup(self, stage: str):
@@ -129,7 +155,7 @@ class DataModule(L.LightningDataModule):
             dataset_class = SampleDataset
         elif self.dataset_type == 'latent_dir':
             dataset_class = LatentDataset
-        elif self.dataset_type == 'video_dataset':
+        elif self.dataset_type == 'video_dataset' or self.dataset_type == 'video_feature_wds':
             dataset_class = VideoDataset
         elif self.dataset_type == 'multimodal_dir':
             dataset_class = VideoDataset
@@ -143,11 +169,23 @@ class DataModule(L.LightningDataModule):
                 input_type=self.input_type,
                 fps=self.input_type,
                 force_channels=self.force_channels,
-                latent_length=self.latent_length
+                latent_length=self.latent_length,
+                keys=self.keys
             )
 
         if stage == 'fit':
-            if self.dataset_type != 'multimodal_dir':
+            if self.dataset_type == 'video_feature_wds':
+                self.train_set = VideoFeatureWebDataset(
+                    self.wds_configs,
+                    batch_size=self.batch_size,
+                    num_workers=self.num_workers,
+                    epoch_steps=self.epoch_steps,
+                    shuffle_buffer=self.shuffle_buffer,
+                    resampled=self.resampled,
+                    keys=self.keys,
+                    latent_length=self.latent_length
+                ).dataset
+            elif self.dataset_type != 'multimodal_dir':
                 self.train_set = create_dataset(self.configs, random_crop=self.random_crop)
             else:
                 self.video_set = VideoDataset(
@@ -157,7 +195,8 @@ class DataModule(L.LightningDataModule):
                     random_crop=self.random_crop,
                     input_type=self.input_type,
                     fps=self.input_type,
-                    force_channels=self.force_channels
+                    force_channels=self.force_channels,
+                    keys=self.keys
                 )
                 self.audio_set = AudioDataset(
                     self.audio_configs,
@@ -166,7 +205,8 @@ class DataModule(L.LightningDataModule):
                     random_crop=self.random_crop,
                     input_type=self.input_type,
                     fps=self.input_type,
-                    force_channels=self.force_channels
+                    force_channels=self.force_channels,
+                    keys=self.keys
                 )
                 self.train_set = MultiModalDataset([self.video_set]*self.repeat_num, [self.audio_set])
             self.val_set = create_dataset(self.val_configs, random_crop=False)
@@ -176,16 +216,32 @@ class DataModule(L.LightningDataModule):
             self.test_set = create_dataset(self.test_configs, random_crop=False)
 
     def train_dataloader(self):
+        if self.dataset_type == 'video_feature_wds':
+            # batches are collated inside the pipeline
+            return wds.WebLoader(self.train_set, batch_size=None, num_workers=self.num_workers,
+                                 persistent_workers=self.num_workers > 0, pin_memory=True)
+        if self.bucket_by_duration:
+            return self.bucketed_dataloader(self.train_set, self.batch_size, shuffle=True, drop_last=True,
+                                            persistent_workers=True, pin_memory=True)
         return DataLoader(self.train_set, self.batch_size, shuffle=True,
                                 num_workers=self.num_workers, persistent_workers=True, pin_memory=True, drop_last=True, collate_fn=collation_fn)
 
     def val_dataloader(self):
         return DataLoader(self.val_set, self.batch_size, shuffle=False,
-                                num_workers=self.num_workers, persistent_workers=False, pin_memory=False, drop_last=False, collate_fn=collation_fn)
+                                num_workers=self.num_workers, persistent_workers=False, pin_memory=torch.cuda.is_available(), drop_last=False, collate_fn=collation_fn)
 
     def predict_dataloader(self):
+        if self.bucket_by_duration:
+            return self.bucketed_dataloader(self.test_set, self.test_batch_size, shuffle=False, drop_last=False,
+                                            persistent_workers=False, pin_memory=torch.cuda.is_available())
         return DataLoader(self.test_set, batch_size=self.test_batch_size, shuffle=False,
-                                num_workers=self.num_workers, persistent_workers=False, pin_memory=False, drop_last=False, collate_fn=collation_fn)
+                                num_workers=self.num_workers, persistent_workers=False, pin_memory=torch.cuda.is_available(), drop_last=False, collate_fn=collation_fn)
+
+    def bucketed_dataloader(self, dataset, batch_size, shuffle, drop_last, **kwargs):
+        assert hasattr(dataset, "sample_lengths"), f"bucket_by_duration is not supported by {type(dataset).__name__}"
+        batch_sampler = DurationBucketBatchSampler(dataset.sample_lengths(), batch_size, shuffle=shuffle, drop_last=drop_last)
+        return DataLoader(dataset, batch_sampler=batch_sampler, num_workers=self.num_workers,
+                          collate_fn=collation_fn, **kwargs)
 
     # def predict_dataloader(self):
     #     return DataLoader(self.mnist_predict, batch_size=self.batch_size)
@@ -19,6 +19,9 @@ from torchaudio import transforms as T
 from typing import Optional, Callable, List
 import bisect
 
+from .batch import BatchedMetadata
+from .manifest import DatasetManifest, scan_files
+from .packed import PackedShards, is_packed
 from .utils import FOA, Stereo, Mono, PhaseFlipper, PadCrop_Normalized_T, PadCrop_Video_Normalized_T, PadCrop_Video_Hiera_Normalized_T, PadCrop_Video_Image_Normalized_T, PadCrop_DualVideo_Normalized_T
 
 AUDIO_KEYS = ("flac", "wav", "mp3", "m4a", "ogg", "opus")
@@ -103,11 +106,8 @@ def get_audio_filenames(
     if type(paths) is str:
         paths = [paths]
     for path in paths:               # get a list of relevant filenames
-        if keywords is not None:
-            subfolders, files = keyword_scandir(path, exts, keywords)
-        else:
-            subfolders, files = fast_scandir(path, exts)
-        filenames.extend(files)
+        # cached listing validated from directory mtimes, see manifest.py
+        filenames.extend(scan_files(path, exts, keywords=keywords))
     return filenames
 
 class LocalDatasetConfig:
@@ -126,6 +126,85 @@ class LocalDatasetConfig:
         self.audio_dir = audio_dir
         self.custom_metadata_fn = custom_metadata_fn
         self.extra_cot = extra_cot
+
+# features stored as bfloat16 (extract_latents.py --storage_dtype) are int16 bits listed in this member
+BFLOAT16_KEYS = "bfloat16_keys"
+
+def restore_feature_dtypes(data):
+    """Features stored in 16 bit (float16, or bfloat16 bits) as float32 tensors, as models and conditioners expect."""
+    bfloat16_keys = data.pop(BFLOAT16_KEYS, ())
+    if isinstance(bfloat16_keys, np.ndarray):
+        bfloat16_keys = bfloat16_keys.tolist()
+    for key, value in data.items():
+        if not isinstance(value, torch.Tensor):
+            continue
+        if key in bfloat16_keys:
+            data[key] = value.view(torch.bfloat16).float()
+        elif value.dtype in (torch.float16, torch.bfloat16):
+            data[key] = value.float()
+    return data
+
+def load_npz(filename, keys=None):
+    """
+    Reads the arrays of a feature npz, only the members in keys when given. Members are
+    decompressed on access, so unselected features are never read.
+    """
+    with np.load(filename, allow_pickle=True) as npz_data:
+        data = {key: npz_data[key] for key in npz_data.files if keys is None or key in keys or key == BFLOAT16_KEYS}
+    for key in data.keys():
+        if isinstance(data[key], np.ndarray) and np.issubdtype(data[key].dtype, np.number):
+            data[key] = torch.from_numpy(data[key])
+    return restore_feature_dtypes(data)
+
+def load_pth(filename, keys=None):
+    """Loads a feature dict saved with torch.save, memory-mapped so the tensors of unselected keys are never read."""
+    data = torch.load(filename, weights_only=False, mmap=True)
+    return restore_feature_dtypes({key: value for key, value in data.items() if keys is None or key in keys})
+
+def open_packed(config, keys=None):
+    """
+    Opens a packed dataset directory (see data/packed.py and pack_npz_features.py).
+    Returns the shards and the indices of the samples listed in config.split_path (all when unset).
+    """
+    shards = PackedShards(config.path, fields=None if keys is None else set(keys) | {BFLOAT16_KEYS})
+    if config.split_path and os.path.exists(config.split_path):
+        with open(config.split_path, 'r') as f:
+            # split files list npz names, ids are the stems
+            split_ids = [Path(line.strip()).stem for line in f if line.strip()]
+        missing = [i for i in split_ids if i not in shards]
+        if missing:
+            print(f'{len(missing)} ids of {config.split_path} are not in {config.path}')
+        indices = np.asarray([shards.id_to_index[i] for i in split_ids if i in shards], dtype=np.int64)
+    else:
+        indices = np.arange(len(shards), dtype=np.int64)
+    return shards, indices
+
+def packed_to_torch(sample):
+    """Wraps the numeric arrays of a packed sample as tensors, sharing memory with the mapped shard."""
+    return restore_feature_dtypes({key: torch.from_numpy(value) if isinstance(value, np.ndarray) and np.issubdtype(value.dtype, np.number) else value
+                                   for key, value in sample.items()})
+
+class PackedSources:
+    """Samples of several packed directories behind one index, the packed part of a dataset."""
+    def __init__(self, keys=None):
+        self.keys = keys
+        self.sources = []
+        self.cumulative_sizes = []
+
+    def add(self, config):
+        shards, indices = open_packed(config, self.keys)
+        self.sources.append((shards, indices))
+        self.cumulative_sizes.append(len(self) + len(indices))
+
+    def __len__(self):
+        return self.cumulative_sizes[-1] if self.cumulative_sizes else 0
+
+    def __getitem__(self, idx):
+        source = bisect.bisect_right(self.cumulative_sizes, idx)
+        start = self.cumulative_sizes[source - 1] if source > 0 else 0
+        shards, indices = self.sources[source]
+        return shards.root, packed_to_torch(shards[int(indices[idx - start])])
+
 class SampleDataset(torch.utils.data.Dataset):
     def __init__(
         self, 
@@ -275,10 +354,14 @@ class LatentDataset(torch.utils.data.Dataset):
         random_crop=True,
         input_type="prompt",
         fps=4,
-        force_channels="stereo"
+        force_channels="stereo",
+        keys=None,
     ):
         super().__init__()
         self.filenames = []
+        # metadata keys the model consumes (see get_conditioning_keys), None loads every stored feature
+        self.keys = None if keys is None else set(keys) | {'latent'}
+        self.packed = PackedSources(self.keys)
 
         self.augs = torch.nn.Sequential(
             PhaseFlipper(),
@@ -299,6 +382,9 @@ class LatentDataset(torch.utils.data.Dataset):
         self.sr = sample_rate
         for config in configs:
             self.root_paths.append(config.path)
+            if is_packed(config.path):
+                self.packed.add(config)
+                continue
             def add_prefix(s):
                 return str(os.path.join(config.path,f'{s.strip()}'))
             with open(config.split_path,'r') as f:
@@ -308,33 +394,39 @@ class LatentDataset(torch.utils.data.Dataset):
             # self.filenames.extend(get_audio_filenames(config.path, keywords))
             
 
-        print(f'Found {len(self.filenames)} files')
+        print(f'Found {len(self.filenames)} files, {len(self.packed)} packed samples')
 
     def load_file(self, filename, info):
         # try:
         npz_file = filename.replace('.pth','.npz')
         if os.path.exists(filename) and '.npz' not in filename:
-            data = torch.load(filename, weights_only=False)
+            data = load_pth(filename, self.keys)
         elif os.path.exists(npz_file): 
             # print(filename)
-            npz_data = np.load(npz_file,allow_pickle=True)
-            data = {key: npz_data[key] for key in npz_data.files}
-            # print("data.keys()",data.keys())
-            for key in data.keys():
-                if isinstance(data[key], np.ndarray) and np.issubdtype(data[key].dtype, np.number):
-                    data[key] = torch.from_numpy(data[key])
+            data = load_npz(npz_file, self.keys)
         else:
             raise ValueError(f'error load file: {filename}')
         info.update(data)
         audio = data['latent']
         # except:
         #     print(f'error load file: {filename}')
-        return audio, info['metaclip_features']
+        return audio, info.get('metaclip_features')
+
+    def load_packed(self, idx, info):
+        root, data = self.packed[idx]
+        info.update(data)
+        info["path"] = os.path.join(root, data['id'])
+        info["relpath"] = data['id']
+        return data['latent'], info.get('metaclip_features')
 
     def __len__(self):
-        return len(self.filenames)
+        return len(self.filenames) + len(self.packed)
 
     def __getitem__(self, idx):
+        if idx >= len(self.filenames):
+            info = {}
+            audio, video = self.load_packed(idx - len(self.filenames), info)
+            return (audio, info)
         audio_filename = self.filenames[idx]
         assert os.path.exists(audio_filename) or audio_filename.replace('.pth','.npz'), f'{audio_filename}: file not exists'
         # try:
@@ -360,10 +452,13 @@ class AudioDataset(torch.utils.data.Dataset):
         random_crop=True,
         input_type="prompt",
         fps=4,
-        force_channels="stereo"
+        force_channels="stereo",
+        keys=None,
     ):
         super().__init__()
         self.filenames = []
+        # metadata keys the model consumes, the video features are replaced by placeholders below and never loaded
+        self.keys = None if keys is None else (set(keys) | {'latent'}) - {'metaclip_features', 'sync_features'}
 
         self.augs = torch.nn.Sequential(
             PhaseFlipper(),
@@ -402,15 +497,10 @@ class AudioDataset(torch.utils.data.Dataset):
         # try:
         npz_file = filename.replace('.pth','.npz')
         if os.path.exists(filename) and '.npz' not in filename:
-            data = torch.load(filename, weights_only=False)
+            data = load_pth(filename, self.keys)
         elif os.path.exists(npz_file): 
             # print(filename)
-            npz_data = np.load(npz_file,allow_pickle=True)
-            data = {key: npz_data[key] for key in npz_data.files}
-            # print("data.keys()",data.keys())
-            for key in data.keys():
-                if isinstance(data[key], np.ndarray) and np.issubdtype(data[key].dtype, np.number):
-                    data[key] = torch.from_numpy(data[key])
+            data = load_npz(npz_file, self.keys)
         else:
             raise ValueError(f'error load file: {filename}')
         info.update(data)
@@ -420,7 +510,7 @@ class AudioDataset(torch.utils.data.Dataset):
         info['video_exist'] = self.video_exist
         # except:
         #     print(f'error load file: {filename}')
-        return audio, info['metaclip_features']
+        return audio, info.get('metaclip_features')
 
     def __len__(self):
         return len(self.filenames)
@@ -442,6 +532,11 @@ class AudioDataset(torch.utils.data.Dataset):
         return (audio, info)
 
 class VideoDataset(torch.utils.data.Dataset):
+    # feature rates of extract_latents.py: 8 fps MetaCLIP frames, 24 fps Synchformer tokens, 44100 / 2048 VAE latents
+    CLIP_FPS = 8
+    SYNC_FPS = 24
+    LATENTS_PER_SECOND = 44100 / 2048
+
     def __init__(
         self, 
         configs,
@@ -453,10 +548,14 @@ class VideoDataset(torch.utils.data.Dataset):
         fps=4,
         force_channels="stereo",
         latent_length=194,  # default latent length for video dataset
+        keys=None,
     ):
         self.latent_length = latent_length
         super().__init__()
         self.filenames = []
+        # metadata keys the model consumes (see get_conditioning_keys), None loads every stored feature
+        self.keys = None if keys is None else set(keys) | {'latent'}
+        self.packed = PackedSources(self.keys)
         print(f'configs: {configs[0]}')
         if configs[0].extra_cot is not None:
             self.extra_cot = configs[0].extra_cot
@@ -483,6 +582,9 @@ class VideoDataset(torch.utils.data.Dataset):
         self.video_exist = torch.tensor(1, dtype=torch.bool)
         for config in configs:
             self.root_paths.append(config.path)
+            if is_packed(config.path):
+                self.packed.add(config)
+                continue
             def add_prefix(s):
                 return str(os.path.join(config.path,f'{s.strip()}'))
             if config.split_path and os.path.exists(config.split_path):
@@ -490,55 +592,99 @@ class VideoDataset(torch.utils.data.Dataset):
                     item_names = [line.strip() for line in f if line.strip()]
             else:
                 item_names = [
-                    os.path.splitext(f)[0]+".npz"
-                    for f in os.listdir(config.path)
-                    if os.path.isfile(os.path.join(config.path, f))
+                    Path(f).stem+".npz"
+                    for f in scan_files(config.path, recursive=False)
                 ]
             filenames = list(map(add_prefix, item_names))
             self.filenames.extend(filenames) 
             # self.filenames.extend(get_audio_filenames(config.path, keywords))
             
 
-        print(f'Found {len(self.filenames)} files')
+        print(f'Found {len(self.filenames)} files, {len(self.packed)} packed samples')
 
     def load_file(self, filename, info):
         # try:
         npz_file = filename.replace('.pth','.npz')
         if os.path.exists(filename) and '.npz' not in filename:
-            data = torch.load(filename, weights_only=False)
+            data = load_pth(filename, self.keys)
         elif os.path.exists(npz_file): 
             # print(filename)
-            npz_data = np.load(npz_file,allow_pickle=True)
-            data = {key: npz_data[key] for key in npz_data.files}
-            # print("data.keys()",data.keys())
-            for key in data.keys():
-                if isinstance(data[key], np.ndarray) and np.issubdtype(data[key].dtype, np.number):
-                    data[key] = torch.from_numpy(data[key])
-            if self.extra_cot is not None:
-                extra_pth = filename.replace('.npz','.pth')
-                extra_pth = os.path.join(self.extra_cot, os.path.basename(extra_pth))
-                if os.path.exists(extra_pth):
-                    extra_data = torch.load(extra_pth, weights_only=False)
-                    for key in extra_data.keys():
-                        if isinstance(extra_data[key], torch.Tensor):
-                            # print(f'load extra cot {key}')
-                            data[key] = extra_data[key]
+            data = load_npz(npz_file, self.keys)
+            self.load_extra_cot(data, Path(filename).stem)
         else:
             raise ValueError(f'error load file: {filename}')
+        return self.finish_sample(data, info)
+
+    def load_extra_cot(self, data, sample_id):
+        if self.extra_cot is not None:
+            extra_pth = os.path.join(self.extra_cot, f'{sample_id}.pth')
+            if os.path.exists(extra_pth):
+                extra_data = load_pth(extra_pth, self.keys)
+                for key in extra_data.keys():
+                    if isinstance(extra_data[key], torch.Tensor):
+                        # print(f'load extra cot {key}')
+                        data[key] = extra_data[key]
+
+    def finish_sample(self, data, info):
         info.update(data)
         if 'latent' in data.keys():
             audio = data['latent']
+        elif 'metaclip_features' in data.keys():
+            # no latents (inference), the length follows the clip duration
+            audio = torch.zeros(64,self.latent_length_for(data['metaclip_features'].shape[0]))
         else:
             audio = torch.zeros(64,self.latent_length)
         info['video_exist'] = self.video_exist
         # except:
         #     print(f'error load file: {filename}')
-        return audio, info['metaclip_features']
+        return audio, info.get('metaclip_features')
+
+    def latent_length_for(self, clip_length):
+        return round(self.LATENTS_PER_SECOND * clip_length / self.CLIP_FPS)
+
+    def sample_lengths(self):
+        """
+        The (latent, clip, sync) sequence lengths of every sample, for DurationBucketBatchSampler. Taken from the
+        feature shapes cached in the dataset manifests and the packed shard manifests, no feature is read.
+        """
+        default = (self.latent_length, round(self.latent_length / self.LATENTS_PER_SECOND * self.CLIP_FPS),
+                   round(self.latent_length / self.LATENTS_PER_SECOND * self.SYNC_FPS))
+
+        def lengths(latent_shape, clip_shape, sync_shape):
+            clip = clip_shape[0] if clip_shape else default[1]
+            sync = sync_shape[0] if sync_shape else default[2]
+            latent = latent_shape[-1] if latent_shape else (self.latent_length_for(clip) if clip_shape else default[0])
+            return (latent, clip, sync)
+
+        result = []
+        manifests = {}
+        for filename in self.filenames:
+            root = os.path.dirname(filename)
+            if root not in manifests:
+                manifests[root] = DatasetManifest(root).refresh()
+            info = manifests[root].info(filename.replace('.pth', '.npz')) or {}
+            shapes = info.get('shapes') or {}
+            result.append(lengths(shapes.get('latent'), shapes.get('metaclip_features'), shapes.get('sync_features')))
+        for shards, indices in self.packed.sources:
+            for idx in indices:
+                result.append(lengths(*(shards.field_shape(idx, field) for field in ('latent', 'metaclip_features', 'sync_features'))))
+        return result
+
+    def load_packed(self, idx, info):
+        root, data = self.packed[idx]
+        self.load_extra_cot(data, data['id'])
+        info["path"] = os.path.join(root, data['id'])
+        info["relpath"] = data['id']
+        return self.finish_sample(data, info)
 
     def __len__(self):
-        return len(self.filenames)
+        return len(self.filenames) + len(self.packed)
 
     def __getitem__(self, idx):
+        if idx >= len(self.filenames):
+            info = {}
+            audio, video = self.load_packed(idx - len(self.filenames), info)
+            return (audio, info)
         audio_filename = self.filenames[idx]
         assert os.path.exists(audio_filename) or audio_filename.replace('.pth','.npz'), f'{audio_filename}: file not exists'
         # try:
@@ -950,7 +1096,7 @@ class LocalWebDatasetConfig:
 
     def load_data_urls(self):
 
-        self.urls = fast_scandir(self.path, ["tar"])[1]
+        self.urls = scan_files(self.path, ["tar"])
 
         return self.urls
 
@@ -973,6 +1119,9 @@ def collation_fn(samples):
                 b = torch.stack(b)
             elif isinstance(b[0], np.ndarray):
                 b = np.array(b)
+            elif isinstance(b[0], dict):
+                # metadata, stacked per key here in the worker
+                b = BatchedMetadata(b)
             else:
                 b = b
             result.append(b)
@@ -1090,6 +1239,71 @@ class WebDatasetDataLoader():
         
         return sample
 
+class VideoFeatureWebDataset():
+    """
+    Streams pre-extracted video features and latents from tar shards written by
+    pack_npz_features.py --format wds, the sharded counterpart of VideoDataset (same samples).
+
+    A sample is {key}.{field}.npy per array plus {key}.json with the id and the strings. Shards
+    are drawn at random (resampled) or shuffled and split across nodes and workers, samples go
+    through a shuffle buffer and batches are collated in the workers.
+    """
+    def __init__(
+        self,
+        datasets: List[S3DatasetConfig],
+        batch_size,
+        num_workers=8,
+        epoch_steps=2000,
+        shuffle_buffer=1000,
+        resampled=True,
+        keys=None,
+        latent_length=194,
+    ):
+        self.datasets = datasets
+        self.latent_length = latent_length
+        # metadata keys the model consumes (see get_conditioning_keys), other arrays are dropped before decoding
+        self.keys = None if keys is None else set(keys) | {'latent'}
+        self.video_exist = torch.tensor(1, dtype=torch.bool)
+
+        urls = [url for dataset in datasets for url in dataset.load_data_urls()]
+        random.shuffle(urls)
+
+        if resampled:
+            # every worker draws shards at random, no split needed across nodes and workers
+            shards = [wds.ResampledShards(urls)]
+        else:
+            shards = [wds.SimpleShardList(urls), wds.shuffle(len(urls)), wds.split_by_node, wds.split_by_worker]
+
+        self.dataset = wds.DataPipeline(
+            *shards,
+            wds.tarfile_to_samples(handler=log_and_continue),
+            wds.shuffle(bufsize=shuffle_buffer, initial=shuffle_buffer),
+            wds.map(self.select_fields),
+            wds.decode(handler=log_and_continue),
+            wds.map(self.wds_preprocess, handler=log_and_continue),
+            wds.batched(batch_size, partial=False, collation_fn=collation_fn),
+        ).with_epoch(epoch_steps//num_workers if num_workers > 0 else epoch_steps)
+
+    def select_fields(self, sample):
+        if self.keys is None:
+            return sample
+        return {k: v for k, v in sample.items() if not k.endswith(".npy") or k[:-len(".npy")] in self.keys}
+
+    def wds_preprocess(self, sample):
+        info = dict(sample.get("json", {}))
+        for k, v in sample.items():
+            if k.endswith(".npy"):
+                info[k[:-len(".npy")]] = torch.from_numpy(v)
+        restore_feature_dtypes(info)
+        if 'latent' in info:
+            audio = info['latent']
+        else:
+            audio = torch.zeros(64, self.latent_length)
+        info['video_exist'] = self.video_exist
+        info["path"] = sample["__url__"]
+        info["relpath"] = sample["__key__"]
+        return (audio, info)
+
 def create_dataloader_from_config(dataset_config, batch_size, sample_size, sample_rate, audio_channels=2, num_workers=4):
 
     dataset_type = dataset_config.get("dataset_type", None)
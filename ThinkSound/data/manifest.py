@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+log = logging.getLogger()
+
+# A manifest caches the file listing of a dataset root (size, mtime and, for audio and feature files, the
+# duration and array shapes) so launches do not rescan the tree. It is validated from directory mtimes:
+# a directory whose mtime is unchanged has the same entries, so only the directories themselves are
+# stat'ed and only changed ones are listed again. Files rewritten in place under the same name do not
+# change the directory mtime, call refresh(full=True) (or delete the manifest) after such edits.
+# Manifests live outside the dataset (writing into the root would change its mtime), one file per root
+# under THINKSOUND_MANIFEST_DIR, ~/.cache/thinksound/manifests by default.
+
+MANIFEST_VERSION = 1
+AUDIO_INFO_EXTS = (".wav", ".mp3", ".flac", ".ogg", ".aif", ".opus", ".m4a")
+MANIFEST_DIR = os.environ.get("THINKSOUND_MANIFEST_DIR",
+                              os.path.join(os.path.expanduser("~"), ".cache", "thinksound", "manifests"))
+
+
+def audio_duration(path: str) -> Optional[float]:
+    try:
+        from pedalboard.io import AudioFile
+        with AudioFile(path) as f:
+            return f.frames / f.samplerate
+    except Exception:
+        return None
+
+
+def npz_shapes(path: str) -> Optional[Dict[str, list]]:
+    """Array shapes of an npz from the member headers, without reading or decompressing the data."""
+    try:
+        shapes = {}
+        with zipfile.ZipFile(path) as zf:
+            for name in zf.namelist():
+                if not name.endswith(".npy"):
+                    continue
+                with zf.open(name) as f:
+                    version = np.lib.format.read_magic(f)
+                    if version == (1, 0):
+                        shape, _, _ = np.lib.format.read_array_header_1_0(f)
+                    else:
+                        shape, _, _ = np.lib.format.read_array_header_2_0(f)
+                shapes[name[:-len(".npy")]] = list(shape)
+        return shapes
+    except Exception:
+        return None
+
+
+def file_info(path: str) -> Optional[dict]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in AUDIO_INFO_EXTS:
+        return {"duration": audio_duration(path)}
+    if ext == ".npz":
+        return {"shapes": npz_shapes(path)}
+    return None
+
+
+class DatasetManifest:
+    """
+    Cached recursive listing of a dataset root.
+
+    Directories are listed and new files are inspected with a thread pool of num_threads (file
+    system calls release the GIL).
+    """
+    def __init__(self, root: str, num_threads: int = 16, manifest_path: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.num_threads = num_threads
+        self.manifest_path = manifest_path or os.path.join(
+            MANIFEST_DIR, f"{os.path.basename(self.root)}-{hashlib.sha1(self.root.encode()).hexdigest()[:16]}.json")
+        # relative directory -> {"mtime_ns", "subdirs": [names], "files": {name: [size, mtime_ns, info]}}
+        self.dirs: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if manifest.get("version") == MANIFEST_VERSION and manifest.get("root") == self.root:
+            self.dirs = manifest["dirs"]
+
+    def _save(self) -> None:
+        manifest = {"version": MANIFEST_VERSION, "root": self.root, "dirs": self.dirs}
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, separators=(",", ":"))
+            # atomic, concurrent ranks building the same manifest do not corrupt it
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            log.warning(f"Could not store the manifest of {self.root}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _scan_dir(self, rel_dir: str, full: bool) -> tuple:
+        """Returns (rel_dir, entry, files needing info, changed) for one directory."""
+        path = os.path.join(self.root, rel_dir)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return rel_dir, None, [], True
+        cached = self.dirs.get(rel_dir)
+        if cached is not None and cached["mtime_ns"] == mtime_ns and not full:
+            return rel_dir, cached, [], False
+
+        cached_files = cached["files"] if cached is not None else {}
+        entry = {"mtime_ns": mtime_ns, "subdirs": [], "files": {}}
+        pending = []
+        try:
+            for f in os.scandir(path):
+                try:  # broken symlinks and permission errors are skipped, like fast_scandir
+                    if f.is_dir():
+                        entry["subdirs"].append(f.name)
+                    elif f.is_file():
+                        stat = f.stat()
+                        previous = cached_files.get(f.name)
+                        if previous is not None and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+                            entry["files"][f.name] = previous
+                        else:
+                            entry["files"][f.name] = [stat.st_size, stat.st_mtime_ns, None]
+                            pending.append(f.name)
+                except OSError:
+                    pass
+        except OSError:
+            pass
+        entry["subdirs"].sort()
+        return rel_dir, entry, pending, True
+
+    def refresh(self, full: bool = False, recursive: bool = True) -> "DatasetManifest":
+        """
+        Brings the manifest up to date with the directory tree and stores it if anything changed. With
+        recursive=False only the root is listed; the cached subdirectories are kept as they are.
+        """
+        dirs = {}
+        changed = False
+        with ThreadPoolExecutor(self.num_threads) as pool:
+            level = [""]
+            pending_files = []
+            while level:
+                next_level = []
+                for rel_dir, entry, pending, dir_changed in pool.map(lambda d: self._scan_dir(d, full), level):
+                    changed |= dir_changed
+                    if entry is None:
+                        continue
+                    dirs[rel_dir] = entry
+                    pending_files.extend((rel_dir, name) for name in pending)
+                    if recursive:
+                        next_level.extend(os.path.join(rel_dir, name) for name in entry["subdirs"])
+                level = next_level
+            if not recursive:
+                # neither listed nor dropped, the next recursive refresh validates them
+                dirs.update((rel_dir, entry) for rel_dir, entry in self.dirs.items() if rel_dir not in dirs)
+            changed |= set(dirs) != set(self.dirs)
+
+            paths = [os.path.join(self.root, rel_dir, name) for rel_dir, name in pending_files]
+            for (rel_dir, name), info in zip(pending_files, pool.map(file_info, paths)):
+                dirs[rel_dir]["files"][name][2] = info
+
+        if changed:
+            log.info(f"Updated the manifest of {self.root}: {sum(len(d['files']) for d in dirs.values())} files, "
+                     f"{len(pending_files)} new or modified")
+            self.dirs = dirs
+            self._save()
+        return self
+
+    def files(self, exts: Optional[List[str]] = None, keywords: Optional[List[str]] = None,
+              recursive: bool = True) -> List[str]:
+        """
+        Sorted absolute paths of the files under root. With exts, only those extensions and no hidden
+        files; with keywords, only names containing one of them (case insensitive), as keyword_scandir.
+        """
+        if exts is not None:
+            exts = tuple(('.' + x if x[0] != '.' else x).lower() for x in exts)
+        if keywords is not None:
+            keywords = [keyword.lower() for keyword in keywords]
+        banned_words = ["paxheader", "__macosx"]
+        paths = []
+        for rel_dir, entry in self.dirs.items():
+            if not recursive and rel_dir != "":
+                continue
+            for name in entry["files"]:
+                name_lower = name.lower()
+                if exts is not None and (not name_lower.endswith(exts) or name.startswith(".")):
+                    continue
+                if keywords is not None and (not any(k in name_lower for k in keywords)
+                                             or any(b in name_lower for b in banned_words)):
+                    continue
+                paths.append(os.path.join(self.root, rel_dir, name))
+        return sorted(paths)
+
+    def info(self, path: str) -> Optional[dict]:
+        """Size, mtime_ns and the cached duration or feature shapes of a file in the manifest."""
+        rel_dir, name = os.path.split(os.path.relpath(os.path.abspath(path), self.root))
+        entry = self.dirs.get(rel_dir, {}).get("files", {}).get(name)
+        if entry is None:
+            return None
+        size, mtime_ns, info = entry
+        return {"size": size, "mtime_ns": mtime_ns, **(info or {})}
+
+
+def scan_files(root: str, exts: Optional[List[str]] = None, keywords: Optional[List[str]] = None,
+               recursive: bool = True) -> List[str]:
+    """Files under root from its validated manifest, a drop-in for fast_scandir / keyword_scandir listings."""
+    return DatasetManifest(root).refresh(recursive=recursive).files(exts, keywords=keywords, recursive=recursive)
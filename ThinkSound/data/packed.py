@@ -0,0 +1,232 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+log = logging.getLogger()
+
+# Shard layout under a packed dataset directory:
+#   {prefix}-{index:05d}/{field}.npy   one array per field, samples stacked along dim 0 (memory-mappable)
+#   {prefix}-{index:05d}/{field}.json  string fields (e.g. captions), one entry per row
+#   {prefix}-{index:05d}/ids.json      sample ids in row order
+#   manifest-{prefix}.jsonl            one line per finished shard, appended after the shard is in place
+# Shards are written to a .tmp directory and renamed, so a shard listed in a manifest is always complete
+# (a shard renamed into place but not yet listed is removed when its writer resumes).
+# Every writer (e.g. one per rank) uses its own prefix and manifest, readers merge all manifests.
+
+MANIFEST_PATTERN = "manifest-*.jsonl"
+
+
+def read_manifests(root: str) -> List[dict]:
+    """Returns the entries of all manifests under root, skipping a truncated last line."""
+    entries = []
+    for manifest in sorted(glob.glob(os.path.join(root, MANIFEST_PATTERN))):
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    log.warning(f"Skipping incomplete manifest line in {manifest}")
+    return entries
+
+
+def completed_ids(root: str) -> set:
+    """Ids already stored in finished shards, used to resume a partial run."""
+    return {sample_id for entry in read_manifests(root) for sample_id in entry["ids"]}
+
+
+def is_packed(root: str) -> bool:
+    """True if root is a packed dataset directory rather than a directory of per-sample files."""
+    return os.path.isdir(root) and bool(glob.glob(os.path.join(root, MANIFEST_PATTERN)))
+
+
+def _is_string(value) -> bool:
+    return isinstance(value, str) or (isinstance(value, np.ndarray) and value.dtype.kind in "USO")
+
+
+def _signature(fields: dict) -> dict:
+    return {name: "str" if _is_string(value) else (np.shape(value), np.asarray(value).dtype.str)
+            for name, value in fields.items()}
+
+
+class PackedShardWriter:
+    """
+    Buffers samples and writes them as packed shards of shard_size samples.
+
+    Array fields are stacked, so a sample whose fields differ from the buffered ones in name, shape or
+    dtype starts a new shard (pad variable length data and store a mask field to keep shards full).
+    String fields (str or numpy string arrays, as np.savez stores captions) are kept as JSON.
+    Resuming continues the shard numbering of the prefix and removes shards left unfinished or
+    unlisted by an interrupted run (their samples are not in completed_ids, so they are written again).
+    """
+    def __init__(self, root: str, prefix: str = "shard", shard_size: int = 1024):
+        self.root = root
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.manifest_path = os.path.join(root, f"manifest-{prefix}.jsonl")
+        os.makedirs(root, exist_ok=True)
+
+        for stale in glob.glob(os.path.join(root, f"{prefix}-*.tmp")):
+            log.info(f"Removing unfinished shard {stale}")
+            shutil.rmtree(stale)
+
+        written = [entry["shard"] for entry in read_manifests(root) if entry["shard"].startswith(f"{prefix}-")]
+        # a crash between the rename of a shard and its manifest line leaves a shard no reader knows about,
+        # and the resumed numbering would try to rename onto it
+        shard_name = re.compile(rf"{re.escape(prefix)}-\d+")
+        for entry in os.scandir(root):
+            if entry.is_dir() and shard_name.fullmatch(entry.name) and entry.name not in written:
+                log.info(f"Removing shard {entry.path}, missing from the manifest")
+                shutil.rmtree(entry.path)
+        self.shard_index = max((int(name.rsplit("-", 1)[1]) + 1 for name in written), default=0)
+        self._ids: List[str] = []
+        self._fields: Dict[str, list] = {}
+        self._signature: Optional[dict] = None
+
+    def add(self, sample_id: str, **fields: Union[np.ndarray, str]) -> None:
+        signature = _signature(fields)
+        if self._ids and signature != self._signature:
+            self.flush()
+        self._signature = signature
+        self._ids.append(sample_id)
+        for name, value in fields.items():
+            if _is_string(value):
+                value = value if isinstance(value, str) else value.tolist()
+            else:
+                value = np.asarray(value)
+            self._fields.setdefault(name, []).append(value)
+        if len(self._ids) >= self.shard_size:
+            self.flush()
+
+    def flush(self) -> Optional[str]:
+        """Writes the buffered samples as a shard and records it in the manifest."""
+        if not self._ids:
+            return None
+        name = f"{self.prefix}-{self.shard_index:05d}"
+        tmp_dir = os.path.join(self.root, f"{name}.tmp")
+        os.makedirs(tmp_dir)
+
+        fields = {}
+        for field, values in self._fields.items():
+            if self._signature[field] == "str":
+                with open(os.path.join(tmp_dir, f"{field}.json"), "w") as f:
+                    json.dump(values, f)
+                fields[field] = {"dtype": "str"}
+                continue
+            array = np.stack(values)
+            np.save(os.path.join(tmp_dir, f"{field}.npy"), array)
+            fields[field] = {"shape": list(array.shape[1:]), "dtype": array.dtype.str}
+        with open(os.path.join(tmp_dir, "ids.json"), "w") as f:
+            json.dump(self._ids, f)
+
+        os.rename(tmp_dir, os.path.join(self.root, name))
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps({"shard": name, "ids": self._ids, "fields": fields}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.shard_index += 1
+        self._ids = []
+        self._fields = {}
+        return name
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # an exception leaves the buffered samples unwritten, they are redone on resume
+        if exc[0] is None:
+            self.close()
+
+
+class PackedShards:
+    """
+    Random access to the samples of a packed dataset directory by index or id.
+
+    Shard arrays are memory-mapped on first access, so opening is cheap and every DataLoader
+    worker shares the page cache instead of holding its own copy. A sample is a view into the
+    mapping (no decompression or copy until collation). The index is an array of shard offsets
+    and a fixed-width id array, which stays small and is not duplicated by copy-on-write in
+    forked workers the way per-sample Python objects are.
+    """
+    def __init__(self, root: str, fields: Optional[Iterable[str]] = None):
+        self.root = root
+        self.fields = set(fields) if fields is not None else None
+        self.shards: List[str] = []
+        self.shard_fields: List[dict] = []
+        ids = []
+        offsets = [0]
+        for entry in read_manifests(root):
+            self.shards.append(entry["shard"])
+            self.shard_fields.append(entry["fields"])
+            ids.extend(entry["ids"])
+            offsets.append(len(ids))
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=str)
+        self._id_to_index: Optional[Dict[str, int]] = None
+        self._arrays: Dict[int, Dict[str, Union[np.ndarray, list]]] = {}
+        log.info(f"Found {len(self.ids)} packed samples in {len(self.shards)} shards under {root}")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _shard_arrays(self, shard: int) -> Dict[str, Union[np.ndarray, list]]:
+        arrays = self._arrays.get(shard)
+        if arrays is None:
+            shard_dir = os.path.join(self.root, self.shards[shard])
+            arrays = {}
+            for name, spec in self.shard_fields[shard].items():
+                if self.fields is not None and name not in self.fields:
+                    continue
+                if spec["dtype"] == "str":
+                    with open(os.path.join(shard_dir, f"{name}.json")) as f:
+                        arrays[name] = json.load(f)
+                else:
+                    # copy-on-write mapping: rows are writable views (torch.from_numpy does not warn),
+                    # pages are only copied if a sample is modified in place
+                    arrays[name] = np.load(os.path.join(shard_dir, f"{name}.npy"), mmap_mode="c")
+            self._arrays[shard] = arrays
+        return arrays
+
+    def locate(self, idx: int) -> tuple:
+        """(shard, row) of the sample at idx."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Sample index {idx} out of range for {len(self)} samples")
+        shard = bisect.bisect_right(self.offsets, idx) - 1
+        return shard, idx - int(self.offsets[shard])
+
+    def field_shape(self, idx: int, field: str) -> Optional[list]:
+        """Per-sample shape of an array field from the manifest, without mapping the shard."""
+        spec = self.shard_fields[self.locate(idx)[0]].get(field)
+        return spec.get("shape") if spec is not None else None
+
+    def __getitem__(self, idx: int) -> Dict[str, Union[np.ndarray, str]]:
+        shard, row = self.locate(idx)
+        sample = {name: np.asarray(array[row]) if isinstance(array, np.ndarray) else array[row]
+                  for name, array in self._shard_arrays(shard).items()}
+        sample["id"] = str(self.ids[idx])
+        return sample
+
+    @property
+    def id_to_index(self) -> Dict[str, int]:
+        # built on first lookup by id, plain index access does not need it
+        if self._id_to_index is None:
+            self._id_to_index = {str(sample_id): idx for idx, sample_id in enumerate(self.ids)}
+        return self._id_to_index
+
+    def get(self, sample_id: str) -> Dict[str, Union[np.ndarray, str]]:
+        return self[self.id_to_index[sample_id]]
+
+    def __contains__(self, sample_id: str) -> bool:
+        return sample_id in self.id_to_index
@@ -0,0 +1,86 @@
+import logging
+import math
+import random
+import typing as tp
+from collections import defaultdict
+
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+log = logging.getLogger()
+
+
+class DurationBucketBatchSampler(Sampler[tp.List[int]]):
+    """
+    Batches samples of equal (latent, clip, sync) sequence lengths, so mixed-duration data is batched without
+    padding and the model switches sequence lengths per batch (MMmodule.match_seq_lengths).
+
+    Every epoch the samples of each bucket are shuffled and cut into batches, then the batches of all buckets
+    are shuffled together. Under torch.distributed every rank takes a strided slice of the same batch order,
+    truncated to an equal number of batches so the ranks stay in step; with Lightning set
+    Trainer(use_distributed_sampler=False), the sampler does the sharding itself.
+
+    Args:
+        lengths: the (latent, clip, sync) lengths of every sample, e.g. VideoDataset.sample_lengths()
+        batch_size: samples per batch
+        shuffle: shuffle within buckets and the batch order
+        drop_last: drop the incomplete last batch of every bucket
+        seed: base seed, combined with the epoch set by set_epoch
+    """
+    def __init__(self, lengths: tp.Sequence[tp.Tuple[int, int, int]], batch_size: int, shuffle: bool = True,
+                 drop_last: bool = False, seed: int = 0, num_replicas: tp.Optional[int] = None, rank: tp.Optional[int] = None):
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+        self.buckets: tp.Dict[tuple, tp.List[int]] = defaultdict(list)
+        for idx, key in enumerate(lengths):
+            self.buckets[tuple(key)].append(idx)
+
+        # the latent frames spent on padding when every sample is padded to the longest one, as without buckets
+        total = sum(key[0] * len(indices) for key, indices in self.buckets.items())
+        longest = max((key[0] for key in self.buckets), default=0)
+        self.unbucketed_padding_ratio = 1 - total / (longest * len(lengths)) if total else 0.0
+        sizes = ", ".join(f"{key}: {len(indices)}" for key, indices in sorted(self.buckets.items()))
+        log.info(f"{len(self.buckets)} duration buckets (latent, clip, sync lengths: samples) {sizes}")
+        log.info(f"Bucketed batches need no padding, padding every sample to the longest one "
+                 f"would pad {self.unbucketed_padding_ratio:.1%} of the latent frames")
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _batches(self) -> tp.List[tp.List[int]]:
+        rng = random.Random(self.seed + self.epoch)
+        batches = []
+        for key in sorted(self.buckets):
+            indices = list(self.buckets[key])
+            if self.shuffle:
+                rng.shuffle(indices)
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start:start + self.batch_size]
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+                batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self) -> tp.Iterator[tp.List[int]]:
+        batches = self._batches()
+        per_rank = len(batches) // self.num_replicas if self.num_replicas > 1 else len(batches)
+        yield from batches[self.rank::self.num_replicas][:per_rank]
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            num_batches = sum(len(indices) // self.batch_size for indices in self.buckets.values())
+        else:
+            num_batches = sum(math.ceil(len(indices) / self.batch_size) for indices in self.buckets.values())
+        return num_batches // self.num_replicas if self.num_replicas > 1 else num_batches
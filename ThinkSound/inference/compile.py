@@ -0,0 +1,58 @@
+import os
+import logging
+from typing import Optional
+
+import torch
+from torch import nn
+
+log = logging.getLogger()
+
+
+def enable_compile_cache(cache_dir: Optional[str]) -> None:
+    """
+    Persists inductor/triton artifacts under cache_dir so a warm container skips recompilation.
+    Must run before the first compiled call. Existing environment overrides are respected.
+    """
+    if not cache_dir:
+        return
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    os.environ.setdefault("TRITON_CACHE_DIR", os.path.join(cache_dir, "triton"))
+
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+    # Newer torch versions can also cache the AOT autograd graph
+    if hasattr(inductor_config, "autograd_cache"):
+        inductor_config.autograd_cache = True
+    log.info(f"Compile cache: {os.environ['TORCHINDUCTOR_CACHE_DIR']}")
+
+
+def compile_model(model: nn.Module, strategy: str = "regional", cache_dir: Optional[str] = None, **compile_kwargs) -> nn.Module:
+    """
+    Compiles a diffusion model wrapper for inference.
+
+    strategy: "regional" compiles the repeated transformer blocks only (see MMmodule.compile_blocks),
+              "full" wraps the whole model in torch.compile
+    cache_dir: directory for the persistent compile cache
+    compile_kwargs: passed on to torch.compile, e.g. mode="max-autotune"
+    """
+    enable_compile_cache(cache_dir)
+
+    if strategy == "full":
+        return torch.compile(model, **compile_kwargs)
+
+    if strategy != "regional":
+        raise ValueError(f"Unknown compile strategy {strategy}")
+
+    compiled = False
+    for module in model.modules():
+        if hasattr(module, "compile_blocks"):
+            module.compile_blocks(**compile_kwargs)
+            compiled = True
+
+    if not compiled:
+        log.warning("No regionally compilable blocks found, falling back to full compilation")
+        return torch.compile(model, **compile_kwargs)
+
+    return model
@@ -0,0 +1,119 @@
+import os
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import torch
+
+log = logging.getLogger()
+
+
+def _parse_dtype(dtype: Union[str, torch.dtype, None]) -> Optional[torch.dtype]:
+    if dtype is None or isinstance(dtype, torch.dtype):
+        return dtype
+    dtype = dtype.lower()
+    if dtype in ("", "auto"):
+        return None
+    if dtype in ("fp16", "float16", "half"):
+        return torch.float16
+    if dtype in ("bf16", "bfloat16"):
+        return torch.bfloat16
+    if dtype in ("fp32", "float32", "float"):
+        return torch.float32
+    raise ValueError(f"Unknown dtype {dtype}")
+
+
+@dataclass
+class DevicePolicy:
+    """
+    Device and precision policy shared by feature extraction, conditioning, sampling and decoding.
+
+    device: the compute device
+    dtype: the autocast dtype (float16 on CUDA, bfloat16 on CPU by default)
+    num_threads / num_interop_threads: CPU thread pool sizes, only applied on CPU
+    """
+    device: torch.device
+    dtype: torch.dtype
+    num_threads: Optional[int] = None
+    num_interop_threads: Optional[int] = None
+
+    @classmethod
+    def create(cls,
+               device: Union[str, torch.device, None] = None,
+               dtype: Union[str, torch.dtype, None] = None,
+               num_threads: Optional[int] = None,
+               num_interop_threads: Optional[int] = None) -> "DevicePolicy":
+        if device is None or device in ("", "auto"):
+            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        device = torch.device(device)
+
+        dtype = _parse_dtype(dtype)
+        if dtype is None:
+            dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+
+        return cls(device=device, dtype=dtype, num_threads=num_threads or None,
+                   num_interop_threads=num_interop_threads or None)
+
+    @classmethod
+    def from_device(cls, device: Union[str, torch.device, None]) -> "DevicePolicy":
+        return cls.create(device=device)
+
+    @property
+    def device_type(self) -> str:
+        return self.device.type
+
+    @property
+    def is_cuda(self) -> bool:
+        return self.device.type == "cuda"
+
+    def apply(self) -> "DevicePolicy":
+        """Applies process-wide settings (CPU thread pools). Safe to call more than once."""
+        if self.is_cuda:
+            return self
+
+        num_threads = self.num_threads
+        if num_threads is None:
+            # Respect container CPU limits where the affinity mask is narrower than cpu_count()
+            num_threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        torch.set_num_threads(num_threads)
+
+        num_interop_threads = self.num_interop_threads or max(1, num_threads // 4)
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # The interop pool can only be sized before the first parallel op runs
+            log.warning("Interop threads already initialized, keeping %d", torch.get_num_interop_threads())
+
+        log.info(f"CPU policy: {torch.get_num_threads()} intra-op threads, {torch.get_num_interop_threads()} interop threads, autocast {self.dtype}")
+        return self
+
+    def autocast(self, enabled: bool = True):
+        if not enabled or self.dtype == torch.float32:
+            return nullcontext()
+        return torch.autocast(device_type=self.device_type, dtype=self.dtype)
+
+    def to(self, x, non_blocking: bool = True):
+        if isinstance(x, torch.Tensor):
+            return x.to(self.device, non_blocking=non_blocking and self.is_cuda)
+        return x
+
+    def synchronize(self):
+        if self.is_cuda:
+            torch.cuda.synchronize(self.device)
+
+    def empty_cache(self):
+        if self.is_cuda:
+            torch.cuda.empty_cache()
+
+    def max_memory_allocated(self) -> Optional[int]:
+        if self.is_cuda:
+            return torch.cuda.max_memory_allocated(self.device)
+        return None
+
+
+def get_device_policy(device_policy: Optional[DevicePolicy] = None,
+                      device: Union[str, torch.device, None] = None) -> DevicePolicy:
+    if device_policy is not None:
+        return device_policy
+    return DevicePolicy.from_device(device)
@@ -6,6 +6,7 @@ from torchaudio import transforms as T
 
 from .utils import prepare_audio
 from .sampling import sample, sample_k, sample_rf
+from .device import DevicePolicy, get_device_policy
 from ..data.utils import PadCrop
 
 def generate_diffusion_cond(
@@ -25,6 +26,7 @@ def generate_diffusion_cond(
         init_noise_level: float = 1.0,
         mask_args: dict = None,
         return_latents = False,
+        device_policy: tp.Optional[DevicePolicy] = None,
         **sampler_kwargs
         ) -> torch.Tensor: 
     """
@@ -44,9 +46,13 @@ def generate_diffusion_cond(
         init_audio: A tuple of (sample_rate, audio) to use as the initial audio for generation.
         init_noise_level: The noise level to use when generating from an initial audio sample.
         return_latents: Whether to return the latents used for generation instead of the decoded audio.
+        device_policy: The device/precision policy to use. If None, one is derived from `device`.
         **sampler_kwargs: Additional keyword arguments to pass to the sampler.    
     """
 
+    device_policy = get_device_policy(device_policy, device)
+    device = device_policy.device
+
     # The length of the output in audio samples 
     audio_sample_size = sample_size
 
@@ -62,12 +68,11 @@ def generate_diffusion_cond(
     # Define the initial noise immediately after setting the seed
     noise = torch.randn([batch_size, model.io_channels, sample_size], device=device)
 
-    torch.backends.cuda.matmul.allow_tf32 = False
-    torch.backends.cudnn.allow_tf32 = False
-    torch.backends.cuda.matmul.allow_fp16_reduced_precision_reduction = False
-    torch.backends.cudnn.benchmark = False
-    import ipdb
-    # ipdb.set_trace()
+    if device_policy.is_cuda:
+        torch.backends.cuda.matmul.allow_tf32 = False
+        torch.backends.cudnn.allow_tf32 = False
+        torch.backends.cuda.matmul.allow_fp16_reduced_precision_reduction = False
+        torch.backends.cudnn.benchmark = False
     # Conditioning
     assert conditioning is not None or conditioning_tensors is not None, "Must provide either conditioning or conditioning_tensors"
     if conditioning_tensors is None:
@@ -143,7 +148,7 @@ def generate_diffusion_cond(
     if diff_objective == "v":    
         # k-diffusion denoising process go!
         # sampled = sample(model.model, noise, steps, 0, **conditioning_inputs)
-        sampled = sample_k(model.model, noise, init_audio, mask, steps, **sampler_kwargs, **conditioning_inputs, **negative_conditioning_tensors, cfg_scale=cfg_scale, batch_cfg=True, rescale_cfg=True, device=device)
+        sampled = sample_k(model.model, noise, init_audio, mask, steps, **sampler_kwargs, **conditioning_inputs, **negative_conditioning_tensors, cfg_scale=cfg_scale, batch_cfg=True, rescale_cfg=True, device=device, device_policy=device_policy)
     elif diff_objective == "rectified_flow":
 
         if "sigma_min" in sampler_kwargs:
@@ -152,14 +157,14 @@ def generate_diffusion_cond(
         if "sampler_type" in sampler_kwargs:
             del sampler_kwargs["sampler_type"]
 
-        sampled = sample_rf(model.model, noise, init_data=init_audio, steps=steps, **sampler_kwargs, **conditioning_inputs, **negative_conditioning_tensors, cfg_scale=cfg_scale, batch_cfg=True, rescale_cfg=True, device=device)
+        sampled = sample_rf(model.model, noise, init_data=init_audio, steps=steps, **sampler_kwargs, **conditioning_inputs, **negative_conditioning_tensors, cfg_scale=cfg_scale, batch_cfg=True, rescale_cfg=True, device=device, device_policy=device_policy)
 
     # v-diffusion: 
     #sampled = sample(model.model, noise, steps, 0, **conditioning_tensors, embedding_scale=cfg_scale)
     del noise
     del conditioning_tensors
     del conditioning_inputs
-    torch.cuda.empty_cache()
+    device_policy.empty_cache()
     # Denoising process done. 
     # If this is latent diffusion, decode latents back into audio
     if model.pretransform is not None and not return_latents:
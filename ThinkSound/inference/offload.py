@@ -0,0 +1,247 @@
+import time
+import logging
+import resource
+import weakref
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Iterable, List, Optional
+
+import torch
+from torch import nn
+
+from .device import DevicePolicy
+
+log = logging.getLogger()
+
+
+def _named_tensors(module: nn.Module):
+    yield from module.named_parameters(recurse=True)
+    yield from module.named_buffers(recurse=True)
+
+
+def _owned_tensors(module: nn.Module):
+    """(owner, name, tensor) of every parameter and buffer under module, with the submodule that holds it."""
+    for owner in module.modules():
+        for name, tensor in [*owner._parameters.items(), *owner._buffers.items()]:
+            if tensor is not None:
+                yield owner, name, tensor
+
+
+class StageMemoryTracker:
+    """
+    Records wall time and peak memory per pipeline stage.
+
+    On CUDA the peak is the device allocator high-water mark within the stage.
+    On CPU it is the process peak RSS, which only grows over the lifetime of the process.
+    """
+    def __init__(self, device_policy: DevicePolicy):
+        self.device_policy = device_policy
+        self.stats: Dict[str, dict] = {}
+
+    @contextmanager
+    def track(self, name: str):
+        if self.device_policy.is_cuda:
+            torch.cuda.reset_peak_memory_stats(self.device_policy.device)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.device_policy.synchronize()
+            elapsed = time.perf_counter() - start
+            if self.device_policy.is_cuda:
+                peak = self.device_policy.max_memory_allocated()
+            else:
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            stats = self.stats.setdefault(name, {"calls": 0, "time": 0.0, "peak": 0})
+            stats["calls"] += 1
+            stats["time"] += elapsed
+            stats["peak"] = max(stats["peak"], peak)
+
+    def report(self) -> str:
+        kind = "device peak" if self.device_policy.is_cuda else "host peak RSS"
+        lines = [f"Stage memory on {self.device_policy.device}:"]
+        for name, stats in self.stats.items():
+            lines.append(f"  {name}: {kind} {stats['peak'] / 1024**2:.1f} MB, "
+                         f"{stats['time']:.2f}s over {stats['calls']} call(s)")
+        return "\n".join(lines)
+
+
+class OffloadScheduler:
+    """
+    Keeps module weights on the host and moves them onto the compute device only while they are needed.
+
+    Host copies are pinned when pin_memory is set (fast async copies), otherwise the existing host
+    tensors are kept as-is, e.g. memory-mapped checkpoint tensors loaded with assign=True.
+    Whole modules are loaded per pipeline stage with stage(); repeated transformer blocks can instead
+    be streamed one at a time with stream_blocks().
+
+    Host copies are keyed by the module holding the tensor and its attribute name, and remember the tensor
+    they belong to (weakly): a buffer that is replaced, like the RoPE rotations MMmodule recomputes when the
+    sequence lengths change, gets a new host copy and the stale one is dropped. Ids of freed tensors are
+    reused, so they cannot be keys.
+    """
+    def __init__(self, device_policy: DevicePolicy, pin_memory: bool = True):
+        self.device_policy = device_policy
+        self.pin_memory = pin_memory and device_policy.is_cuda
+        self.memory = StageMemoryTracker(device_policy)
+        # owner module -> {name: (weakref to the tensor, host copy)}
+        self._host: "weakref.WeakKeyDictionary[nn.Module, Dict[str, tuple]]" = weakref.WeakKeyDictionary()
+        self._streamed: "weakref.WeakSet[nn.Module]" = weakref.WeakSet()
+        self._streamers: List["BlockStreamer"] = []
+
+    def _host_copy(self, owner: nn.Module, name: str, tensor: torch.Tensor) -> Optional[torch.Tensor]:
+        """The host copy of owner.name, None if it has none or the attribute now holds another tensor."""
+        entry = self._host.get(owner, {}).get(name)
+        if entry is None or entry[0]() is not tensor:
+            return None
+        return entry[1]
+
+    def register(self, *modules: nn.Module) -> None:
+        """Moves modules to host memory and records the host copy of every parameter and buffer."""
+        for module in modules:
+            for owner, name, tensor in _owned_tensors(module):
+                if self._host_copy(owner, name, tensor) is not None:
+                    continue
+                tensor.data = self.register_tensor(owner, name, tensor)
+
+    def load(self, module: nn.Module, skip_streamed: bool = True) -> None:
+        device = self.device_policy.device
+        for owner, name, tensor in _owned_tensors(module):
+            if skip_streamed and owner in self._streamed:
+                continue
+            host = self._host_copy(owner, name, tensor)
+            if host is None:
+                # Created or replaced after registration (e.g. recomputed rope buffers), manage it from now on
+                host = self.register_tensor(owner, name, tensor)
+            if tensor.device != device:
+                tensor.data = host.to(device, non_blocking=self.pin_memory)
+
+    def unload(self, module: nn.Module, skip_streamed: bool = True) -> None:
+        for owner, name, tensor in _owned_tensors(module):
+            if skip_streamed and owner in self._streamed:
+                continue
+            host = self._host_copy(owner, name, tensor)
+            if host is not None:
+                # Inference weights are frozen, so the host copy is still current
+                tensor.data = host
+
+    def register_tensor(self, owner: nn.Module, name: str, tensor: torch.Tensor) -> torch.Tensor:
+        """Records (replacing any stale entry of owner.name) and returns the host copy of a tensor."""
+        host = tensor.data if tensor.device.type == "cpu" else tensor.data.cpu()
+        if self.pin_memory and not host.is_pinned():
+            host = host.pin_memory()
+        self._host.setdefault(owner, {})[name] = (weakref.ref(tensor), host)
+        return host
+
+    @contextmanager
+    def stage(self, name: str, *modules: nn.Module):
+        """Loads modules for the duration of a pipeline stage and records its peak memory."""
+        with self.memory.track(name):
+            for module in modules:
+                self.load(module)
+            try:
+                yield
+            finally:
+                for module in modules:
+                    self.unload(module)
+                # unload() skips streamed blocks, drop the ones prefetched for a step that never came
+                for streamer in self._streamers:
+                    streamer.drain()
+                self.device_policy.empty_cache()
+
+    def stream_blocks(self, blocks: Iterable[nn.Module], prefetch: int = 1) -> "BlockStreamer":
+        """
+        Streams blocks onto the device one at a time in call order. The blocks are excluded from
+        stage() loads, so a stage containing them only keeps the non-block weights resident.
+        """
+        blocks = list(blocks)
+        self.register(*blocks)
+        for block in blocks:
+            for owner in block.modules():
+                self._streamed.add(owner)
+        streamer = BlockStreamer(self, blocks, prefetch=prefetch)
+        self._streamers.append(streamer)
+        return streamer
+
+    def report(self) -> str:
+        return self.memory.report()
+
+
+class BlockStreamer:
+    """
+    Forward hooks that load a block right before it runs and release it right after.
+
+    On CUDA the next `prefetch` blocks are copied on a side stream while the current block computes.
+    Prefetching wraps around, so block 0 of the next sampling step is loaded during the last block;
+    drain() releases such blocks once sampling is over.
+    """
+    def __init__(self, scheduler: OffloadScheduler, blocks: List[nn.Module], prefetch: int = 1):
+        self.scheduler = scheduler
+        self.blocks = blocks
+        self.prefetch = prefetch
+        device_policy = scheduler.device_policy
+        self.stream = torch.cuda.Stream(device_policy.device) if device_policy.is_cuda else None
+        self._ready: Dict[int, Optional[torch.cuda.Event]] = {}
+        self._handles = []
+        for i, block in enumerate(blocks):
+            self._handles.append(block.register_forward_pre_hook(partial(self._pre_forward, i)))
+            self._handles.append(block.register_forward_hook(partial(self._post_forward, i)))
+
+    def _fetch(self, i: int) -> None:
+        if i in self._ready:
+            return
+        block = self.blocks[i]
+        if self.stream is None:
+            self.scheduler.load(block, skip_streamed=False)
+            self._ready[i] = None
+            return
+        with torch.cuda.stream(self.stream):
+            self.scheduler.load(block, skip_streamed=False)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        self._ready[i] = event
+
+    def _pre_forward(self, i: int, module: nn.Module, args):
+        self._fetch(i)
+        event = self._ready[i]
+        if event is not None:
+            current = torch.cuda.current_stream(self.scheduler.device_policy.device)
+            current.wait_event(event)
+            # The weights were allocated on the side stream; keep them alive until the compute stream is done
+            for _, tensor in _named_tensors(module):
+                tensor.data.record_stream(current)
+        for j in range(1, self.prefetch + 1):
+            self._fetch((i + j) % len(self.blocks))
+
+    def _post_forward(self, i: int, module: nn.Module, args, output):
+        self.scheduler.unload(module, skip_streamed=False)
+        self._ready.pop(i, None)
+
+    def drain(self) -> None:
+        """Unloads the blocks fetched ahead of a forward that has not run."""
+        if self.stream is not None:
+            self.stream.synchronize()
+        for i in self._ready:
+            self.scheduler.unload(self.blocks[i], skip_streamed=False)
+        self._ready.clear()
+
+    def remove(self) -> None:
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+def create_offload_scheduler(model: nn.Module, device_policy: DevicePolicy, pin_memory: bool = True,
+                             prefetch: int = 1) -> OffloadScheduler:
+    """
+    Offloads a diffusion model wrapper: the MMDiT joint/fused blocks are streamed,
+    everything else (conditioner, projections, pretransform) is loaded per stage.
+    """
+    from ..models.mmdit import MMmodule
+
+    scheduler = OffloadScheduler(device_policy, pin_memory=pin_memory)
+    for module in model.modules():
+        if isinstance(module, MMmodule):
+            scheduler.stream_blocks([*module.joint_blocks, *module.fused_blocks], prefetch=prefetch)
+    scheduler.register(model)
+    return scheduler
@@ -0,0 +1,51 @@
+import json
+import logging
+from typing import Optional
+
+from ..models.factory import create_pretransform_from_config
+from ..models.pretransforms import AutoencoderPretransform
+from ..models.utils import load_ckpt_state_dict
+
+log = logging.getLogger()
+
+
+def create_preview_decoder(model_config_path: str, precision: Optional[str] = None) -> AutoencoderPretransform:
+    """
+    Builds the preview decoder of a model config with untrained weights, for benchmarks and distillation.
+    Use load_preview_decoder to decode with it.
+    """
+    with open(model_config_path) as f:
+        model_config = json.load(f)
+
+    pretransform_config = {"type": "autoencoder", "config": model_config["model"]}
+    # calibrated chunk overlaps live next to the model (see calibrate_vae_overlap.py)
+    for key in ("encode_overlap", "decode_overlap"):
+        if key in model_config["model"]:
+            pretransform_config[key] = model_config["model"][key]
+    if precision is not None:
+        pretransform_config["precision"] = precision
+    return create_pretransform_from_config(pretransform_config, model_config["sample_rate"])
+
+
+def load_preview_decoder(model_config_path: str, ckpt_path: str,
+                         precision: Optional[str] = None) -> AutoencoderPretransform:
+    """
+    Loads a distilled preview decoder (see configs/model_configs/preview_decoder.json) as a drop-in
+    replacement for the generator's VAE pretransform when decoding latents.
+
+    The output is audio at the decoder_sample_rate of the preview model, lower than the generator's.
+    ckpt_path: an exported training checkpoint or an inference checkpoint saved with
+    save_inference_checkpoint (decoder only is enough), required: untrained weights decode to noise
+    """
+    if not ckpt_path:
+        raise ValueError(f"A checkpoint is required to load the preview decoder of {model_config_path}")
+    decoder = create_preview_decoder(model_config_path, precision)
+
+    state_dict = load_ckpt_state_dict(ckpt_path)
+    if any(k.startswith("autoencoder.") for k in state_dict):
+        state_dict = load_ckpt_state_dict(ckpt_path, prefix="autoencoder.")
+    decoder.load_state_dict(state_dict)
+    decoder.prepare_for_inference()
+
+    log.info(f"Preview decoder: {decoder.sample_rate} Hz latents -> {decoder.decoder_sample_rate} Hz audio")
+    return decoder.eval()
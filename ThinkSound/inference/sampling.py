@@ -1,9 +1,12 @@
 import torch
 import math
+from functools import wraps
 from tqdm import trange, tqdm
 
 import k_diffusion as K
 
+from .device import DevicePolicy, get_device_policy
+
 # Define the noise schedule and sampling loop
 def get_alphas_sigmas(t):
     """Returns the scaling factors for the clean image (alpha) and for the
@@ -20,8 +23,29 @@ def t_to_alpha_sigma(t):
     a timestep."""
     return torch.cos(t * math.pi / 2), torch.sin(t * math.pi / 2)
 
+def release_workspaces(model) -> None:
+    """Frees the buffers a model keeps between sampling steps (see MMmodule.release_workspace)."""
+    from ..models.mmdit import MMmodule
+
+    if not isinstance(model, torch.nn.Module):
+        return
+    for module in model.modules():
+        if isinstance(module, MMmodule):
+            module.release_workspace()
+
+def _releases_workspaces(sampler):
+    # every sampler frees the model's per-step buffers when it is done, so callers never hold them through decode
+    @wraps(sampler)
+    def wrapper(model, *args, **kwargs):
+        try:
+            return sampler(model, *args, **kwargs)
+        finally:
+            release_workspaces(model)
+    return wrapper
+
 
 @torch.no_grad()
+@_releases_workspaces
 def sample_discrete_euler(model, x, steps, sigma_max=1, **extra_args):
     """Draws samples from a model given starting noise. Euler method"""
 
@@ -45,8 +69,10 @@ def sample_discrete_euler(model, x, steps, sigma_max=1, **extra_args):
     return x
 
 @torch.no_grad()
-def sample(model, x, steps, eta, **extra_args):
+@_releases_workspaces
+def sample(model, x, steps, eta, device_policy: DevicePolicy = None, **extra_args):
     """Draws samples from a model given starting noise. v-diffusion"""
+    device_policy = get_device_policy(device_policy, x.device)
     ts = x.new_ones([x.shape[0]])
 
     # Create the noise schedule
@@ -58,7 +84,7 @@ def sample(model, x, steps, eta, **extra_args):
     for i in trange(steps):
 
         # Get the model output (v, the predicted velocity)
-        with torch.cuda.amp.autocast():
+        with device_policy.autocast():
             v = model(x, ts * t[i], **extra_args).float()
 
         # Predict the noise and the denoised image
@@ -108,6 +134,7 @@ def make_cond_model_fn(model, cond_fn):
 # For sampling, set both init_data and mask to None
 # For variations, set init_data 
 # For inpainting, set both init_data & mask 
+@_releases_workspaces
 def sample_k(
         model_fn, 
         noise, 
@@ -120,9 +147,13 @@ def sample_k(
         rho=1.0, device="cuda", 
         callback=None, 
         cond_fn=None,
+        device_policy: DevicePolicy = None,
         **extra_args
     ):
 
+    device_policy = get_device_policy(device_policy, device)
+    device = device_policy.device
+
     denoiser = K.external.VDenoiser(model_fn)
 
     if cond_fn is not None:
@@ -174,7 +205,7 @@ def sample_k(
         x = noise
 
 
-    with torch.cuda.amp.autocast():
+    with device_policy.autocast():
         if sampler_type == "k-heun":
             return K.sampling.sample_heun(denoiser, x, sigmas, disable=False, callback=wrapped_callback, extra_args=extra_args)
         elif sampler_type == "k-lms":
@@ -197,6 +228,7 @@ def sample_k(
 # For sampling, set both init_data and mask to None
 # For variations, set init_data 
 # For inpainting, set both init_data & mask 
+@_releases_workspaces
 def sample_rf(
         model_fn, 
         noise, 
@@ -206,9 +238,12 @@ def sample_rf(
         device="cuda", 
         callback=None, 
         cond_fn=None,
+        device_policy: DevicePolicy = None,
         **extra_args
     ):
 
+    device_policy = get_device_policy(device_policy, device)
+
     if sigma_max > 1:
         sigma_max = 1
 
@@ -226,7 +261,7 @@ def sample_rf(
         # set the initial latent to noise
         x = noise
 
-    with torch.cuda.amp.autocast():
+    with device_policy.autocast():
         # TODO: Add callback support
         #return sample_discrete_euler(model_fn, x, steps, sigma_max, callback=wrapped_callback, **extra_args)
         return sample_discrete_euler(model_fn, x, steps, sigma_max, **extra_args)
\ No newline at end of file
@@ -16,11 +16,137 @@ from .bottleneck import Bottleneck, DiscreteBottleneck
 from .diffusion import ConditionedDiffusionModel, DAU1DCondWrapper, UNet1DCondWrapper, DiTWrapper
 from .factory import create_pretransform_from_config, create_bottleneck_from_config
 from .pretransforms import Pretransform
+from .utils import remove_weight_norm_from_model
 
 def checkpoint(function, *args, **kwargs):
     kwargs.setdefault("use_reentrant", False)
     return torch.utils.checkpoint.checkpoint(function, *args, **kwargs)
 
+def chunk_spans(total_size, chunk_size, overlap):
+    '''
+    Splits total_size positions into chunks of chunk_size with the given overlap.
+    Returns (start, end, keep_start, keep_end) per chunk: the chunk covers [start, end) and
+    owns [keep_start, keep_end) of the output. Each chunk drops half the overlap at its
+    inner edges, later chunks win where the trimmed ranges still overlap, and the final
+    chunk is aligned to the end so every chunk has the same size.
+    '''
+    if total_size <= chunk_size:
+        return [(0, total_size, 0, total_size)]
+
+    hop_size = chunk_size - overlap
+    starts = list(range(0, total_size - chunk_size + 1, hop_size))
+    if starts[-1] + chunk_size != total_size:
+        # Final chunk
+        starts.append(total_size - chunk_size)
+
+    ol = overlap // 2
+    spans = []
+    for i, start in enumerate(starts):
+        # no overlap for the start of the first chunk or the end of the last chunk
+        keep_start = start + ol if i > 0 else start
+        keep_end = start + chunk_size - ol if i < len(starts) - 1 else total_size
+        spans.append([start, start + chunk_size, keep_start, keep_end])
+    for span, next_span in zip(spans[:-1], spans[1:]):
+        span[3] = min(span[3], next_span[2])
+    return [tuple(span) for span in spans]
+
+def iterate_micro_batches(items, micro_batch_size, fn, cache=None):
+    '''
+    Runs fn on items (tensors batched along dim 0) concatenated into micro-batches and yields
+    the per-item outputs in order.
+    micro_batch_size is the number of items per call, or "auto": on CUDA the first item is run
+    alone to measure its peak memory and the rest are grouped to fill ~80% of the free memory
+    (measured once per function, item shape and dtype when the caller passes its cache dict, e.g. the
+    _auto_micro_batches of its model), elsewhere 4 items are grouped.
+    '''
+    outputs = []
+    micro_batch_size = _probe_micro_batch(fn, items, micro_batch_size, outputs, cache=cache)
+    yield from outputs
+    i = len(outputs)
+
+    while i < len(items):
+        group = items[i:i + micro_batch_size]
+        if len(group) == 1:
+            yield fn(group[0])
+        else:
+            yield from fn(torch.cat(group, dim=0)).split([item.shape[0] for item in group], dim=0)
+        i += len(group)
+
+def _probe_micro_batch(fn, items, micro_batch_size, outputs, sizes=None, cache=None):
+    # resolves "auto" to a number of items; on CUDA the probe output of the first item is appended to outputs.
+    # cache maps (function, item shape, dtype, device) to resolved sizes, it belongs to the model running fn:
+    # the key does not tell two models apart
+    if micro_batch_size == "auto":
+        device = items[0].device
+        if device.type == "cuda":
+            key = (getattr(fn, "__qualname__", type(fn).__qualname__), tuple(items[0].shape), items[0].dtype, device)
+            if cache is not None and key in cache:
+                return cache[key]
+            torch.cuda.synchronize(device)
+            baseline = torch.cuda.memory_allocated(device)
+            # the global peak is not reset, callers such as StageMemoryTracker measure across this call
+            prior_peak = torch.cuda.max_memory_allocated(device)
+            outputs.append(fn(items[0]))
+            if sizes is not None:
+                sizes.append(items[0].shape[0])
+            peak = torch.cuda.max_memory_allocated(device)
+            per_item = max(peak - baseline, 1)
+            free, _ = torch.cuda.mem_get_info(device)
+            micro_batch_size = max(1, int(free * 0.8) // per_item)
+            # a probe that stayed under an earlier peak is only bounded by it: use the bound, but probe again next time
+            if cache is not None and peak > prior_peak:
+                cache[key] = micro_batch_size
+        else:
+            micro_batch_size = 4
+    return max(1, int(micro_batch_size))
+
+def _resolve_micro_batch(micro_batch, iterate_batch=False):
+    if micro_batch is None and iterate_batch:
+        return 1
+    return micro_batch
+
+def _chunk_call_kwargs(kwargs):
+    # the chunked paths size their calls with chunk_batch_size alone: splitting each group of chunks again
+    # per sample would undo it, and an "auto" micro_batch would probe a second time inside the "auto" one
+    kwargs = dict(kwargs)
+    kwargs.pop("iterate_batch", None)
+    kwargs["micro_batch"] = None
+    return kwargs
+
+def _merge_bottleneck_outputs(outputs, sizes):
+    # concatenates the latents and per-sample info, averages scalar losses weighted by micro-batch size
+    latents = torch.cat([latents for latents, _ in outputs], dim=0)
+    info = {}
+    for key, value in outputs[0][1].items():
+        values = [out_info[key] for _, out_info in outputs]
+        if torch.is_tensor(value) and value.ndim > 0 and value.shape[0] == sizes[0]:
+            info[key] = torch.cat(values, dim=0)
+        elif torch.is_tensor(value) and value.ndim == 0:
+            info[key] = sum(v * size for v, size in zip(values, sizes)) / sum(sizes)
+        else:
+            info[key] = values[-1]
+    return latents, info
+
+def run_micro_batched(fn, x, micro_batch, merge=None, cache=None):
+    '''
+    Applies fn to x in slices of micro_batch samples along dim 0 (an int, "auto" or None for the whole batch,
+    see iterate_micro_batches). Outputs are concatenated, or combined with merge(outputs, sizes).
+    '''
+    if micro_batch is None or (micro_batch != "auto" and int(micro_batch) >= x.shape[0]) or x.shape[0] == 1:
+        return fn(x)
+    items = list(x.split(1, dim=0))
+    if merge is None:
+        return torch.cat(list(iterate_micro_batches(items, micro_batch, fn, cache=cache)), dim=0)
+
+    # outputs that are not plain tensors are collected per micro-batch
+    outputs, sizes = [], []
+    micro_batch = _probe_micro_batch(fn, items, micro_batch, outputs, sizes, cache=cache)
+    for i in range(sum(sizes), len(items), micro_batch):
+        group = torch.cat(items[i:i + micro_batch], dim=0)
+        outputs.append(fn(group))
+        sizes.append(group.shape[0])
+    return merge(outputs, sizes)
+
 def get_activation(activation: Literal["elu", "snake", "none"], antialias=False, channels=None) -> nn.Module:
     if activation == "elu":
         act = nn.ELU()
@@ -240,13 +366,24 @@ class AudioAutoencoder(nn.Module):
         pretransform: Pretransform = None,
         in_channels = None,
         out_channels = None,
-        soft_clip = False
+        soft_clip = False,
+        decoder_sample_rate = None
     ):
         super().__init__()
 
         self.downsampling_ratio = downsampling_ratio
         self.sample_rate = sample_rate
 
+        # Output rate of the decoder. Preview decoders upsample less than the encoder downsamples
+        # and produce audio at a lower rate than they encode.
+        self.decoder_sample_rate = decoder_sample_rate if decoder_sample_rate is not None else sample_rate
+        assert (downsampling_ratio * self.decoder_sample_rate) % sample_rate == 0, \
+            "decoder_sample_rate must give a whole number of output samples per latent"
+        self.upsampling_ratio = downsampling_ratio * self.decoder_sample_rate // sample_rate
+
+        # resolved "auto" micro-batch sizes of this model (see iterate_micro_batches)
+        self._auto_micro_batches = {}
+
         self.latent_dim = latent_dim
         self.io_channels = io_channels
         self.in_channels = io_channels
@@ -272,44 +409,31 @@ class AudioAutoencoder(nn.Module):
  
         self.is_discrete = self.bottleneck is not None and self.bottleneck.is_discrete
 
-    def encode(self, audio, return_info=False, skip_pretransform=False, iterate_batch=False, **kwargs):
+    def encode(self, audio, return_info=False, skip_pretransform=False, iterate_batch=False, micro_batch=None, **kwargs):
+        '''
+        micro_batch: run the pretransform, encoder and bottleneck on slices of this many samples,
+        "auto" to size the slices to the free memory, or None for the whole batch at once.
+        iterate_batch=True is the legacy spelling of micro_batch=1.
+        '''
+        micro_batch = _resolve_micro_batch(micro_batch, iterate_batch)
 
         info = {}
-        # import ipdb
-        # ipdb.set_trace()
         if self.pretransform is not None and not skip_pretransform:
             if self.pretransform.enable_grad:
-                if iterate_batch:
-                    audios = []
-                    for i in range(audio.shape[0]):
-                        audios.append(self.pretransform.encode(audio[i:i+1]))
-                    audio = torch.cat(audios, dim=0)
-                else:
-                    audio = self.pretransform.encode(audio)
+                audio = run_micro_batched(self.pretransform.encode, audio, micro_batch, cache=self._auto_micro_batches)
             else:
                 with torch.no_grad():
-                    if iterate_batch:
-                        audios = []
-                        for i in range(audio.shape[0]):
-                            audios.append(self.pretransform.encode(audio[i:i+1]))
-                        audio = torch.cat(audios, dim=0)
-                    else:
-                        audio = self.pretransform.encode(audio)
+                    audio = run_micro_batched(self.pretransform.encode, audio, micro_batch, cache=self._auto_micro_batches)
 
         if self.encoder is not None:
-            if iterate_batch:
-                latents = []
-                for i in range(audio.shape[0]):
-                    latents.append(self.encoder(audio[i:i+1]))
-                latents = torch.cat(latents, dim=0)
-            else:
-                latents = self.encoder(audio)
+            latents = run_micro_batched(self.encoder, audio, micro_batch, cache=self._auto_micro_batches)
         else:
             latents = audio
 
         if self.bottleneck is not None:
-            # TODO: Add iterate batch logic, needs to merge the info dicts
-            latents, bottleneck_info = self.bottleneck.encode(latents, return_info=True, **kwargs)
+            encode = lambda x: self.bottleneck.encode(x, return_info=True, **kwargs)
+            latents, bottleneck_info = run_micro_batched(encode, latents, micro_batch, merge=_merge_bottleneck_outputs,
+                                                         cache=self._auto_micro_batches)
 
             info.update(bottleneck_info)
         
@@ -318,49 +442,86 @@ class AudioAutoencoder(nn.Module):
 
         return latents
 
-    def decode(self, latents, iterate_batch=False, **kwargs):
+    def decode(self, latents, iterate_batch=False, micro_batch=None, **kwargs):
+        '''
+        micro_batch: see encode
+        '''
+        micro_batch = _resolve_micro_batch(micro_batch, iterate_batch)
 
         if self.bottleneck is not None:
-            if iterate_batch:
-                decoded = []
-                for i in range(latents.shape[0]):
-                    decoded.append(self.bottleneck.decode(latents[i:i+1]))
-                latents = torch.cat(decoded, dim=0)
-            else:
-                latents = self.bottleneck.decode(latents)
+            latents = run_micro_batched(self.bottleneck.decode, latents, micro_batch, cache=self._auto_micro_batches)
 
-        if iterate_batch:
-            decoded = []
-            for i in range(latents.shape[0]):
-                decoded.append(self.decoder(latents[i:i+1]))
-            decoded = torch.cat(decoded, dim=0)
-        else:
-            decoded = self.decoder(latents, **kwargs)
+        decoded = run_micro_batched(lambda x: self.decoder(x, **kwargs), latents, micro_batch, cache=self._auto_micro_batches)
 
         if self.pretransform is not None:
             if self.pretransform.enable_grad:
-                if iterate_batch:
-                    decodeds = []
-                    for i in range(decoded.shape[0]):
-                        decodeds.append(self.pretransform.decode(decoded[i:i+1]))
-                    decoded = torch.cat(decodeds, dim=0)
-                else:
-                    decoded = self.pretransform.decode(decoded)
+                decoded = run_micro_batched(self.pretransform.decode, decoded, micro_batch, cache=self._auto_micro_batches)
             else:
                 with torch.no_grad():
-                    if iterate_batch:
-                        decodeds = []
-                        for i in range(latents.shape[0]):
-                            decodeds.append(self.pretransform.decode(decoded[i:i+1]))
-                        decoded = torch.cat(decodeds, dim=0)
-                    else:
-                        decoded = self.pretransform.decode(decoded)
+                    decoded = run_micro_batched(self.pretransform.decode, decoded, micro_batch, cache=self._auto_micro_batches)
 
         if self.soft_clip:
             decoded = torch.tanh(decoded)
         
         return decoded
           
+    def prepare_for_inference(self):
+        '''
+        Inference-only conversion: bakes weight norm into plain conv weights and precomputes the
+        SnakeBeta exponentials and reciprocal. The model can no longer be trained afterwards.
+        '''
+        remove_weight_norm_from_model(self)
+        for module in self.modules():
+            if isinstance(module, SnakeBeta):
+                module.prepare_for_inference()
+        return self
+
+    def receptive_field(self, part="decoder", length=32, tol=0.0, max_length=1024):
+        '''
+        Measures the receptive field of the encoder or decoder by its gradient footprint: the input
+        positions with a non-zero gradient (above tol times the largest one) for the outputs of one
+        latent frame in the middle of a random input. The input is doubled until the footprint
+        stays clear of its edges.
+        Returns the radius in latents, the number of latents on either side of a frame that affect it.
+        Chunks that keep only outputs at least this far from their inner edges match unchunked output.
+        '''
+        assert part in ("encoder", "decoder"), f"Unknown part {part}"
+        assert self.pretransform is None, "receptive_field does not include a nested pretransform"
+        module = self.encoder if part == "encoder" else self.decoder
+        # input positions per latent frame
+        in_per_latent = self.downsampling_ratio if part == "encoder" else 1
+        out_per_latent = 1 if part == "encoder" else self.upsampling_ratio
+        in_channels = self.in_channels if part == "encoder" else self.latent_dim
+        param = next(module.parameters())
+
+        while True:
+            center = length // 2
+            x = torch.randn(1, in_channels, length * in_per_latent, device=param.device, dtype=param.dtype, requires_grad=True)
+            with torch.enable_grad():
+                y = module(x)
+                grad, = torch.autograd.grad(y[..., center * out_per_latent:(center + 1) * out_per_latent].sum(), x)
+            footprint = grad.abs().amax(dim=(0, 1))
+            positions = (footprint > tol * footprint.max()).nonzero().squeeze(1)
+            first, last = positions.min().item(), positions.max().item()
+            if (first > 0 and last < x.shape[-1] - 1) or length >= max_length:
+                break
+            length *= 2
+
+        left = center * in_per_latent - first
+        right = last - ((center + 1) * in_per_latent - 1)
+        return math.ceil(max(left, right, 0) / in_per_latent)
+
+    def calibrate_overlap(self, tol=0.0):
+        '''
+        Minimal chunk overlaps (in latents) for encode_audio and decode_audio: chunks drop half the
+        overlap at each inner edge, so the overlap is twice the receptive field radius.
+        '''
+        overlaps = {}
+        for part, key in (("encoder", "encode_overlap"), ("decoder", "decode_overlap")):
+            if getattr(self, part) is not None:
+                overlaps[key] = 2 * self.receptive_field(part, tol=tol)
+        return overlaps
+
     def decode_tokens(self, tokens, **kwargs):
         '''
         Decode discrete tokens to audio
@@ -427,7 +588,7 @@ class AudioAutoencoder(nn.Module):
         # convert to tensor 
         return torch.stack(new_audio) 
 
-    def encode_audio(self, audio, chunked=False, overlap=32, chunk_size=128, **kwargs):
+    def encode_audio(self, audio, chunked=False, overlap=32, chunk_size=128, chunk_batch_size="auto", **kwargs):
         '''
         Encode audios into latents. Audios should already be preprocesed by preprocess_audio_for_encoder.
         If chunked is True, split the audio into chunks of a given maximum size chunk_size, with given overlap.
@@ -435,11 +596,14 @@ class AudioAutoencoder(nn.Module):
         # and therefore you likely could use the same values with decode_audio. 
         A overlap of zero will cause discontinuity artefacts. Overlap should be => receptive field size. 
         Every autoencoder will have a different receptive field size, and thus ideal overlap.
-        You can determine it empirically by diffing unchunked vs chunked output and looking at maximum diff.
+        calibrate_overlap measures it (see calibrate_vae_overlap.py, which stores it in the model config).
         The final chunk may have a longer overlap in order to keep chunk_size consistent for all chunks.
         Smaller chunk_size uses less memory, but more compute.
         The chunk_size vs memory tradeoff isn't linear, and possibly depends on the GPU and CUDA version
         For example, on a A6000 chunk_size 128 is overall faster than 256 and 512 even though it has more chunks
+        Chunks are folded into the batch dimension, chunk_batch_size at a time (an int, or "auto" to size
+        the micro-batches to the free memory, see iterate_micro_batches); micro_batch and iterate_batch
+        only apply to unchunked calls.
         '''
         if not chunked:
             # default behavior. Encode the entire audio in parallel
@@ -447,123 +611,58 @@ class AudioAutoencoder(nn.Module):
         else:
             # CHUNKED ENCODING
             # samples_per_latent is just the downsampling ratio (which is also the upsampling ratio)
-            # import ipdb
-            # ipdb.set_trace()
             samples_per_latent = self.downsampling_ratio
-            total_size = audio.shape[2] # in samples
-            print(f'audio shape: {audio.shape}')
-            batch_size = audio.shape[0]
-            chunk_size *= samples_per_latent # converting metric in latents to samples
-            overlap *= samples_per_latent # converting metric in latents to samples
-            hop_size = chunk_size - overlap
-            chunks = []
-            for i in range(0, total_size - chunk_size + 1, hop_size):
-                chunk = audio[:,:,i:i+chunk_size]
-                chunks.append(chunk)
-            if i+chunk_size != total_size:
-                # Final chunk
-                chunk = audio[:,:,-chunk_size:]
-                chunks.append(chunk)
-            chunks = torch.stack(chunks)
-            num_chunks = chunks.shape[0]
             # Note: y_size might be a different value from the latent length used in diffusion training
             # because we can encode audio of varying lengths
             # However, the audio should've been padded to a multiple of samples_per_latent by now.
-            y_size = total_size // samples_per_latent
-            # Create an empty latent, we will populate it with chunks as we encode them
-            y_final = torch.zeros((batch_size,self.latent_dim,y_size)).to(audio.device)
-            print(f'y_final shape: {y_final.shape}')
-            for i in range(num_chunks):
-                x_chunk = chunks[i,:]
-                # encode the chunk
-                y_chunk = self.encode(x_chunk)
-                print(f'y_chunk shape: {y_chunk.shape}')
-                # figure out where to put the audio along the time domain
-                if i == num_chunks-1:
-                    # final chunk always goes at the end
-                    t_end = y_size
-                    t_start = t_end - y_chunk.shape[2]
-                else:
-                    t_start = i * hop_size // samples_per_latent
-                    t_end = t_start + chunk_size // samples_per_latent
-                #  remove the edges of the overlaps
-                ol = overlap//samples_per_latent//2
-                chunk_start = 0
-                chunk_end = y_chunk.shape[2]
-                if i > 0:
-                    # no overlap for the start of the first chunk
-                    t_start += ol
-                    chunk_start += ol
-                if i < num_chunks-1:
-                    # no overlap for the end of the last chunk
-                    t_end -= ol
-                    chunk_end -= ol
-                # paste the chunked audio into our y_final output audio
-                y_final[:,:,t_start:t_end] = y_chunk[:,:,chunk_start:chunk_end]
-            return y_final
+            y_size = audio.shape[2] // samples_per_latent
+            spans = chunk_spans(y_size, chunk_size, overlap)
+            x_chunks = [audio[:, :, start * samples_per_latent:end * samples_per_latent] for start, end, _, _ in spans]
+            y_chunks = []
+            chunk_kwargs = _chunk_call_kwargs(kwargs)
+            encode = lambda x: self.encode(x, **chunk_kwargs)
+            # encode the chunks, several at a time
+            for (start, end, keep_start, keep_end), y_chunk in zip(spans, iterate_micro_batches(x_chunks, chunk_batch_size, encode, self._auto_micro_batches)):
+                #  keep the part of the chunk no later chunk overwrites
+                y_chunks.append(y_chunk[:, :, keep_start - start:keep_end - start])
+            return torch.cat(y_chunks, dim=2)
     
-    def decode_audio(self, latents, chunked=False, overlap=32, chunk_size=128, **kwargs):
+    def decode_audio(self, latents, chunked=False, overlap=32, chunk_size=128, chunk_batch_size="auto", **kwargs):
         '''
         Decode latents to audio. 
         If chunked is True, split the latents into chunks of a given maximum size chunk_size, with given overlap, both of which are measured in number of latents. 
         A overlap of zero will cause discontinuity artefacts. Overlap should be => receptive field size. 
         Every autoencoder will have a different receptive field size, and thus ideal overlap.
-        You can determine it empirically by diffing unchunked vs chunked audio and looking at maximum diff.
+        calibrate_overlap measures it (see encode_audio).
         The final chunk may have a longer overlap in order to keep chunk_size consistent for all chunks.
         Smaller chunk_size uses less memory, but more compute.
         The chunk_size vs memory tradeoff isn't linear, and possibly depends on the GPU and CUDA version
         For example, on a A6000 chunk_size 128 is overall faster than 256 and 512 even though it has more chunks
+        Chunks are folded into the batch dimension, chunk_batch_size at a time, and micro_batch only
+        applies to unchunked calls (see encode_audio).
         '''
         if not chunked:
             # default behavior. Decode the entire latent in parallel
             return self.decode(latents, **kwargs)
         else:
-            # chunked decoding
-            hop_size = chunk_size - overlap
-            total_size = latents.shape[2]
-            batch_size = latents.shape[0]
-            chunks = []
-            for i in range(0, total_size - chunk_size + 1, hop_size):
-                chunk = latents[:,:,i:i+chunk_size]
-                chunks.append(chunk)
-            if i+chunk_size != total_size:
-                # Final chunk
-                chunk = latents[:,:,-chunk_size:]
-                chunks.append(chunk)
-            chunks = torch.stack(chunks)
-            num_chunks = chunks.shape[0]
-            # samples_per_latent is just the downsampling ratio
-            samples_per_latent = self.downsampling_ratio
-            # Create an empty waveform, we will populate it with chunks as decode them
-            y_size = total_size * samples_per_latent
-            y_final = torch.zeros((batch_size,self.out_channels,y_size)).to(latents.device)
-            for i in range(num_chunks):
-                x_chunk = chunks[i,:]
-                # decode the chunk
-                y_chunk = self.decode(x_chunk)
-                # figure out where to put the audio along the time domain
-                if i == num_chunks-1:
-                    # final chunk always goes at the end
-                    t_end = y_size
-                    t_start = t_end - y_chunk.shape[2]
-                else:
-                    t_start = i * hop_size * samples_per_latent
-                    t_end = t_start + chunk_size * samples_per_latent
-                #  remove the edges of the overlaps
-                ol = (overlap//2) * samples_per_latent
-                chunk_start = 0
-                chunk_end = y_chunk.shape[2]
-                if i > 0:
-                    # no overlap for the start of the first chunk
-                    t_start += ol
-                    chunk_start += ol
-                if i < num_chunks-1:
-                    # no overlap for the end of the last chunk
-                    t_end -= ol
-                    chunk_end -= ol
-                # paste the chunked audio into our y_final output audio
-                y_final[:,:,t_start:t_end] = y_chunk[:,:,chunk_start:chunk_end]
-            return y_final
+            return torch.cat(list(self.decode_audio_stream(latents, overlap=overlap, chunk_size=chunk_size,
+                                                           chunk_batch_size=chunk_batch_size, **kwargs)), dim=2)
+
+    def decode_audio_stream(self, latents, overlap=32, chunk_size=128, chunk_batch_size=1, **kwargs):
+        '''
+        Generator version of chunked decode_audio, for progressive playback or chunked HTTP responses.
+        Yields finished, overlap-trimmed audio segments (Batch x Channels x Samples) in order as soon as
+        each chunk is decoded; concatenating them along the last dim gives the decode_audio(chunked=True) output.
+        Memory is bounded by chunk_size * chunk_batch_size regardless of the total latent length;
+        the default of 1 chunk per call gives the lowest time-to-first-audio.
+        '''
+        samples_per_latent = self.upsampling_ratio
+        spans = chunk_spans(latents.shape[2], chunk_size, overlap)
+        x_chunks = [latents[:, :, start:end] for start, end, _, _ in spans]
+        chunk_kwargs = _chunk_call_kwargs(kwargs)
+        decode = lambda x: self.decode(x, **chunk_kwargs)
+        for (start, end, keep_start, keep_end), y_chunk in zip(spans, iterate_micro_batches(x_chunks, chunk_batch_size, decode, self._auto_micro_batches)):
+            yield y_chunk[:, :, (keep_start - start) * samples_per_latent:(keep_end - start) * samples_per_latent]
 
     
 class DiffusionAutoencoder(AudioAutoencoder):
@@ -721,6 +820,8 @@ def create_autoencoder_from_config(config: Dict[str, Any]):
 
     soft_clip = ae_config["decoder"].get("soft_clip", False)
 
+    decoder_sample_rate = ae_config.get("decoder_sample_rate", None)
+
     return AudioAutoencoder(
         encoder,
         decoder,
@@ -732,7 +833,8 @@ def create_autoencoder_from_config(config: Dict[str, Any]):
         pretransform=pretransform,
         in_channels=in_channels,
         out_channels=out_channels,
-        soft_clip=soft_clip
+        soft_clip=soft_clip,
+        decoder_sample_rate=decoder_sample_rate
     )
 
 def create_diffAE_from_config(config: Dict[str, Any]):
@@ -301,6 +301,10 @@ class RMSNorm(nn.Module):
 def snake_beta(x, alpha, beta):
     return x + (1.0 / (beta + 0.000000001)) * pow(torch.sin(x * alpha), 2)
 
+def snake_beta_inference(x, alpha, inv_beta):
+    # snake_beta with exp(alpha) and 1 / (exp(beta) + eps) precomputed, the multiply-add fused into addcmul
+    return torch.addcmul(x, inv_beta, torch.sin(x * alpha).square())
+
 # try:
 #     snake_beta = torch.compile(snake_beta)
 # except RuntimeError:
@@ -327,8 +331,28 @@ class SnakeBeta(nn.Module):
         self.beta.requires_grad = alpha_trainable
 
         self.no_div_by_zero = 0.000000001
+        self.inference = False
+
+    @torch.no_grad()
+    def prepare_for_inference(self):
+        '''
+        Precomputes the exponentials and the reciprocal of beta from the current parameters.
+        Call again after loading new weights; training code should not use it.
+        '''
+        # computed in fp32 and stored in the parameter dtype
+        alpha = self.alpha.float().unsqueeze(0).unsqueeze(-1)
+        beta = self.beta.float().unsqueeze(0).unsqueeze(-1)
+        if self.alpha_logscale:
+            alpha = torch.exp(alpha)
+            beta = torch.exp(beta)
+        self.register_buffer("alpha_inference", alpha.to(self.alpha.dtype), persistent=False)
+        self.register_buffer("inv_beta_inference", (1.0 / (beta + self.no_div_by_zero)).to(self.beta.dtype), persistent=False)
+        self.inference = True
 
     def forward(self, x):
+        if self.inference:
+            return snake_beta_inference(x, self.alpha_inference, self.inv_beta_inference)
+
         alpha = self.alpha.unsqueeze(0).unsqueeze(-1) # line up with x to [B, C, T]
         beta = self.beta.unsqueeze(0).unsqueeze(-1)
         if self.alpha_logscale:
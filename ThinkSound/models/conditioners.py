@@ -10,6 +10,7 @@ import os
 from ..inference.utils import set_audio_channels
 from .factory import create_pretransform_from_config
 from .pretransforms import Pretransform
+from ..data.batch import BatchedMetadata
 from .utils import copy_state_dict
 from .utils import load_ckpt_state_dict
 import numpy as np
@@ -31,6 +32,9 @@ class Conditioner(nn.Module):
         self.output_dim = output_dim
         self.proj_out = nn.Linear(dim, output_dim) if (dim != output_dim or project_out) else nn.Identity()
 
+    # True if forward accepts the batch as one stacked tensor (see BatchedMetadata) instead of a list of per-sample values
+    accepts_batch = False
+
     def forward(self, x: tp.Any) -> tp.Any:
         raise NotImplementedError()
 
@@ -212,12 +216,19 @@ class Text_Linear(Conditioner):
 class mm_unchang(Conditioner):
     """ Transform the video feat encoder"""
 
+    accepts_batch = True
+
     def __init__(self, dim, output_dim):
         super().__init__(dim, output_dim)
 
     def forward(self, x, device: tp.Any = "cuda"):
         # import ipdb
         # ipdb.set_trace()
+        if isinstance(x, torch.Tensor):
+            # stacked in the DataLoader worker, asynchronous copy from pinned memory; always a fresh tensor
+            # (like torch.stack below) since callers mask the conditioning in place and the batch may
+            # already be on the device
+            return [x.to(device, non_blocking=True, copy=True)]
         if not isinstance(x[0], torch.Tensor):
             video_feats = []
             for path in x:
@@ -900,30 +911,35 @@ class MultiConditioner(nn.Module):
         self.conditioners = nn.ModuleDict(conditioners)
         self.default_keys = default_keys
 
-    def forward(self, batch_metadata: tp.List[tp.Dict[str, tp.Any]], device: tp.Union[torch.device, str]) -> tp.Dict[str, tp.Any]:
+    def forward(self, batch_metadata: tp.Sequence[tp.Dict[str, tp.Any]], device: tp.Union[torch.device, str]) -> tp.Dict[str, tp.Any]:
         output = {}
+        batched = batch_metadata.tensors if isinstance(batch_metadata, BatchedMetadata) else {}
 
         for key, conditioner in self.conditioners.items():
             condition_key = key
 
-            conditioner_inputs = []
+            if conditioner.accepts_batch and (key in batched or self.default_keys.get(key) in batched):
+                # the whole batch as one tensor stacked by collation, no per-sample loop
+                conditioner_inputs = batched[key if key in batched else self.default_keys[key]]
+            else:
+                conditioner_inputs = []
+
+                for x in batch_metadata:
 
-            for x in batch_metadata:
+                    if condition_key not in x:
+                        if condition_key in self.default_keys:
+                            condition_key = self.default_keys[condition_key]
+                        else:
+                            raise ValueError(f"Conditioner key {condition_key} not found in batch metadata")
 
-                if condition_key not in x:
-                    if condition_key in self.default_keys:
-                        condition_key = self.default_keys[condition_key]
+                    #Unwrap the condition info if it's a single-element list or tuple, this is to support collation functions that wrap everything in a list
+                    if isinstance(x[condition_key], list) or isinstance(x[condition_key], tuple) and len(x[condition_key]) == 1:
+                        conditioner_input = x[condition_key][0]
+                        
                     else:
-                        raise ValueError(f"Conditioner key {condition_key} not found in batch metadata")
-
-                #Unwrap the condition info if it's a single-element list or tuple, this is to support collation functions that wrap everything in a list
-                if isinstance(x[condition_key], list) or isinstance(x[condition_key], tuple) and len(x[condition_key]) == 1:
-                    conditioner_input = x[condition_key][0]
-                    
-                else:
-                    conditioner_input = x[condition_key]
+                        conditioner_input = x[condition_key]
 
-                conditioner_inputs.append(conditioner_input)
+                    conditioner_inputs.append(conditioner_input)
             
             cond_output = conditioner(conditioner_inputs, device)
             if len(cond_output) == 1:
@@ -1002,4 +1018,19 @@ def create_multi_conditioner_from_conditioning_config(config: tp.Dict[str, tp.An
         else:
             raise ValueError(f"Unknown conditioner type: {conditioner_type}")
 
-    return MultiConditioner(conditioners, default_keys=default_keys)
\ No newline at end of file
+    return MultiConditioner(conditioners, default_keys=default_keys)
+
+
+def get_conditioning_keys(model_config: tp.Dict[str, tp.Any]) -> tp.Set[str]:
+    """
+    The batch metadata keys a model conditions on: the conditioner ids, including the mm_cond_ids of the diffusion
+    model, and their default_keys fallbacks. Datasets use it to load only these features.
+
+    Args:
+        model_config: the model config dictionary (the "model" section of a model config file)
+    """
+    conditioning_config = model_config.get("conditioning", {})
+    keys = {conditioner_info["id"] for conditioner_info in conditioning_config.get("configs", [])}
+    keys.update(conditioning_config.get("default_keys", {}).values())
+    keys.update(model_config.get("diffusion", {}).get("mm_cond_ids", []))
+    return keys
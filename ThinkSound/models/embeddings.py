@@ -21,7 +21,7 @@ def compute_rope_rotations(length: int,
                            device: Union[torch.device, str] = 'cpu') -> Tensor:
     assert dim % 2 == 0
 
-    with torch.amp.autocast(device_type='cuda', enabled=False):
+    with torch.amp.autocast(device_type=torch.device(device).type, enabled=False):
         pos = torch.arange(length, dtype=torch.float32, device=device)
         freqs = 1.0 / (theta**(torch.arange(0, dim, 2, dtype=torch.float32, device=device) / dim))
         freqs *= freq_scaling
@@ -33,7 +33,7 @@ def compute_rope_rotations(length: int,
 
 
 def apply_rope(x: Tensor, rot: Tensor) -> tuple[Tensor, Tensor]:
-    with torch.amp.autocast(device_type='cuda', enabled=False):
+    with torch.amp.autocast(device_type=x.device.type, enabled=False):
         _x = x.float()
         _x = _x.view(*_x.shape[:-1], -1, 1, 2)
         x_out = rot[..., 0] * _x[..., 0] + rot[..., 1] * _x[..., 1]
@@ -49,9 +49,14 @@ def create_pretransform_from_config(pretransform_config, sample_rate):
         scale = pretransform_config.get("scale", 1.0)
         model_half = pretransform_config.get("model_half", False)
         iterate_batch = pretransform_config.get("iterate_batch", False)
+        vae_micro_batch = pretransform_config.get("vae_micro_batch", None)
         chunked = pretransform_config.get("chunked", False)
+        precision = pretransform_config.get("precision", None)
+        encode_overlap = pretransform_config.get("encode_overlap", None)
+        decode_overlap = pretransform_config.get("decode_overlap", None)
 
-        pretransform = AutoencoderPretransform(autoencoder, scale=scale, model_half=model_half, iterate_batch=iterate_batch, chunked=chunked)
+        pretransform = AutoencoderPretransform(autoencoder, scale=scale, model_half=model_half, iterate_batch=iterate_batch, chunked=chunked, precision=precision, vae_micro_batch=vae_micro_batch,
+                                               encode_overlap=encode_overlap, decode_overlap=decode_overlap)
     elif pretransform_type == 'wavelet':
         from .pretransforms import WaveletPretransform
 
@@ -9,7 +9,7 @@ import sys
 from .embeddings import compute_rope_rotations
 from .embeddings import TimestepEmbedder
 from .blocks import MLP, ChannelLastConv1d, ConvMLP
-from .transformer_layers import (FinalBlock, JointBlock, MMDitSingleBlock)
+from .transformer_layers import (FinalBlock, JointBlock, MMDitSingleBlock, QKVWorkspace)
 from .utils import resample
 
 log = logging.getLogger()
@@ -52,7 +52,9 @@ class MMmodule(nn.Module):
                  cross_attend: bool = False,
                  add_video: bool = False,
                  triple_fusion: bool = False,
-                 gated_video: bool = False) -> None:
+                 gated_video: bool = False,
+                 clip_merge_ratio: float = 0.0,
+                 text_merge_ratio: float = 0.0) -> None:
         super().__init__()
 
         self.v2 = v2
@@ -68,6 +70,7 @@ class MMmodule(nn.Module):
         self.gated_video = gated_video
         self.triple_fusion = triple_fusion
         self.use_inpaint = use_inpaint
+        self._compiled_blocks = False
         if self.gated_video:
             self.gated_mlp = nn.Sequential(
                 nn.LayerNorm(hidden_dim * 2),
@@ -172,11 +175,16 @@ class MMmodule(nn.Module):
             self.t_embed = TimestepEmbedder(hidden_dim,
                                             frequency_embedding_size=256,
                                             max_period=10000)
+        # joint q/k/v buffer of this model's joint blocks at inference, freed by release_workspace
+        self.qkv_workspace = QKVWorkspace()
         self.joint_blocks = nn.ModuleList([
             JointBlock(hidden_dim,
                        num_heads,
                        mlp_ratio=mlp_ratio,
-                       pre_only=(i == depth - fused_depth - 1)) for i in range(depth - fused_depth)
+                       pre_only=(i == depth - fused_depth - 1),
+                       clip_merge_ratio=clip_merge_ratio,
+                       text_merge_ratio=text_merge_ratio,
+                       workspace=self.qkv_workspace) for i in range(depth - fused_depth)
         ])
 
         self.fused_blocks = nn.ModuleList([
@@ -220,6 +228,48 @@ class MMmodule(nn.Module):
         self._sync_seq_len = sync_seq_len
         self.initialize_rotations()
 
+    def match_seq_lengths(self, latent_seq_len: int, clip_seq_len: int, sync_seq_len: int) -> None:
+        """
+        switches to the sequence lengths of a batch, duration-bucketed batches (DurationBucketBatchSampler)
+        differ from batch to batch; the rotations are only recomputed on a change
+        """
+        if (latent_seq_len, clip_seq_len, sync_seq_len) != (self._latent_seq_len, self._clip_seq_len, self._sync_seq_len):
+            self.update_seq_lengths(latent_seq_len, clip_seq_len, sync_seq_len)
+
+    def set_token_merge(self, clip_merge_ratio: float = 0.0, text_merge_ratio: float = 0.0) -> None:
+        """
+        token merging for the clip/text streams of the joint blocks, as a fraction of the tokens
+        merged per block (at most 0.5); 0 disables it
+        """
+        for block in self.joint_blocks:
+            block.clip_merge_ratio = clip_merge_ratio
+            block.text_merge_ratio = text_merge_ratio
+
+    def release_workspace(self) -> None:
+        """
+        frees the joint q/k/v workspace kept between sampling steps, the next inference forward
+        allocates it again
+        """
+        self.qkv_workspace.release()
+
+    def compile_blocks(self, **compile_kwargs) -> None:
+        """
+        regional compilation: each joint/fused block is compiled on its own, so the repeated blocks
+        share compiled code and the conditioners/pretransform stay eager.
+        sequence dimensions are marked dynamic in predict_flow so a new duration does not recompile
+        """
+        for block in [*self.joint_blocks, *self.fused_blocks]:
+            block.compile(**compile_kwargs)
+        self._compiled_blocks = True
+
+    def _mark_seq_dynamic(self, *tensors: torch.Tensor) -> None:
+        if not self._compiled_blocks:
+            return
+        import torch._dynamo
+        for x in tensors:
+            # all sequence-carrying tensors (features and rope rotations) keep the sequence in dim 1
+            torch._dynamo.maybe_mark_dynamic(x, 1)
+
     def initialize_weights(self):
 
         def _basic_init(module):
@@ -343,6 +393,7 @@ class MMmodule(nn.Module):
         global_c = self.t_embed(t).unsqueeze(1) + global_c.unsqueeze(1)  # (B, D)
         extended_c = global_c + sync_f
 
+        self._mark_seq_dynamic(latent, clip_f, extended_c, self.latent_rot, self.clip_rot)
         for block in self.joint_blocks:
             latent, clip_f, text_f = block(latent, clip_f, text_f, global_c, extended_c,
                                            self.latent_rot, self.clip_rot)  # (B, N, D)
@@ -366,6 +417,7 @@ class MMmodule(nn.Module):
             else:
                 latent = latent + clip_f
         
+        self._mark_seq_dynamic(latent)
         for block in self.fused_blocks:
             if self.cross_attend:
                 latent = block(latent, extended_c, self.latent_rot, context=text_f)
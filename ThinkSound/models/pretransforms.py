@@ -1,7 +1,16 @@
+from contextlib import nullcontext
+
 import torch
 from einops import rearrange
 from torch import nn
 
+PRECISIONS = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+def _match_input_dtype(module, args):
+    # forward pre-hook for layers kept at a different precision than the rest of the model
+    dtype = next(module.parameters()).dtype
+    return tuple(a.to(dtype) if torch.is_tensor(a) and a.is_floating_point() else a for a in args)
+
 class Pretransform(nn.Module):
     def __init__(self, enable_grad, io_channels, is_discrete):
         super().__init__()
@@ -26,7 +35,8 @@ class Pretransform(nn.Module):
         raise NotImplementedError
 
 class AutoencoderPretransform(Pretransform):
-    def __init__(self, model, scale=1.0, model_half=False, iterate_batch=False, chunked=False):
+    def __init__(self, model, scale=1.0, model_half=False, iterate_batch=False, chunked=False, precision=None, vae_micro_batch=None,
+                 encode_overlap=None, decode_overlap=None):
         super().__init__(enable_grad=False, io_channels=model.io_channels, is_discrete=model.bottleneck is not None and model.bottleneck.is_discrete)
         self.model = model
         self.model.requires_grad_(False).eval()
@@ -34,45 +44,136 @@ class AutoencoderPretransform(Pretransform):
         self.downsampling_ratio = model.downsampling_ratio
         self.io_channels = model.io_channels
         self.sample_rate = model.sample_rate
+        self.decoder_sample_rate = model.decoder_sample_rate
         
-        self.model_half = model_half
-        self.iterate_batch = iterate_batch
+        # precision is fixed here: "fp32", "fp16" or "bf16" (model_half is the legacy spelling of "fp16");
+        # left unset, the weights stay fp32 and an outer autocast region still decides the compute dtype
+        self.precision_configured = precision is not None or model_half
+        if precision is None:
+            precision = "fp16" if model_half else "fp32"
+        assert precision in PRECISIONS, f"Unknown precision {precision}, expected one of {list(PRECISIONS)}"
+        self.precision = precision
+        self.model_half = precision == "fp16"
+        # samples per VAE call: an int, "auto" (sized to the free memory) or None for the whole batch
+        # (iterate_batch=True is the legacy spelling of 1); chunked calls are sized by chunk_batch_size instead
+        if vae_micro_batch is None and iterate_batch:
+            vae_micro_batch = 1
+        assert vae_micro_batch is None or vae_micro_batch == "auto" or int(vae_micro_batch) >= 1, \
+            f"vae_micro_batch must be a positive int, \"auto\" or None, got {vae_micro_batch}"
+        self.vae_micro_batch = vae_micro_batch
 
         self.encoded_channels = model.latent_dim
 
         self.chunked = chunked
+        # chunk overlaps in latents measured for this model (see calibrate_vae_overlap.py), None keeps the default
+        self.encode_overlap = encode_overlap
+        self.decode_overlap = decode_overlap
         self.num_quantizers = model.bottleneck.num_quantizers if model.bottleneck is not None and model.bottleneck.is_discrete else None
         self.codebook_size = model.bottleneck.codebook_size if model.bottleneck is not None and model.bottleneck.is_discrete else None
 
-        if self.model_half:
-            self.model.half()
+        self.prepared = False
+
+        # the final convs of the encoder (latent statistics) and decoder (waveform) always run in fp32
+        for module in self._fp32_modules():
+            module.register_forward_pre_hook(_match_input_dtype)
+        self._apply_precision()
+
+    @property
+    def dtype(self):
+        return PRECISIONS[self.precision]
+
+    def _fp32_modules(self):
+        modules = []
+        for part in (self.model.encoder, self.model.decoder):
+            convs = [m for m in part.modules() if isinstance(m, nn.Conv1d)] if part is not None else []
+            if convs:
+                modules.append(convs[-1])
+        return modules
+
+    def _apply_precision(self):
+        # one cast of the module tree at load time instead of on every call
+        self.model.to(self.dtype)
+        for module in self._fp32_modules():
+            module.float()
+
+    def _autocast_disabled(self, x):
+        # once prepared for inference, a configured precision, not an outer autocast region, decides the VAE
+        # compute dtype; in training (e.g. bf16-mixed) and without a configured precision the VAE keeps
+        # running under the caller's autocast (fp16 in predict.py), as it did before precision existed
+        if not self.prepared or not self.precision_configured:
+            return nullcontext()
+        return torch.autocast(device_type=x.device.type, enabled=False)
+
+    def prepare_for_inference(self):
+        '''
+        Bakes weight norm and precomputes the Snake activations of the autoencoder (inference only)
+        '''
+        # bake in fp32, then return to the configured precision
+        self.model.float()
+        self.model.prepare_for_inference()
+        self.prepared = True
+        self._apply_precision()
+        return self
+
+    def save_inference_checkpoint(self, path, decoder_only=False, dtype=None):
+        '''
+        Saves the prepared autoencoder as a safetensors file with the same 'autoencoder.' key prefix
+        as the training checkpoints, optionally without the encoder and/or cast to a smaller dtype.
+        '''
+        from safetensors.torch import save_file
+
+        if not self.prepared:
+            self.prepare_for_inference()
+        state_dict = {}
+        for k, v in self.model.state_dict().items():
+            if decoder_only and k.startswith("encoder."):
+                continue
+            if dtype is not None and v.is_floating_point():
+                v = v.to(dtype)
+            state_dict[f"autoencoder.{k}"] = v.detach().cpu().contiguous()
+        save_file(state_dict, path, metadata={"format": "inference", "decoder_only": str(decoder_only)})
     
-    def encode(self, x, **kwargs):
-        
-        if self.model_half:
-            x = x.half()
-            self.model.to(torch.float16)
+    @staticmethod
+    def _with_overlap(kwargs, overlap):
+        if kwargs.get("overlap") is None:
+            kwargs.pop("overlap", None)
+            if overlap is not None:
+                kwargs["overlap"] = overlap
+        return kwargs
 
-        encoded = self.model.encode_audio(x, chunked=self.chunked, iterate_batch=self.iterate_batch, **kwargs)
+    def encode(self, x, **kwargs):
+        kwargs = self._with_overlap(kwargs, self.encode_overlap)
 
-        if self.model_half:
-            encoded = encoded.float()
+        with self._autocast_disabled(x):
+            encoded = self.model.encode_audio(x.to(self.dtype), chunked=self.chunked, micro_batch=self.vae_micro_batch, **kwargs)
 
-        return encoded / self.scale
+        return encoded.float() / self.scale
 
     def decode(self, z, **kwargs):
+        kwargs = self._with_overlap(kwargs, self.decode_overlap)
         z = z * self.scale
 
-        if self.model_half:
-            z = z.half()
-            self.model.to(torch.float16)
-
-        decoded = self.model.decode_audio(z, chunked=self.chunked, iterate_batch=self.iterate_batch, **kwargs)
+        with self._autocast_disabled(z):
+            decoded = self.model.decode_audio(z.to(self.dtype), chunked=self.chunked, micro_batch=self.vae_micro_batch, **kwargs)
 
-        if self.model_half:
-            decoded = decoded.float()
+        return decoded.float()
+    
+    def decode_stream(self, z, chunk_size=128, overlap=None, **kwargs):
+        '''
+        Streaming chunked decode, yields finished audio segments in order (see AudioAutoencoder.decode_audio_stream)
+        '''
+        kwargs = self._with_overlap({**kwargs, "overlap": overlap}, self.decode_overlap)
+        z = z * self.scale
 
-        return decoded
+        stream = self.model.decode_audio_stream(z.to(self.dtype), chunk_size=chunk_size,
+                                                micro_batch=self.vae_micro_batch, **kwargs)
+        while True:
+            # autocast is re-entered per segment so it does not leak into the consumer between yields
+            with self._autocast_disabled(z):
+                decoded = next(stream, None)
+            if decoded is None:
+                return
+            yield decoded.float()
     
     def tokenize(self, x, **kwargs):
         assert self.model.is_discrete, "Cannot tokenize with a continuous model"
@@ -87,8 +188,25 @@ class AutoencoderPretransform(Pretransform):
         return self.model.decode_tokens(tokens, **kwargs)
     
     def load_state_dict(self, state_dict, strict=True):
+        # Inference checkpoints (see save_inference_checkpoint) have no weight norm parameters and may lack the encoder
+        is_weight_normed = lambda keys: any(k.endswith(("weight_g", "weight_v")) or ".parametrizations." in k for k in keys)
+        if not is_weight_normed(state_dict):
+            if is_weight_normed(self.model.state_dict()):
+                self.prepare_for_inference()
+            if self.model.encoder is not None and not any(k.startswith("encoder.") for k in state_dict):
+                # decoder-only checkpoint
+                self.model.encoder = None
+                strict = False
+
+        # load and bake at full precision, then return to the configured precision
+        self.model.float()
         self.model.load_state_dict(state_dict, strict=strict)
 
+        if self.prepared:
+            # the precomputed activations depend on the loaded parameters
+            self.model.prepare_for_inference()
+        self._apply_precision()
+
 class WaveletPretransform(Pretransform):
     def __init__(self, channels, levels, wavelet):
         super().__init__(enable_grad=False, io_channels=channels, is_discrete=False)
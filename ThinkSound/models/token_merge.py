@@ -0,0 +1,97 @@
+# Token merging adapted from https://github.com/facebookresearch/ToMe (Bolya et al., "Token Merging: Your ViT But Faster")
+from typing import Callable, Optional
+
+import torch
+from einops import rearrange
+
+
+def _identity(x: torch.Tensor) -> torch.Tensor:
+    return x
+
+
+def bipartite_soft_matching(metric: torch.Tensor, r: int) -> tuple[Callable, Callable]:
+    """
+    Splits the tokens into two alternating sets and merges the r most similar tokens of the
+    first set into their best match in the second set.
+
+    metric: (B, N, C) similarity features, e.g. the keys averaged over heads
+    r: number of tokens to remove, at most N // 2
+    Returns (merge, unmerge): merge maps (B, N, C) -> (B, N - r, C), unmerge copies every
+    merged output back to all of its source positions, (B, N - r, C) -> (B, N, C).
+    """
+    t = metric.shape[1]
+    r = min(r, t // 2)
+    if r <= 0:
+        return _identity, _identity
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[..., ::2, :], metric[..., 1::2, :]
+        scores = a @ b.transpose(-1, -2)
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+
+        unm_idx = edge_idx[..., r:, :]  # tokens of the first set that stay
+        src_idx = edge_idx[..., :r, :]  # tokens of the first set that are merged
+        dst_idx = node_idx[..., None].gather(dim=-2, index=src_idx)
+
+    def merge(x: torch.Tensor, mode: str = "mean") -> torch.Tensor:
+        src, dst = x[..., ::2, :], x[..., 1::2, :]
+        n, t1, c = src.shape
+        unm = src.gather(dim=-2, index=unm_idx.expand(n, t1 - r, c))
+        src = src.gather(dim=-2, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce=mode)
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x: torch.Tensor) -> torch.Tensor:
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[..., :unm_len, :], x[..., unm_len:, :]
+        n, _, c = unm.shape
+
+        src = dst.gather(dim=-2, index=dst_idx.expand(n, r, c))
+
+        out = torch.zeros(n, t, c, device=x.device, dtype=x.dtype)
+        out[..., 1::2, :] = dst
+        out.scatter_(dim=-2, index=(2 * unm_idx).expand(n, unm_len, c), src=unm)
+        out.scatter_(dim=-2, index=(2 * src_idx).expand(n, r, c), src=src)
+        return out
+
+    return merge, unmerge
+
+
+def merge_qkv(qkv: tuple[torch.Tensor, torch.Tensor, torch.Tensor], ratio: float
+              ) -> tuple[tuple[torch.Tensor, torch.Tensor, torch.Tensor], Callable, Optional[torch.Tensor]]:
+    """
+    Merges similar tokens of one attention stream.
+
+    qkv: q, k, v of shape (B, H, N, D)
+    ratio: fraction of the N tokens to remove (capped at 0.5)
+    Returns the merged q, k, v, the unmerge function for (B, N', C) outputs and the (B, N')
+    token sizes used for proportional attention, or None when nothing was merged.
+    """
+    q, k, v = qkv
+    n = k.shape[2]
+    r = min(int(n * ratio), n // 2)
+    if r <= 0:
+        return qkv, _identity, None
+
+    h = k.shape[1]
+    merge, unmerge = bipartite_soft_matching(k.mean(dim=1), r)
+    q, k, v = (rearrange(merge(rearrange(t, 'b h n d -> b n (h d)')), 'b n (h d) -> b h n d', h=h)
+               for t in (q, k, v))
+    size = merge(torch.ones(k.shape[0], n, 1, device=k.device, dtype=k.dtype), mode="sum")
+    return (q, k, v), unmerge, size.squeeze(-1)
+
+
+def proportional_attention_bias(lengths: tuple[int, ...], sizes: tuple[Optional[torch.Tensor], ...],
+                                batch_size: int, dtype: torch.dtype, device: torch.device) -> Optional[torch.Tensor]:
+    """
+    log(size) key bias so a merged token is attended to as often as the tokens it replaced.
+    Returns a (B, 1, 1, sum(lengths)) additive mask, or None when no stream was merged.
+    """
+    if all(size is None for size in sizes):
+        return None
+    parts = [torch.zeros(batch_size, length, device=device, dtype=torch.float32) if size is None else size.float().log()
+             for length, size in zip(lengths, sizes)]
+    return torch.cat(parts, dim=1)[:, None, None, :].to(dtype)
@@ -8,6 +8,7 @@ from einops.layers.torch import Rearrange
 
 from .embeddings import apply_rope
 from .blocks import MLP, ChannelLastConv1d, ConvMLP
+from .token_merge import merge_qkv, proportional_attention_bias
 try:
     from flash_attn import flash_attn_func, flash_attn_kvpacked_func
     print('flash_attn installed, using Flash Attention')
@@ -21,7 +22,7 @@ def modulate(x: torch.Tensor, shift: torch.Tensor, scale: torch.Tensor):
     return x * (1 + scale) + shift
 
 
-def attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
+def attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, attn_bias: Optional[torch.Tensor] = None):
     # training will crash without these contiguous calls and the CUDNN limitation
     # I believe this is related to https://github.com/pytorch/pytorch/issues/133974
     # unresolved at the time of writing
@@ -30,7 +31,7 @@ def attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
     q = q.contiguous()
     k = k.contiguous()
     v = v.contiguous()
-    out = F.scaled_dot_product_attention(q, k, v)
+    out = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_bias)
     out = rearrange(out, 'b h n d -> b n (h d)').contiguous()
     return out
     q, k, v = map(lambda t: rearrange(t, 'b h n d -> b n h d').to(torch.bfloat16), (q, k, v))
@@ -208,11 +209,42 @@ class MMDitSingleBlock(nn.Module):
         return x
 
 
+class QKVWorkspace:
+    """
+    Inference-only (3, B, H, N_total, D) buffer the joint blocks of one model copy their streams' q/k/v
+    into, in place of three torch.cat results per block per step. The blocks run one after another, so
+    they share it, and it is reused across sampling steps. A new shape, dtype or device reallocates it;
+    release() frees it (e.g. before the VAE decode).
+    """
+    def __init__(self):
+        self.buffer: Optional[torch.Tensor] = None
+
+    def get(self, shape: tuple, dtype: torch.dtype, device: torch.device) -> torch.Tensor:
+        buffer = self.buffer
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype or buffer.device != device:
+            # drop the old buffer before allocating, so the two never coexist
+            self.buffer = None
+            self.buffer = torch.empty(shape, dtype=dtype, device=device)
+        return self.buffer
+
+    def release(self) -> None:
+        self.buffer = None
+
+
 class JointBlock(nn.Module):
 
-    def __init__(self, dim: int, nhead: int, mlp_ratio: float = 4.0, pre_only: bool = False):
+    def __init__(self, dim: int, nhead: int, mlp_ratio: float = 4.0, pre_only: bool = False,
+                 clip_merge_ratio: float = 0.0, text_merge_ratio: float = 0.0,
+                 workspace: Optional[QKVWorkspace] = None, use_workspace: bool = True):
         super().__init__()
         self.pre_only = pre_only
+        # workspace: shared with the other joint blocks of the model (see QKVWorkspace);
+        # without one, or with use_workspace off, q/k/v are concatenated
+        self.workspace = workspace
+        self.use_workspace = use_workspace
+        # fraction of clip/text tokens merged (ToMe) before the joint attention, 0 disables
+        self.clip_merge_ratio = clip_merge_ratio
+        self.text_merge_ratio = text_merge_ratio
         self.latent_block = MMDitSingleBlock(dim,
                                              nhead,
                                              mlp_ratio,
@@ -237,25 +269,55 @@ class JointBlock(nn.Module):
         c_qkv, c_mod = self.clip_block.pre_attention(clip_f, global_c, clip_rot)
         t_qkv, t_mod = self.text_block.pre_attention(text_f, global_c, rot=None)
 
-        latent_len = latent.shape[1]
-        clip_len = clip_f.shape[1]
-        text_len = text_f.shape[1]
+        c_qkv, c_unmerge, c_size = merge_qkv(c_qkv, self.clip_merge_ratio)
+        t_qkv, t_unmerge, t_size = merge_qkv(t_qkv, self.text_merge_ratio)
 
-        joint_qkv = [torch.cat([x_qkv[i], c_qkv[i], t_qkv[i]], dim=2) for i in range(3)]
+        latent_len = latent.shape[1]
+        clip_len = c_qkv[0].shape[2]
+        text_len = t_qkv[0].shape[2]
+        attn_bias = proportional_attention_bias((latent_len, clip_len, text_len), (None, c_size, t_size),
+                                                latent.shape[0], x_qkv[0].dtype, latent.device)
+
+        if (self.workspace is not None and self.use_workspace and not torch.is_grad_enabled()
+                and not torch.compiler.is_compiling()):
+            joint_qkv = self._assemble_qkv(x_qkv, c_qkv, t_qkv)
+        else:
+            joint_qkv = [torch.cat([x_qkv[i], c_qkv[i], t_qkv[i]], dim=2) for i in range(3)]
 
-        attn_out = attention(*joint_qkv)
+        attn_out = attention(*joint_qkv, attn_bias=attn_bias)
         x_attn_out = attn_out[:, :latent_len]
         c_attn_out = attn_out[:, latent_len:latent_len + clip_len]
         t_attn_out = attn_out[:, latent_len + clip_len:]
 
         latent = self.latent_block.post_attention(latent, x_attn_out, x_mod)
         if not self.pre_only:
+            # per-token outputs are only needed when the clip/text streams continue
+            c_attn_out = c_unmerge(c_attn_out)
+            t_attn_out = t_unmerge(t_attn_out)
             clip_f = self.clip_block.post_attention(clip_f, c_attn_out, c_mod)
             text_f = self.text_block.post_attention(text_f, t_attn_out, t_mod)
 
         return latent, clip_f, text_f
 
 
+    def _assemble_qkv(self, x_qkv, c_qkv, t_qkv) -> torch.Tensor:
+        # the same copies as torch.cat, into the slices of the reused workspace instead of three new
+        # tensors (q/k/v come out of RMSNorm and RoPE, so they cannot be produced in place);
+        # q, k and v are contiguous views of the buffer
+        b, h, _, d = x_qkv[0].shape
+        lengths = (x_qkv[0].shape[2], c_qkv[0].shape[2], t_qkv[0].shape[2])
+        dtype = torch.result_type(x_qkv[0], c_qkv[0])
+        dtype = torch.promote_types(dtype, t_qkv[0].dtype)
+        workspace = self.workspace.get((3, b, h, sum(lengths), d), dtype, x_qkv[0].device)
+
+        start = 0
+        for stream_qkv, length in zip((x_qkv, c_qkv, t_qkv), lengths):
+            for i in range(3):
+                workspace[i, :, :, start:start + length].copy_(stream_qkv[i])
+            start += length
+        return workspace
+
+
 class FinalBlock(nn.Module):
 
     def __init__(self, dim, out_dim):
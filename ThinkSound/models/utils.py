@@ -2,7 +2,7 @@ import torch
 from safetensors.torch import load_file
 from torch import nn, Tensor, einsum, IntTensor, FloatTensor, BoolTensor
 #from torchcubicspline import natural_cubic_spline_coeffs, NaturalCubicSpline
-from torch.nn.utils import remove_weight_norm
+from torch.nn.utils import remove_weight_norm, parametrize
 
 def load_ckpt_state_dict(ckpt_path, prefix=None):
     if ckpt_path.endswith(".safetensors"):
@@ -16,10 +16,13 @@ def load_ckpt_state_dict(ckpt_path, prefix=None):
     return filtered_state_dict
 
 def remove_weight_norm_from_model(model):
-    for module in model.modules():
-        if hasattr(module, "weight"):
-            print(f"Removing weight norm from {module}")
+    # Bakes g * v / ||v|| into a plain weight, only for modules that actually carry weight norm
+    # (the hook-based torch.nn.utils.weight_norm used by dac, or the parametrization-based one)
+    for module in list(model.modules()):
+        if hasattr(module, "weight_g") and hasattr(module, "weight_v"):
             remove_weight_norm(module)
+        elif parametrize.is_parametrized(module, "weight"):
+            parametrize.remove_parametrizations(module, "weight", leave_parametrized=True)
 
     return model
 
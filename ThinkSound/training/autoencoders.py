@@ -31,7 +31,8 @@ class AutoencoderTrainingWrapper(L.LightningModule):
             ema_copy = None,
             force_input_mono = False,
             latent_mask_ratio = 0.0,
-            teacher_model: AudioAutoencoder = None
+            teacher_model: AudioAutoencoder = None,
+            decoder_only: bool = False
     ):
         super().__init__()
 
@@ -48,6 +49,13 @@ class AutoencoderTrainingWrapper(L.LightningModule):
 
         self.teacher_model = teacher_model
 
+        # Only train the decoder, e.g. a preview decoder reading the latents of a frozen encoder
+        self.decoder_only = decoder_only
+
+        # Losses are computed at the decoder output rate, reals and teacher outputs are resampled to it
+        self.sample_rate = sample_rate
+        self.loss_sample_rate = self.autoencoder.decoder_sample_rate
+
         if optimizer_configs is None:
             optimizer_configs ={
                 "autoencoder": {
@@ -124,30 +132,35 @@ class AutoencoderTrainingWrapper(L.LightningModule):
         stft_loss_args = loss_config['spectral']['config']
 
         if self.autoencoder.out_channels == 2:
-            self.sdstft = SumAndDifferenceSTFTLoss(sample_rate=sample_rate, **stft_loss_args)
-            self.lrstft = MultiResolutionSTFTLoss(sample_rate=sample_rate, **stft_loss_args)
+            self.sdstft = SumAndDifferenceSTFTLoss(sample_rate=self.loss_sample_rate, **stft_loss_args)
+            self.lrstft = MultiResolutionSTFTLoss(sample_rate=self.loss_sample_rate, **stft_loss_args)
         elif self.autoencoder.out_channels == 4:
-            # self.sdstft = SpatialSTFTLoss(sample_rate=sample_rate, **stft_loss_args)
-            self.sdstft = MultiResolutionSTFTLoss(sample_rate=sample_rate, **stft_loss_args)
+            # self.sdstft = SpatialSTFTLoss(sample_rate=self.loss_sample_rate, **stft_loss_args)
+            self.sdstft = MultiResolutionSTFTLoss(sample_rate=self.loss_sample_rate, **stft_loss_args)
         else:
-            self.sdstft = MultiResolutionSTFTLoss(sample_rate=sample_rate, **stft_loss_args)
+            self.sdstft = MultiResolutionSTFTLoss(sample_rate=self.loss_sample_rate, **stft_loss_args)
+
+        # Discriminator (optional, a null discriminator config trains with the spectral and distillation losses only)
 
-        # Discriminator
+        self.discriminator = None
 
-        if loss_config['discriminator']['type'] == 'oobleck':
+        if loss_config.get('discriminator') is None:
+            pass
+        elif loss_config['discriminator']['type'] == 'oobleck':
             self.discriminator = OobleckDiscriminator(**loss_config['discriminator']['config'])
         elif loss_config['discriminator']['type'] == 'encodec':
             self.discriminator = EncodecDiscriminator(in_channels=self.autoencoder.out_channels, **loss_config['discriminator']['config'])
         elif loss_config['discriminator']['type'] == 'dac':
-            self.discriminator = DACGANLoss(channels=self.autoencoder.out_channels, sample_rate=sample_rate, **loss_config['discriminator']['config'])
+            self.discriminator = DACGANLoss(channels=self.autoencoder.out_channels, sample_rate=self.loss_sample_rate, **loss_config['discriminator']['config'])
 
         self.gen_loss_modules = []
 
         # Adversarial and feature matching losses
-        self.gen_loss_modules += [
-            ValueLoss(key='loss_adv', weight=self.loss_config['discriminator']['weights']['adversarial'], name='loss_adv'),
-            ValueLoss(key='feature_matching_distance', weight=self.loss_config['discriminator']['weights']['feature_matching'], name='feature_matching'),
-        ]
+        if self.discriminator is not None:
+            self.gen_loss_modules += [
+                ValueLoss(key='loss_adv', weight=self.loss_config['discriminator']['weights']['adversarial'], name='loss_adv'),
+                ValueLoss(key='feature_matching_distance', weight=self.loss_config['discriminator']['weights']['feature_matching'], name='feature_matching'),
+            ]
 
         if self.teacher_model is not None:
             # Distillation losses
@@ -223,7 +236,15 @@ class AutoencoderTrainingWrapper(L.LightningModule):
 
     def configure_optimizers(self):
 
-        opt_gen = create_optimizer_from_config(self.optimizer_configs['autoencoder']['optimizer'], self.autoencoder.parameters())
+        gen_params = self.autoencoder.decoder.parameters() if self.decoder_only else self.autoencoder.parameters()
+        opt_gen = create_optimizer_from_config(self.optimizer_configs['autoencoder']['optimizer'], gen_params)
+
+        if self.discriminator is None:
+            if "scheduler" in self.optimizer_configs['autoencoder']:
+                sched_gen = create_scheduler_from_config(self.optimizer_configs['autoencoder']['scheduler'], opt_gen)
+                return [opt_gen], [sched_gen]
+            return [opt_gen]
+
         opt_disc = create_optimizer_from_config(self.optimizer_configs['discriminator']['optimizer'], self.discriminator.parameters())
 
         if "scheduler" in self.optimizer_configs['autoencoder'] and "scheduler" in self.optimizer_configs['discriminator']:
@@ -232,6 +253,13 @@ class AutoencoderTrainingWrapper(L.LightningModule):
             return [opt_gen, opt_disc], [sched_gen, sched_disc]
 
         return [opt_gen, opt_disc]
+
+    def to_loss_rate(self, audio, sample_rate=None):
+        """Resamples audio at sample_rate (default: the input rate) to the decoder output rate."""
+        sample_rate = sample_rate if sample_rate is not None else self.sample_rate
+        if sample_rate == self.loss_sample_rate:
+            return audio
+        return torchaudio.functional.resample(audio, sample_rate, self.loss_sample_rate)
   
     def training_step(self, batch, batch_idx):
         reals, _ = batch
@@ -245,10 +273,12 @@ class AutoencoderTrainingWrapper(L.LightningModule):
 
         loss_info = {}
 
-        loss_info["reals"] = reals
-
         encoder_input = reals
 
+        reals = self.to_loss_rate(reals)
+
+        loss_info["reals"] = reals
+
         if self.force_input_mono and encoder_input.shape[1] > 1:
             encoder_input = encoder_input.mean(dim=1, keepdim=True)
 
@@ -256,7 +286,7 @@ class AutoencoderTrainingWrapper(L.LightningModule):
 
         data_std = encoder_input.std()
 
-        if self.warmed_up and self.encoder_freeze_on_warmup:
+        if self.decoder_only or (self.warmed_up and self.encoder_freeze_on_warmup):
             with torch.no_grad():
                 latents, encoder_info = self.autoencoder.encode(encoder_input, return_info=True)
         else:
@@ -298,8 +328,9 @@ class AutoencoderTrainingWrapper(L.LightningModule):
         # Distillation
         if self.teacher_model is not None:
             with torch.no_grad():
-                teacher_decoded = self.teacher_model.decode(teacher_latents)
-                own_latents_teacher_decoded = self.teacher_model.decode(latents) #Distilled model's latents decoded by teacher
+                teacher_rate = self.teacher_model.decoder_sample_rate
+                teacher_decoded = self.to_loss_rate(self.teacher_model.decode(teacher_latents), teacher_rate)
+                own_latents_teacher_decoded = self.to_loss_rate(self.teacher_model.decode(latents), teacher_rate) #Distilled model's latents decoded by teacher
                 teacher_latents_own_decoded = self.autoencoder.decode(teacher_latents) #Teacher's latents decoded by distilled model
 
                 loss_info['teacher_decoded'] = teacher_decoded
@@ -307,7 +338,7 @@ class AutoencoderTrainingWrapper(L.LightningModule):
                 loss_info['teacher_latents_own_decoded'] = teacher_latents_own_decoded
 
        
-        if self.warmed_up:
+        if self.warmed_up and self.discriminator is not None:
             loss_dis, loss_adv, feature_matching_distance = self.discriminator.loss(reals, decoded)
         else:
             loss_dis = torch.tensor(0.).to(reals)
@@ -318,7 +349,10 @@ class AutoencoderTrainingWrapper(L.LightningModule):
         loss_info["loss_adv"] = loss_adv
         loss_info["feature_matching_distance"] = feature_matching_distance
 
-        opt_gen, opt_disc = self.optimizers()
+        if self.discriminator is not None:
+            opt_gen, opt_disc = self.optimizers()
+        else:
+            opt_gen, opt_disc = self.optimizers(), None
 
         lr_schedulers = self.lr_schedulers()
 
@@ -326,10 +360,13 @@ class AutoencoderTrainingWrapper(L.LightningModule):
         sched_disc = None
 
         if lr_schedulers is not None:
-            sched_gen, sched_disc = lr_schedulers
+            if self.discriminator is not None:
+                sched_gen, sched_disc = lr_schedulers
+            else:
+                sched_gen = lr_schedulers
 
         # Train the discriminator
-        if self.global_step % 2 and self.warmed_up:
+        if self.global_step % 2 and self.warmed_up and self.discriminator is not None:
             loss, losses = self.losses_disc(loss_info)
 
             log_dict = {
@@ -429,7 +466,7 @@ class AutoencoderDemoCallback(Callback):
             if module.force_input_mono:
                 encoder_input = encoder_input.mean(dim=1, keepdim=True)
 
-            demo_reals = demo_reals.to(module.device)
+            demo_reals = module.to_loss_rate(demo_reals.to(module.device))
 
             with torch.no_grad():
                 if module.use_ema:
@@ -452,10 +489,10 @@ class AutoencoderDemoCallback(Callback):
             
             filename = f'demos/recon_{trainer.global_step:08}.wav'
             reals_fakes = reals_fakes.to(torch.float32).clamp(-1, 1).mul(32767).to(torch.int16).cpu()
-            torchaudio.save(filename, reals_fakes, self.sample_rate)
+            torchaudio.save(filename, reals_fakes, module.loss_sample_rate)
 
             log_dict[f'recon'] = wandb.Audio(filename,
-                                                sample_rate=self.sample_rate,
+                                                sample_rate=module.loss_sample_rate,
                                                 caption=f'Reconstructed')
             
             log_dict[f'embeddings_3dpca'] = pca_point_cloud(latents)
@@ -14,6 +14,7 @@ from safetensors.torch import save_file
 from torch import optim
 from torch.nn import functional as F
 from pytorch_lightning.utilities.rank_zero import rank_zero_only
+from ..data.batch import stack_metadata
 from ..inference.sampling import get_alphas_sigmas, sample, sample_discrete_euler
 from ..models.diffusion import DiffusionModelWrapper, ConditionedDiffusionModelWrapper
 from ..models.autoencoders import DiffusionAutoencoder
@@ -139,6 +140,11 @@ class DiffusionCondTrainingWrapper(L.LightningModule):
 
         return [opt_diff]
 
+    def match_seq_lengths(self, latent_seq_len, conditioning):
+        # duration-bucketed batches (DurationBucketBatchSampler) change the sequence lengths from batch to batch
+        self.diffusion.model.model.match_seq_lengths(latent_seq_len, conditioning['metaclip_features'].shape[1],
+                                                     conditioning['sync_features'].shape[1])
+
     def training_step(self, batch, batch_idx):
         reals, metadata = batch
         # import ipdb
@@ -160,7 +166,7 @@ class DiffusionCondTrainingWrapper(L.LightningModule):
             conditioning = self.diffusion.conditioner(metadata, self.device)
             
 
-        video_exist = torch.stack([item['video_exist'] for item in metadata],dim=0)
+        video_exist = stack_metadata(metadata, 'video_exist')
         conditioning['metaclip_features'][~video_exist] = self.diffusion.model.model.empty_clip_feat
         conditioning['sync_features'][~video_exist] = self.diffusion.model.model.empty_sync_feat
         # If mask_padding is on, randomly drop the padding masks to allow for learning silence padding
@@ -168,7 +174,7 @@ class DiffusionCondTrainingWrapper(L.LightningModule):
 
         # Create batch tensor of attention masks from the "mask" field of the metadata array
         if use_padding_mask:
-            padding_masks = torch.stack([md["padding_mask"][0] for md in metadata], dim=0).to(self.device) # Shape (batch_size, sequence_length)
+            padding_masks = stack_metadata(metadata, "padding_mask")[:, 0].to(self.device) # Shape (batch_size, sequence_length)
 
         p.tick("conditioning")
 
@@ -190,6 +196,8 @@ class DiffusionCondTrainingWrapper(L.LightningModule):
                 if hasattr(self.diffusion.pretransform, "scale") and self.diffusion.pretransform.scale != 1.0:
                     diffusion_input = diffusion_input / self.diffusion.pretransform.scale
 
+        self.match_seq_lengths(diffusion_input.shape[2], conditioning)
+
         if self.max_mask_segments > 0:
             # Max mask size is the full sequence length
             max_mask_length = diffusion_input.shape[2]
@@ -300,7 +308,7 @@ class DiffusionCondTrainingWrapper(L.LightningModule):
 
             conditioning = self.diffusion.conditioner(metadata, self.device)
         
-        video_exist = torch.stack([item['video_exist'] for item in metadata],dim=0)
+        video_exist = stack_metadata(metadata, 'video_exist')
         conditioning['metaclip_features'][~video_exist] = self.diffusion.model.model.empty_clip_feat
         conditioning['sync_features'][~video_exist] = self.diffusion.model.model.empty_sync_feat
 
@@ -316,6 +324,7 @@ class DiffusionCondTrainingWrapper(L.LightningModule):
                 # Apply scale to pre-encoded latents if needed, as the pretransform encode function will not be run
                 if hasattr(self.diffusion.pretransform, "scale") and self.diffusion.pretransform.scale != 1.0:
                     diffusion_input = diffusion_input / self.diffusion.pretransform.scale
+        self.match_seq_lengths(diffusion_input.shape[2], conditioning)
         if self.max_mask_segments > 0:
             # Max mask size is the full sequence length
             max_mask_length = diffusion_input.shape[2]
@@ -374,9 +383,10 @@ class DiffusionCondTrainingWrapper(L.LightningModule):
         with torch.amp.autocast('cuda'):
             conditioning = self.diffusion.conditioner(metadata, self.device)
         
-        video_exist = torch.stack([item['video_exist'] for item in metadata],dim=0)
+        video_exist = stack_metadata(metadata, 'video_exist')
         conditioning['metaclip_features'][~video_exist] = self.diffusion.model.model.empty_clip_feat
         conditioning['sync_features'][~video_exist] = self.diffusion.model.model.empty_sync_feat
+        self.match_seq_lengths(length, conditioning)
 
         cond_inputs = self.diffusion.get_conditioning_inputs(conditioning)
         if batch_size > 1:
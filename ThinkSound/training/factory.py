@@ -1,6 +1,7 @@
 import torch
 from torch.nn import Parameter
 from ..models.factory import create_model_from_config
+from ..models.utils import load_ckpt_state_dict
 
 def create_training_wrapper_from_config(model_config, model):
     model_type = model_config.get('model_type', None)
@@ -8,7 +9,54 @@ def create_training_wrapper_from_config(model_config, model):
 
     training_config = model_config.get('training', None)
     assert training_config is not None, 'training config must be specified in model config'
-    if model_type == 'mm_diffusion_cond':
+    if model_type == 'autoencoder':
+        from .autoencoders import AutoencoderTrainingWrapper
+
+        ema_copy = None
+
+        use_ema = training_config.get("use_ema", False)
+
+        teacher_model = training_config.get("teacher_model", None)
+        if teacher_model is not None:
+            teacher_model = create_model_from_config(teacher_model)
+            teacher_model = teacher_model.eval().requires_grad_(False)
+
+            teacher_model_ckpt = training_config.get("teacher_model_ckpt", None)
+            if teacher_model_ckpt is None:
+                raise ValueError("teacher_model_ckpt must be specified if teacher_model is specified")
+            teacher_model.load_state_dict(load_ckpt_state_dict(teacher_model_ckpt, prefix=training_config.get("teacher_model_ckpt_prefix", None)))
+
+        decoder_only = training_config.get("decoder_only", False)
+        if decoder_only and teacher_model is not None:
+            # The trained decoder reads the teacher's latents, so the frozen encoder and bottleneck are the teacher's
+            encoder_state = {k: v for k, v in teacher_model.state_dict().items() if not k.startswith("decoder.")}
+            model.load_state_dict(encoder_state, strict=False)
+
+        if use_ema:
+            ema_copy = create_model_from_config(model_config)
+            # Copy each weight to the ema copy
+            for name, param in model.state_dict().items():
+                if isinstance(param, Parameter):
+                    # backwards compatibility for serialized parameters
+                    param = param.data
+                ema_copy.state_dict()[name].copy_(param)
+
+        return AutoencoderTrainingWrapper(
+            model,
+            lr=training_config["learning_rate"],
+            warmup_steps=training_config.get("warmup_steps", 0),
+            encoder_freeze_on_warmup=training_config.get("encoder_freeze_on_warmup", False),
+            sample_rate=model_config["sample_rate"],
+            loss_config=training_config.get("loss_configs", None),
+            optimizer_configs=training_config.get("optimizer_configs", None),
+            use_ema=use_ema,
+            ema_copy=ema_copy,
+            force_input_mono=training_config.get("force_input_mono", False),
+            latent_mask_ratio=training_config.get("latent_mask_ratio", 0.0),
+            teacher_model=teacher_model,
+            decoder_only=decoder_only
+        )
+    elif model_type == 'mm_diffusion_cond':
         from .diffusion import DiffusionCondTrainingWrapper
         return DiffusionCondTrainingWrapper(
             model, 
@@ -36,7 +84,16 @@ def create_demo_callback_from_config(model_config, **kwargs):
 
     demo_config = training_config.get("demo", {})
 
-    if model_type == 'mm_diffusion_cond':
+    if model_type == 'autoencoder':
+        from .autoencoders import AutoencoderDemoCallback
+
+        return AutoencoderDemoCallback(
+            demo_every=demo_config.get("demo_every", 2000),
+            sample_size=model_config["sample_size"],
+            sample_rate=model_config["sample_rate"],
+            **kwargs
+        )
+    elif model_type == 'mm_diffusion_cond':
         from .diffusion import DiffusionCondDemoCallback
 
         return DiffusionCondDemoCallback(
@@ -10,7 +10,12 @@ import tempfile
 from datetime import datetime
 from pathlib import Path
 
-def run_infer(stage, duration_sec, videos_dir, csv_path, results_dir, cwd, use_half=False):
+PREVIEW_DECODER_CONFIG = "ThinkSound/configs/model_configs/preview_decoder.json"
+PREVIEW_DECODER_CKPT = "ckpts/preview_decoder.ckpt"
+# the preview checkpoint is trained separately (not downloaded with the model), the toggle is only offered when present
+PREVIEW_AVAILABLE = (Path(__file__).parent / PREVIEW_DECODER_CKPT).is_file()
+
+def run_infer(stage, duration_sec, videos_dir, csv_path, results_dir, cwd, use_half=False, preview=False):
     cmd = (
         [sys.executable, "extract_latents.py", "--duration_sec", str(duration_sec),
          "--root", videos_dir, "--tsv_path", csv_path, "--save-dir", results_dir]
@@ -22,6 +27,10 @@ def run_infer(stage, duration_sec, videos_dir, csv_path, results_dir, cwd, use_h
     if stage == 1 and use_half:
         cmd.append("--use_half")
 
+    # quick listen: decode with the distilled low sample rate decoder
+    if stage == 2 and preview:
+        cmd += ["--preview-decoder-config", PREVIEW_DECODER_CONFIG, "--preview-decoder-ckpt-path", PREVIEW_DECODER_CKPT]
+
     process = subprocess.Popen(
         cmd,
         cwd=cwd,
@@ -71,7 +80,7 @@ def combine_audio_video(video_path, audio_path, output_path):
     )
     return result.returncode == 0, result.stderr
 
-def generate_audio(video, title, description, use_half):
+def generate_audio(video, title, description, use_half, preview=False):
     print("start")
     if not title:
         title = " "
@@ -129,7 +138,7 @@ def generate_audio(video, title, description, use_half):
 
     # 7. 推理
     yield "⏳ Inferring…", None
-    code, out = run_infer(stage=2, duration_sec=duration_sec,videos_dir=videos_dir,csv_path=csv_path,results_dir=results_dir, cwd=project_root)
+    code, out = run_infer(stage=2, duration_sec=duration_sec,videos_dir=videos_dir,csv_path=csv_path,results_dir=results_dir, cwd=project_root, preview=preview)
     if code != 0:
         yield "❌ Inference Failed", out
         return
@@ -188,7 +197,7 @@ demo = gr.Interface(
         gr.Textbox(label="Caption (optional)", optional=True),
         gr.Textbox(label="CoT Description (optional)", lines=6, optional=True),
         gr.Checkbox(label="Use Half Precision", value=False),
-    ],
+    ] + ([gr.Checkbox(label="Quick Preview (low sample rate)", value=False)] if PREVIEW_AVAILABLE else []),
     outputs=[
         gr.Textbox(label="Status"),
         gr.Video(label="Result"),
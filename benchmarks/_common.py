@@ -0,0 +1,66 @@
+"""
+Helpers shared by the benchmark scripts. Importing this module puts the repository root on sys.path, so the
+scripts, run as python benchmarks/<name>.py, can import ThinkSound, data_utils and predict.
+"""
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Union
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@dataclass
+class Measurement:
+    """Output of the last timed call, seconds per timed call and peak device memory in bytes (None off CUDA)."""
+    output: Any
+    times: List[float]
+    peak: Optional[int]
+
+    @property
+    def mean(self) -> float:
+        return sum(self.times) / len(self.times)
+
+    @property
+    def min(self) -> float:
+        return min(self.times)
+
+    def memory(self, suffix: str = "") -> str:
+        return f", peak {self.peak / 2**20:.0f} MB{suffix}" if self.peak is not None else ""
+
+
+def measure(fn: Callable[[], Any], device: Union[str, torch.device, None] = None, iters: int = 1, warmup: int = 1,
+            relative: bool = False) -> Measurement:
+    """
+    Calls fn warmup times, then times iters calls, synchronizing the device around each one.
+
+    On CUDA the peak memory statistics are reset after the warm-up, so the peak covers the timed calls only;
+    with relative=True it excludes what was already allocated when timing started (weights, inputs).
+    """
+    device = torch.device(device) if device is not None else torch.device('cpu')
+    is_cuda = device.type == 'cuda'
+
+    def synchronize():
+        if is_cuda:
+            torch.cuda.synchronize(device)
+
+    output = None
+    for _ in range(warmup):
+        output = fn()
+    synchronize()
+    baseline = 0
+    if is_cuda:
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = torch.cuda.memory_allocated(device) if relative else 0
+
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        output = fn()
+        synchronize()
+        times.append(time.perf_counter() - start)
+    peak = torch.cuda.max_memory_allocated(device) - baseline if is_cuda else None
+    return Measurement(output, times, peak)
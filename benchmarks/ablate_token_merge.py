@@ -0,0 +1,118 @@
+"""
+Token-merging ablation: speed and quality against the unmerged model on a held-out set of
+extracted feature files (.npz, as written by extract_latents.py).
+
+Every configuration generates from the same noise; quality is reported as the relative L2
+distance of the sampled latents and the log-mel L1 distance of the decoded audio to the
+unmerged reference.
+
+    python benchmarks/ablate_token_merge.py --features_dir results/heldout --ckpt_dir ckpts/thinksound_light.ckpt \
+        --ratios 0.25,0 0.5,0 0,0.25 0,0.5 0.5,0.5
+"""
+import argparse
+import glob
+import json
+import os
+
+import torch
+import torchaudio
+
+from _common import measure
+from ThinkSound.models import create_model_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+from ThinkSound.inference.device import DevicePolicy
+from ThinkSound.inference.sampling import sample, sample_discrete_euler
+from predict import load
+
+
+@torch.no_grad()
+def generate(diffusion, batch, diffusion_objective, device_policy, seed, steps):
+    device = device_policy.device
+    reals, metadata = batch
+    with device_policy.autocast():
+        conditioning = diffusion.conditioner(metadata, device)
+    video_exist = torch.stack([item['video_exist'] for item in metadata], dim=0).to(device)
+    conditioning['metaclip_features'][~video_exist] = diffusion.model.model.empty_clip_feat
+    conditioning['sync_features'][~video_exist] = diffusion.model.model.empty_sync_feat
+    cond_inputs = diffusion.get_conditioning_inputs(conditioning)
+
+    generator = torch.Generator().manual_seed(seed)
+    noise = torch.randn([reals.shape[0], diffusion.io_channels, reals.shape[2]], generator=generator).to(device)
+
+    def run():
+        if diffusion_objective == "v":
+            return sample(diffusion.model, noise, steps, 0, device_policy=device_policy, **cond_inputs, cfg_scale=5, batch_cfg=True)
+        return sample_discrete_euler(diffusion.model, noise, steps, **cond_inputs, cfg_scale=5, batch_cfg=True)
+
+    with device_policy.autocast():
+        sampled = measure(run, device_policy.device, warmup=0)
+        latents = sampled.output
+        audio = diffusion.pretransform.decode(latents)
+    return latents.float(), audio.float(), sampled.mean
+
+
+def main(args):
+    device_policy = DevicePolicy.create(args.device).apply()
+
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+    duration = args.duration_sec
+    model_config["sample_size"] = duration * model_config["sample_rate"]
+    model_config["model"]["diffusion"]["config"]["sync_seq_len"] = 24 * int(duration)
+    model_config["model"]["diffusion"]["config"]["clip_seq_len"] = 8 * int(duration)
+    model_config["model"]["diffusion"]["config"]["latent_seq_len"] = round(44100 / 64 / 32 * duration)
+
+    model = create_model_from_config(model_config)
+    model.load_state_dict(torch.load(args.ckpt_dir, map_location='cpu'))
+    model.pretransform.load_state_dict(load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.'))
+    model = model.to(device_policy.device).eval()
+    mmdit = model.model.model
+    objective = model_config["model"]["diffusion"]["diffusion_objective"]
+
+    mel = torchaudio.transforms.MelSpectrogram(model_config["sample_rate"], n_fft=2048, hop_length=512, n_mels=128).to(device_policy.device)
+
+    def log_mel(audio):
+        return torch.log(mel(audio) + 1e-5)
+
+    files = sorted(glob.glob(os.path.join(args.features_dir, "*.npz")))[:args.num_files]
+    batches = []
+    for filename in files:
+        audio, info = load(filename, duration)
+        for k, v in info.items():
+            if isinstance(v, torch.Tensor):
+                info[k] = device_policy.to(v)
+        batches.append([audio, (info,)])
+
+    configs = [(0.0, 0.0)] + [tuple(float(r) for r in ratios.split(",")) for ratios in args.ratios]
+    reference = {}
+    for clip_ratio, text_ratio in configs:
+        mmdit.set_token_merge(clip_ratio, text_ratio)
+        total_time, latent_err, mel_err = 0.0, 0.0, 0.0
+        for i, batch in enumerate(batches):
+            latents, audio, elapsed = generate(model, batch, objective, device_policy, args.seed + i, args.steps)
+            total_time += elapsed
+            if (clip_ratio, text_ratio) == (0.0, 0.0):
+                reference[i] = (latents, log_mel(audio))
+                continue
+            ref_latents, ref_mel = reference[i]
+            latent_err += ((latents - ref_latents).norm() / ref_latents.norm()).item()
+            mel_err += (log_mel(audio) - ref_mel).abs().mean().item()
+        n = max(len(batches), 1)
+        print(f"clip_merge_ratio={clip_ratio:.2f} text_merge_ratio={text_ratio:.2f}: "
+              f"sampling {total_time / n:.2f}s/clip, latent rel. L2 {latent_err / n:.4f}, log-mel L1 {mel_err / n:.4f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--features_dir', required=True, help='held-out .npz feature files')
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--ckpt_dir', default='ckpts/thinksound_light.ckpt')
+    parser.add_argument('--pretransform_ckpt_path', default='ckpts/vae.ckpt')
+    parser.add_argument('--device', default='')
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--num_files', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--ratios', nargs='+', default=['0.25,0', '0.5,0', '0,0.25', '0,0.5', '0.5,0.5'],
+                        help='clip_ratio,text_ratio pairs to compare against the unmerged model')
+    main(parser.parse_args())
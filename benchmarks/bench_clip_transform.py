@@ -0,0 +1,67 @@
+"""
+CLIPFrameTransform vs the Hugging Face CLIP processor on a clip's frame stack: checks the outputs agree within
+tolerance and times both.
+
+    python benchmarks/bench_clip_transform.py
+    python benchmarks/bench_clip_transform.py --video dataset/vggsound/video/train/xxx.mp4 --device cuda
+
+Without --video, smooth synthetic frames are used (the resize kernels only differ in rounding on natural images;
+white noise is a poor proxy). Exits with status 1 when the tolerance is exceeded.
+"""
+import argparse
+import sys
+
+import torch
+from transformers import AutoProcessor
+
+from _common import measure
+from data_utils.v2a_utils.video_utils import CLIPFrameTransform, read_clip_and_sync_frames
+from data_utils.v2a_utils.vggsound_224_no_audio import pad_to_square
+
+
+def synthetic_frames(num_frames, height=360, width=640):
+    y = torch.linspace(0, 1, height).view(1, height, 1)
+    x = torch.linspace(0, 1, width).view(1, 1, width)
+    t = torch.linspace(0, 1, num_frames).view(num_frames, 1, 1)
+    channels = [torch.sin(6 * x + 3 * t) * torch.cos(4 * y), torch.sin(9 * y * x + t), torch.cos(5 * (x - y) + 2 * t)]
+    frames = torch.stack([c.expand(num_frames, height, width) for c in channels], dim=1)
+    return ((frames + 1) * 127.5).round().to(torch.uint8)
+
+
+def main(args):
+    if args.video:
+        frames = read_clip_and_sync_frames(args.video, args.duration_sec).clip_chunk
+    else:
+        frames = synthetic_frames(int(8 * args.duration_sec))
+    frames = pad_to_square(frames)
+
+    processor = AutoProcessor.from_pretrained(args.processor)
+    transform = CLIPFrameTransform.from_pretrained(args.processor, device=args.device)
+
+    hf = measure(lambda: processor(images=frames, return_tensors="pt")["pixel_values"], iters=args.repeats)
+    tensor = measure(lambda: transform(frames), args.device, iters=args.repeats)
+    reference, hf_time = hf.output, hf.mean
+    output, tensor_time = tensor.output, tensor.mean
+
+    diff = (output.cpu() - reference).abs()
+    ok = diff.max().item() <= args.max_tol and diff.mean().item() <= args.mean_tol
+    print(f"{tuple(frames.shape)} frames -> {tuple(output.shape)}")
+    print(f"abs diff: max {diff.max():.4f} (tol {args.max_tol}), mean {diff.mean():.5f} (tol {args.mean_tol}) "
+          f"{'OK' if ok else 'FAILED'}")
+    print(f"HF processor:       {hf_time * 1000:.1f} ms/clip")
+    print(f"CLIPFrameTransform: {tensor_time * 1000:.1f} ms/clip on {args.device} ({hf_time / tensor_time:.1f}x)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', default='', help='mp4 to take the frames from (default: synthetic frames)')
+    parser.add_argument('--processor', default='facebook/metaclip-h14-fullcc2.5b')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--repeats', type=int, default=3)
+    # both sides are rounded to uint8 levels and one level is 1 / 255 / std ~ 0.015 after normalization, so the
+    # default bound is the "within one uint8 level" of CLIPFrameTransform's docstring
+    parser.add_argument('--max_tol', type=float, default=0.02, help='largest allowed abs difference (one uint8 level)')
+    parser.add_argument('--mean_tol', type=float, default=0.005)
+    main(parser.parse_args())
@@ -0,0 +1,87 @@
+"""
+End-to-end inference benchmark for the device policy (conditioning -> sampling -> VAE decode).
+
+Runs on random weights and random features unless checkpoints are given, so it can be used on a
+CPU-only box to compare devices, autocast dtypes and thread counts:
+
+    python benchmarks/bench_cpu_inference.py --device cpu --dtype bf16 --duration_sec 9
+    python benchmarks/bench_cpu_inference.py --device cpu --dtype fp32 --num_threads 8
+"""
+import argparse
+import json
+import resource
+
+import torch
+
+from _common import measure
+from ThinkSound.models import create_model_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+from ThinkSound.inference.device import DevicePolicy
+from predict import predict_step
+
+
+def make_batch(model_config, duration, batch_size):
+    cfg = model_config["model"]["diffusion"]["config"]
+    latent_length = cfg["latent_seq_len"]
+    metadata = []
+    for i in range(batch_size):
+        metadata.append({
+            "id": f"bench_{i}",
+            "video_exist": torch.tensor(True),
+            "metaclip_features": torch.randn(cfg["clip_seq_len"], cfg["clip_dim"]),
+            "sync_features": torch.randn(cfg["sync_seq_len"], cfg["sync_dim"]),
+            "metaclip_text_features": torch.randn(77, cfg["clip_dim"]),
+            "t5_features": torch.randn(77, cfg["text_dim"]),
+        })
+    reals = torch.zeros(batch_size, cfg["latent_dim"], latent_length)
+    return reals, tuple(metadata)
+
+
+def main(args):
+    device_policy = DevicePolicy.create(args.device, dtype=args.dtype, num_threads=args.num_threads).apply()
+
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+    duration = args.duration_sec
+    model_config["sample_size"] = duration * model_config["sample_rate"]
+    model_config["model"]["diffusion"]["config"]["sync_seq_len"] = 24 * int(duration)
+    model_config["model"]["diffusion"]["config"]["clip_seq_len"] = 8 * int(duration)
+    model_config["model"]["diffusion"]["config"]["latent_seq_len"] = round(44100 / 64 / 32 * duration)
+
+    model = create_model_from_config(model_config)
+    if args.ckpt_dir:
+        model.load_state_dict(torch.load(args.ckpt_dir, map_location='cpu'))
+    if args.pretransform_ckpt_path:
+        model.pretransform.load_state_dict(load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.'))
+    model.eval()
+
+    batch = make_batch(model_config, duration, args.batch_size)
+    objective = model_config["model"]["diffusion"]["diffusion_objective"]
+
+    with torch.no_grad():
+        result = measure(lambda: predict_step(model, batch=batch, diffusion_objective=objective, device_policy=device_policy),
+                         device_policy.device, iters=args.iters, warmup=args.warmup)
+
+    mean = result.mean
+    print(f"device={device_policy.device} dtype={device_policy.dtype} threads={torch.get_num_threads()} "
+          f"batch={args.batch_size} duration={duration}s")
+    print(f"end-to-end: mean {mean:.2f}s, min {result.min:.2f}s, real-time factor {mean / (duration * args.batch_size):.2f}")
+    if result.peak is not None:
+        print(f"peak device memory: {result.peak / 1024**2:.1f} MB")
+    else:
+        print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--ckpt_dir', default='')
+    parser.add_argument('--pretransform_ckpt_path', default='')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--dtype', default='auto', help='fp32, fp16, bf16 or auto')
+    parser.add_argument('--num_threads', type=int, default=0)
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,100 @@
+"""
+DataLoader throughput of VideoDataset on one npz file per sample vs packed memory-mapped shards.
+
+    python benchmarks/bench_feature_loading.py --num_samples 4096 --num_workers 8
+    python benchmarks/bench_feature_loading.py --npz_dir dataset/vggsound/video_latents_t5_clip_npz/train
+
+Without --npz_dir, synthetic npz files with the feature shapes of a 9 s clip are written to a temporary
+directory. Drop the page cache between runs (echo 3 > /proc/sys/vm/drop_caches) to measure cold reads.
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from _common import measure
+from ThinkSound.data.batch import BatchedMetadata
+from ThinkSound.data.dataset import LocalDatasetConfig, VideoDataset, collation_fn
+from ThinkSound.data.packed import PackedShardWriter
+
+# per-sample features written by extract_latents.py for 9 s clips
+FEATURE_SHAPES = {
+    "latent": (64, 194),
+    "metaclip_features": (72, 1024),
+    "metaclip_global_text_features": (1024,),
+    "metaclip_text_features": (77, 1024),
+    "t5_features": (77, 2048),
+    "sync_features": (216, 768),
+}
+
+
+def write_synthetic_npz(npz_dir, num_samples):
+    rng = np.random.default_rng(0)
+    for i in range(num_samples):
+        features = {name: rng.standard_normal(shape, dtype=np.float32) for name, shape in FEATURE_SHAPES.items()}
+        np.savez(os.path.join(npz_dir, f"{i:07d}.npz"), id=f"{i:07d}", caption="a dog barks", caption_cot="a dog barks twice", **features)
+
+
+def pack(npz_dir, packed_dir, shard_size):
+    with PackedShardWriter(packed_dir, shard_size=shard_size) as writer:
+        for name in sorted(os.listdir(npz_dir)):
+            with np.load(os.path.join(npz_dir, name), allow_pickle=True) as npz:
+                writer.add(os.path.splitext(name)[0], **{key: npz[key] for key in npz.files if key != "id"})
+
+
+def check_pinned(metadata):
+    # collation stacks the features in the workers, DataLoader(pin_memory=True) must pin the stacked tensors
+    assert isinstance(metadata, BatchedMetadata), type(metadata)
+    unpinned = [k for k, v in metadata.tensors.items() if not v.is_pinned()]
+    assert not unpinned, f"metadata tensors not pinned: {unpinned}"
+
+
+def throughput(path, args):
+    pin_memory = torch.cuda.is_available()
+    dataset = VideoDataset([LocalDatasetConfig(id="bench", path=path, split_path=None)])
+    dataloader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.num_workers, pin_memory=pin_memory,
+                            shuffle=True, collate_fn=collation_fn, persistent_workers=False)
+
+    def epochs():
+        samples = 0
+        for epoch in range(args.epochs):
+            for audio, metadata in dataloader:
+                if pin_memory and samples == 0:
+                    check_pinned(metadata)
+                samples += len(audio)
+        return samples
+
+    result = measure(epochs, warmup=0)
+    return result.output / result.mean
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        npz_dir = args.npz_dir
+        if not npz_dir:
+            npz_dir = os.path.join(tmp, "npz")
+            os.makedirs(npz_dir)
+            write_synthetic_npz(npz_dir, args.num_samples)
+        packed_dir = os.path.join(tmp, "packed")
+        packing = measure(lambda: pack(npz_dir, packed_dir, args.shard_size), warmup=0)
+        print(f"packed {npz_dir} in {packing.mean:.1f}s")
+
+        results = {}
+        for name, path in (("npz", npz_dir), ("packed", packed_dir)):
+            results[name] = throughput(path, args)
+            print(f"{name}: {results[name]:.0f} samples/s")
+        print(f"packed speedup: {results['packed'] / results['npz']:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--npz_dir', default='', help='Existing npz feature directory (default: synthetic samples)')
+    parser.add_argument('--num_samples', type=int, default=2048)
+    parser.add_argument('--shard_size', type=int, default=1024)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--epochs', type=int, default=2)
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+"""
+Counts allocations in one JointBlock forward with and without the joint QKV workspace.
+
+    python benchmarks/bench_joint_qkv.py --device cuda --duration_sec 9
+"""
+import argparse
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from _common import measure
+from ThinkSound.models.transformer_layers import JointBlock, QKVWorkspace
+from ThinkSound.models.embeddings import compute_rope_rotations
+from ThinkSound.inference.device import DevicePolicy
+
+
+def _device_bytes(event):
+    # renamed from cuda_memory_usage in newer torch versions
+    return getattr(event, "device_memory_usage", getattr(event, "cuda_memory_usage", 0))
+
+
+def count_allocations(block, inputs, device_policy):
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if device_policy.is_cuda else [])
+    with profile(activities=activities, profile_memory=True) as prof:
+        with torch.no_grad(), device_policy.autocast():
+            block(*inputs)
+        device_policy.synchronize()
+    sizes = [max(e.cpu_memory_usage, 0) + max(_device_bytes(e), 0) for e in prof.events() if e.name == "[memory]"]
+    sizes = [size for size in sizes if size > 0]
+    return len(sizes), sum(sizes)
+
+
+def time_block(block, inputs, device_policy, iters):
+    with torch.no_grad(), device_policy.autocast():
+        return measure(lambda: block(*inputs), device_policy.device, iters=iters).mean
+
+
+def main(args):
+    device_policy = DevicePolicy.create(args.device, dtype=args.dtype).apply()
+    device = device_policy.device
+    dim, heads = args.hidden_dim, args.num_heads
+    latent_len = round(44100 / 64 / 32 * args.duration_sec)
+    clip_len = 8 * int(args.duration_sec)
+    text_len = 154
+
+    block = JointBlock(dim, heads, workspace=QKVWorkspace()).to(device).eval()
+    b = args.batch_size
+    inputs = (
+        torch.randn(b, latent_len, dim, device=device),
+        torch.randn(b, clip_len, dim, device=device),
+        torch.randn(b, text_len, dim, device=device),
+        torch.randn(b, 1, dim, device=device),
+        torch.randn(b, latent_len, dim, device=device),
+        compute_rope_rotations(latent_len, dim // heads, 10000, device=device),
+        compute_rope_rotations(clip_len, dim // heads, 10000, freq_scaling=latent_len / clip_len, device=device),
+    )
+
+    for use_workspace in (False, True):
+        block.use_workspace = use_workspace
+        # first call sizes the workspace; measure the steady state
+        with torch.no_grad(), device_policy.autocast():
+            block(*inputs)
+        n, nbytes = count_allocations(block, inputs, device_policy)
+        latency = time_block(block, inputs, device_policy, args.iters)
+        label = "workspace" if use_workspace else "torch.cat"
+        print(f"{label:>10}: {n} allocations, {nbytes / 1024**2:.1f} MB allocated, {latency * 1000:.2f} ms/forward")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', default='')
+    parser.add_argument('--dtype', default='auto')
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--hidden_dim', type=int, default=1024)
+    parser.add_argument('--num_heads', type=int, default=16)
+    parser.add_argument('--iters', type=int, default=20)
+    main(parser.parse_args())
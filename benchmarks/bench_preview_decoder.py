@@ -0,0 +1,62 @@
+"""
+Full VAE decode vs the distilled preview decoder: latency, peak memory and output sample rate.
+
+    python benchmarks/bench_preview_decoder.py --device cuda --pretransform_ckpt_path ckpts/vae.ckpt \
+        --preview_decoder_ckpt_path ckpts/preview_decoder.ckpt
+
+Without checkpoints both decoders run with random weights, which is enough for timing.
+"""
+import argparse
+import json
+
+import torch
+
+from _common import measure
+from ThinkSound.models.factory import create_pretransform_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+from ThinkSound.inference.device import DevicePolicy
+from ThinkSound.inference.preview import create_preview_decoder, load_preview_decoder
+
+
+def main(args):
+    device_policy = DevicePolicy.create(args.device).apply()
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+
+    full = create_pretransform_from_config(model_config["model"]["pretransform"], model_config["sample_rate"])
+    if args.pretransform_ckpt_path:
+        full.load_state_dict(load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.'))
+    full.prepare_for_inference()
+    if args.preview_decoder_ckpt_path:
+        preview = load_preview_decoder(args.preview_decoder_config, args.preview_decoder_ckpt_path)
+    else:
+        preview = create_preview_decoder(args.preview_decoder_config).prepare_for_inference().eval()
+
+    torch.manual_seed(0)
+    latent_length = round(model_config["sample_rate"] / full.downsampling_ratio * args.duration_sec)
+    latents = torch.randn(args.batch_size, full.encoded_channels, latent_length, device=device_policy.device)
+
+    results = {}
+    for name, decoder in (("full", full), ("preview", preview)):
+        decoder = decoder.to(device_policy.device).eval()
+        with torch.no_grad():
+            result = measure(lambda: decoder.decode(latents), device_policy.device, iters=args.iters)
+        results[name] = result.mean
+        print(f"{name}: {result.mean * 1000:.1f} ms/decode{result.memory()}, "
+              f"{tuple(result.output.shape)} at {decoder.decoder_sample_rate} Hz")
+        decoder.cpu()
+        device_policy.empty_cache()
+    print(f"preview speedup: {results['full'] / results['preview']:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--pretransform_ckpt_path', default='')
+    parser.add_argument('--preview_decoder_config', default='ThinkSound/configs/model_configs/preview_decoder.json')
+    parser.add_argument('--preview_decoder_ckpt_path', default='')
+    parser.add_argument('--device', default='')
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    main(parser.parse_args())
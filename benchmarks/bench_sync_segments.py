@@ -0,0 +1,74 @@
+"""
+Peak memory and throughput of Synchformer feature extraction: segments stacked into a new (B, S, T, C, H, W)
+tensor and run b at a time (the previous encode_video_with_sync) vs unfold views run in memory-sized micro-batches.
+
+    python benchmarks/bench_sync_segments.py --batch_size 8
+    python benchmarks/bench_sync_segments.py --synchformer_ckpt ckpts/synchformer_state_dict.pth --half
+
+Random weights are used without --synchformer_ckpt, which is enough for timing and memory.
+"""
+import argparse
+
+import torch
+from einops import rearrange
+
+from _common import measure
+from data_utils.ext.synchformer import Synchformer
+from data_utils.v2a_utils.feature_utils_224 import FeaturesUtils
+
+
+@torch.inference_mode()
+def encode_stacked(synchformer, x):
+    # the previous encode_video_with_sync
+    b, t, c, h, w = x.shape
+    segment_size = 16
+    step_size = 8
+    num_segments = (t - segment_size) // step_size + 1
+    segments = []
+    for i in range(num_segments):
+        segments.append(x[:, i * step_size:i * step_size + segment_size])
+    x = torch.stack(segments, dim=1)  # (B, S, T, C, H, W)
+
+    outputs = []
+    batch_size = b
+    x = rearrange(x, 'b s t c h w -> (b s) 1 t c h w')
+    for i in range(0, b * num_segments, batch_size):
+        outputs.append(synchformer(x[i:i + batch_size]))
+    x = torch.cat(outputs, dim=0)
+    return rearrange(x, '(b s) 1 t d -> b (s t) d', b=b)
+
+
+def main(args):
+    device = torch.device(args.device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+    dtype = torch.float16 if args.half else torch.float32
+
+    extractor = FeaturesUtils(enable_conditions=False)
+    extractor.synchformer = Synchformer()
+    if args.synchformer_ckpt:
+        extractor.synchformer.load_state_dict(torch.load(args.synchformer_ckpt, weights_only=True, map_location='cpu'))
+    extractor = extractor.to(device, dtype).eval()
+
+    num_frames = int(25 * args.duration_sec)
+    x = torch.randn(args.batch_size, num_frames, 3, 224, 224, device=device, dtype=dtype)
+    print(f"input {tuple(x.shape)}, {x.numel() * x.element_size() / 2**20:.0f} MB")
+
+    # the warm-up call also calibrates the micro-batch size
+    stacked = measure(lambda: encode_stacked(extractor.synchformer, x), device, iters=args.repeats, relative=True)
+    unfolded = measure(lambda: extractor.encode_video_with_sync(x), device, iters=args.repeats, relative=True)
+
+    print(f"max abs diff: {(stacked.output.float() - unfolded.output.float()).abs().max():.2e}")
+    clips = args.batch_size
+    for name, result in (("stack", stacked),
+                         (f"unfold ({extractor.sync_segments_per_batch or 'per-call'} segments/batch)", unfolded)):
+        print(f"{name}: {clips / result.mean:.2f} clips/s{result.memory(' above the input')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8, help='Clips per call')
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--synchformer_ckpt', default='')
+    parser.add_argument('--device', default='')
+    parser.add_argument('--half', action='store_true')
+    parser.add_argument('--repeats', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,58 @@
+"""
+Chunked VAE encode/decode: sequential chunks vs chunks folded into the batch dimension.
+
+    python benchmarks/bench_vae_chunks.py --device cuda --pretransform_ckpt_path ckpts/vae.ckpt --duration_sec 30
+"""
+import argparse
+import json
+
+import torch
+
+from _common import measure
+from ThinkSound.models.autoencoders import create_autoencoder_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+from ThinkSound.inference.device import DevicePolicy
+
+
+def main(args):
+    device_policy = DevicePolicy.create(args.device).apply()
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+    autoencoder = create_autoencoder_from_config({"sample_rate": model_config["sample_rate"],
+                                                  "model": model_config["model"]["pretransform"]["config"]})
+    if args.pretransform_ckpt_path:
+        autoencoder.load_state_dict(load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.'))
+    autoencoder = autoencoder.to(device_policy.device).eval().requires_grad_(False)
+
+    latent_length = round(model_config["sample_rate"] / autoencoder.downsampling_ratio * args.duration_sec)
+    latents = torch.randn(args.batch_size, autoencoder.latent_dim, latent_length, device=device_policy.device)
+    audio = torch.randn(args.batch_size, autoencoder.in_channels, latent_length * autoencoder.downsampling_ratio,
+                        device=device_policy.device) * 0.1
+
+    with torch.no_grad():
+        for chunk_size in args.chunk_sizes:
+            for name, x, fn in (("decode", latents, autoencoder.decode_audio), ("encode", audio, autoencoder.encode_audio)):
+                results = {}
+                for chunk_batch_size in (1, "auto"):
+                    result = measure(lambda: fn(x, chunked=True, overlap=args.overlap, chunk_size=chunk_size,
+                                                chunk_batch_size=chunk_batch_size), device_policy.device, iters=args.iters)
+                    results[chunk_batch_size] = result.output
+                    print(f"{name} chunk_size={chunk_size} chunk_batch_size={chunk_batch_size}: "
+                          f"{result.mean * 1000:.1f} ms{result.memory()}")
+                diff = (results[1] - results["auto"]).abs().max().item()
+                # the VAE bottleneck samples during encode, so only decode is expected to match exactly
+                note = " (includes bottleneck sampling noise)" if name == "encode" and autoencoder.bottleneck is not None else ""
+                print(f"{name} chunk_size={chunk_size}: max abs diff sequential vs batched {diff:.3e}{note}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--pretransform_ckpt_path', default='')
+    parser.add_argument('--device', default='')
+    parser.add_argument('--duration_sec', type=float, default=30.0)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--overlap', type=int, default=32)
+    parser.add_argument('--chunk_sizes', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--iters', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,64 @@
+"""
+VAE decode in fp32, fp16 and bf16: latency, peak memory and max abs difference to fp32.
+
+    python benchmarks/bench_vae_precision.py --device cuda --pretransform_ckpt_path ckpts/vae.ckpt
+"""
+import argparse
+import json
+from functools import partial
+
+import torch
+
+from _common import measure
+from ThinkSound.models.factory import create_pretransform_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+from ThinkSound.inference.device import DevicePolicy
+
+
+def main(args):
+    device_policy = DevicePolicy.create(args.device).apply()
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+    pretransform_config = model_config["model"]["pretransform"]
+    state_dict = load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.') if args.pretransform_ckpt_path else None
+
+    torch.manual_seed(0)
+    latents = None
+    reference = None
+    for precision in ("fp32", "fp16", "bf16"):
+        pretransform = create_pretransform_from_config({**pretransform_config, "precision": precision}, model_config["sample_rate"])
+        if state_dict is not None:
+            pretransform.load_state_dict(state_dict)
+        elif reference is None:
+            random_weights = {k: v.clone() for k, v in pretransform.model.state_dict().items()}
+        else:
+            pretransform.load_state_dict(random_weights)
+        if args.prepare:
+            pretransform.prepare_for_inference()
+        pretransform = pretransform.to(device_policy.device).eval()
+        if latents is None:
+            latent_length = round(model_config["sample_rate"] / pretransform.downsampling_ratio * args.duration_sec)
+            latents = torch.randn(args.batch_size, pretransform.encoded_channels, latent_length, device=device_policy.device)
+
+        with torch.no_grad():
+            result = measure(partial(pretransform.decode, latents), device_policy.device, iters=args.iters)
+        audio = result.output
+
+        if reference is None:
+            reference = audio
+        diff = (audio - reference).abs().max().item()
+        print(f"{precision}: {result.mean * 1000:.1f} ms/decode{result.memory()}, max abs diff to fp32 {diff:.3e}")
+        del pretransform
+        device_policy.empty_cache()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--pretransform_ckpt_path', default='')
+    parser.add_argument('--device', default='')
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--prepare', action='store_true', help='Run prepare_for_inference before timing')
+    main(parser.parse_args())
@@ -0,0 +1,89 @@
+"""
+Per-clip decode time of the CLIP (8 fps) and Synchformer (25 fps) frames: two StreamingMediaDecoder video streams,
+as the v2a_utils datasets used to register, vs one 25 fps stream with the 8 fps frames picked by timestamp.
+
+    python benchmarks/bench_video_decode.py --num_clips 16
+    python benchmarks/bench_video_decode.py --video_dir dataset/vggsound/video/train --num_clips 64
+
+Without --video_dir, synthetic 10 s 30 fps clips are encoded to a temporary directory.
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+from torio.io import StreamingMediaDecoder, StreamingMediaEncoder
+
+from _common import measure
+from data_utils.v2a_utils.video_utils import _CLIP_FPS, _SYNC_FPS, read_clip_and_sync_frames
+
+
+def write_synthetic_video(path, seconds=10, fps=30, height=360, width=640):
+    encoder = StreamingMediaEncoder(path)
+    encoder.add_video_stream(frame_rate=fps, height=height, width=width, format='rgb24')
+    y = torch.linspace(0, 255, height).view(height, 1)
+    x = torch.linspace(0, 255, width).view(1, width)
+    with encoder.open():
+        for start in range(0, seconds * fps, fps):
+            t = torch.arange(start, start + fps).view(-1, 1, 1).float()
+            channels = [(x + 4 * t) % 256, (y + 2 * t) % 256, ((x + y) / 2 + t) % 256]
+            frames = torch.stack([c.expand(fps, height, width) for c in channels], dim=1)
+            encoder.write_video_chunk(0, frames.to(torch.uint8))
+
+
+def read_two_streams(path, duration_sec):
+    reader = StreamingMediaDecoder(path)
+    reader.add_basic_video_stream(frames_per_chunk=int(_CLIP_FPS * duration_sec), frame_rate=_CLIP_FPS, format='rgb24')
+    reader.add_basic_video_stream(frames_per_chunk=int(_SYNC_FPS * duration_sec), frame_rate=_SYNC_FPS, format='rgb24')
+    reader.fill_buffer()
+    clip_chunk, sync_chunk = reader.pop_chunks()
+    return clip_chunk, sync_chunk
+
+
+def read_single_stream(path, duration_sec):
+    clip_chunk, sync_chunk, _, _ = read_clip_and_sync_frames(path, duration_sec)
+    return clip_chunk, sync_chunk
+
+
+def time_per_clip(read, paths, duration_sec):
+    read(paths[0], duration_sec)  # warm up the page cache and FFmpeg
+    return measure(lambda: [read(path, duration_sec) for path in paths], warmup=0).mean / len(paths)
+
+
+def main(args):
+    torch.set_num_threads(1)  # as in a DataLoader worker
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.video_dir:
+            paths = sorted(os.path.join(args.video_dir, f) for f in os.listdir(args.video_dir) if f.endswith('.mp4'))
+            paths = paths[:args.num_clips]
+        else:
+            paths = []
+            for i in range(args.num_clips):
+                paths.append(os.path.join(tmp, f"{i:04d}.mp4"))
+                write_synthetic_video(paths[-1])
+
+        clip_two, sync_two = read_two_streams(paths[0], args.duration_sec)
+        clip_one, sync_one = read_single_stream(paths[0], args.duration_sec)
+        print(f"frames (clip, sync): two streams {clip_two.shape[0]}, {sync_two.shape[0]}; "
+              f"single stream {clip_one.shape[0]}, {sync_one.shape[0]}")
+        # the single stream derives its clip frame count from the sync frames, which can differ from the 8 fps
+        # stream's on short or variable frame rate clips: compare the common prefix and report the mismatch
+        num_clip = min(clip_two.shape[0], clip_one.shape[0])
+        clip_diff = (clip_two[:num_clip].float() - clip_one[:num_clip].float()).abs().mean()
+        print(f"sync frames identical: {torch.equal(sync_two, sync_one)}, "
+              f"clip frames mean abs diff over {num_clip}: {clip_diff:.2f} (uint8 levels)")
+        if clip_two.shape[0] != clip_one.shape[0]:
+            print(f"clip frame count mismatch: two streams {clip_two.shape[0]}, single stream {clip_one.shape[0]}")
+
+        two = time_per_clip(read_two_streams, paths, args.duration_sec)
+        one = time_per_clip(read_single_stream, paths, args.duration_sec)
+        print(f"two streams:   {two * 1000:.1f} ms/clip")
+        print(f"single stream: {one * 1000:.1f} ms/clip ({two / one:.2f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video_dir', default='', help='Directory of mp4 clips (default: synthetic clips)')
+    parser.add_argument('--num_clips', type=int, default=16)
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    main(parser.parse_args())
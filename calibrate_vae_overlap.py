@@ -0,0 +1,117 @@
+import argparse
+import json
+import logging
+import re
+
+import torch
+
+from ThinkSound.models.factory import create_pretransform_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+from ThinkSound.inference.device import DevicePolicy
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Measures the receptive field of the VAE encoder and decoder by gradient footprint and stores the minimal
+# chunk overlaps as encode_overlap / decode_overlap in the model config. Chunked encode/decode then does the
+# least redundant work that still matches unchunked output. Oobleck has no normalization or attention,
+# so outside the footprint the gradient is exactly zero and tol=0 gives the exact (structural) receptive field;
+# a small tol trims the tail of negligible contributions at the cost of a bounded difference, see --verify.
+
+
+def overlap_section(model_config):
+    """The config object holding the overlaps: the pretransform of a generator, or the model of an autoencoder config."""
+    model = model_config["model"]
+    return model["pretransform"] if "pretransform" in model else model
+
+
+def create_pretransform(model_config):
+    model = model_config["model"]
+    if "pretransform" in model:
+        pretransform_config = dict(model["pretransform"])
+    else:
+        pretransform_config = {"type": "autoencoder", "config": model}
+    # measure at full precision
+    pretransform_config.pop("model_half", None)
+    pretransform_config["precision"] = "fp32"
+    return create_pretransform_from_config(pretransform_config, model_config["sample_rate"])
+
+
+def write_overlaps(config_path, overlaps):
+    """Updates or inserts the overlap keys in place, leaving the rest of the config file untouched."""
+    with open(config_path) as f:
+        text = f.read()
+    section = "pretransform" if "pretransform" in json.loads(text)["model"] else "model"
+    for key, value in overlaps.items():
+        text, found = re.subn(rf'("{key}":\s*)\d+', rf'\g<1>{value}', text)
+        if not found:
+            # first key of the section, indented like the key after it
+            match = re.search(rf'"{section}":\s*\{{\n(\s*)', text)
+            text = text[:match.end()] + f'"{key}": {value},\n{match.group(1)}' + text[match.end():]
+    config = json.loads(text)
+    assert all(overlap_section(config).get(key) == value for key, value in overlaps.items())
+    with open(config_path, "w") as f:
+        f.write(text)
+
+
+@torch.no_grad()
+def verify(autoencoder, overlaps, chunk_size, device):
+    """Max abs difference between chunked (with the calibrated overlaps) and unchunked encode/decode of random input."""
+    torch.manual_seed(0)
+    length = 4 * chunk_size
+    latents = torch.randn(1, autoencoder.latent_dim, length, device=device)
+    audio = autoencoder.decode_audio(latents)
+    diffs = {}
+    if "decode_overlap" in overlaps:
+        chunked = autoencoder.decode_audio(latents, chunked=True, overlap=overlaps["decode_overlap"], chunk_size=chunk_size)
+        diffs["decode"] = (chunked - audio).abs().max().item()
+    if "encode_overlap" in overlaps:
+        # compare the encoder outputs, the VAE bottleneck samples noise
+        bottleneck, autoencoder.bottleneck = autoencoder.bottleneck, None
+        try:
+            audio = audio[:, :autoencoder.in_channels]
+            reference = autoencoder.encode_audio(audio)
+            chunked = autoencoder.encode_audio(audio, chunked=True, overlap=overlaps["encode_overlap"], chunk_size=chunk_size)
+            diffs["encode"] = (chunked - reference).abs().max().item()
+        finally:
+            autoencoder.bottleneck = bottleneck
+    return diffs
+
+
+def main(args):
+    device_policy = DevicePolicy.create(args.device).apply()
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+
+    pretransform = create_pretransform(model_config)
+    if args.pretransform_ckpt_path:
+        state_dict = load_ckpt_state_dict(args.pretransform_ckpt_path)
+        if any(k.startswith("autoencoder.") for k in state_dict):
+            state_dict = load_ckpt_state_dict(args.pretransform_ckpt_path, prefix="autoencoder.")
+        pretransform.load_state_dict(state_dict)
+    autoencoder = pretransform.model.to(device_policy.device).eval()
+
+    overlaps = autoencoder.calibrate_overlap(tol=args.tol)
+    previous = overlap_section(model_config)
+    for key, value in overlaps.items():
+        logger.info(f"{key}: {value} latents (was {previous.get(key, 'the default of 32')})")
+
+    if args.verify:
+        for name, diff in verify(autoencoder, overlaps, args.chunk_size, device_policy.device).items():
+            logger.info(f"Chunked vs unchunked {name}: max abs difference {diff:.3e}")
+
+    if args.write:
+        write_overlaps(args.model_config, overlaps)
+        logger.info(f"Stored the overlaps in {args.model_config}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the VAE receptive field and store the minimal chunk overlaps in the model config')
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--pretransform_ckpt_path', default='ckpts/vae.ckpt')
+    parser.add_argument('--tol', type=float, default=0.0, help='Ignore gradients below tol times the largest one (0 gives the exact receptive field)')
+    parser.add_argument('--chunk_size', type=int, default=128, help='Chunk size in latents used for verification')
+    parser.add_argument('--verify', action='store_true', help='Compare chunked and unchunked output with the measured overlaps')
+    parser.add_argument('--write', action='store_true', help='Store the overlaps in the model config')
+    parser.add_argument('--device', default='')
+    main(parser.parse_args())
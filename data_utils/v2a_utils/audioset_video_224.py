@@ -8,9 +8,8 @@ import torch
 import torchaudio
 from torch.utils.data.dataset import Dataset
 from torchvision.transforms import v2
-from torio.io import StreamingMediaDecoder
+from data_utils.v2a_utils.video_utils import CLIPFrameTransform, read_clip_and_sync_frames
 from torchvision.utils import save_image
-from transformers import AutoProcessor
 import torch.nn.functional as F
 import numpy as np
 
@@ -133,7 +132,7 @@ class Audioset(Dataset):
             v2.ToImage(),
             v2.ToDtype(torch.float32, scale=True),
         ])
-        self.clip_processor = AutoProcessor.from_pretrained("useful_ckpts/metaclip-huge")
+        self.clip_processor = CLIPFrameTransform.from_pretrained("useful_ckpts/metaclip-huge")
         self.sync_transform = v2.Compose([
             v2.Resize(_SYNC_SIZE, interpolation=v2.InterpolationMode.BICUBIC),
             v2.CenterCrop(_SYNC_SIZE),
@@ -150,23 +149,7 @@ class Audioset(Dataset):
         caption = self.captions[idx]
         caption_t5 = self.caption_t5s[idx]
 
-        reader = StreamingMediaDecoder(video_path)
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_CLIP_FPS * self.duration_sec),
-            frame_rate=_CLIP_FPS,
-            format='rgb24',
-        )
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_SYNC_FPS * self.duration_sec),
-            frame_rate=_SYNC_FPS,
-            format='rgb24',
-        ) 
-
-        reader.fill_buffer()
-        data_chunk = reader.pop_chunks()
-
-        clip_chunk = data_chunk[0]
-        sync_chunk = data_chunk[1]
+        clip_chunk, sync_chunk, _, _ = read_clip_and_sync_frames(video_path, self.duration_sec, _CLIP_FPS, _SYNC_FPS)
 
         if clip_chunk is None:
             raise RuntimeError(f'CLIP video returned None {video_id}')
@@ -211,7 +194,7 @@ class Audioset(Dataset):
         # clip_chunk = self.clip_transform(clip_chunk)
         # import ipdb
         # ipdb.set_trace()
-        clip_chunk = self.clip_processor(images=clip_chunk, return_tensors="pt")["pixel_values"]
+        clip_chunk = self.clip_processor(clip_chunk)
         # log.info(clip_chunk.shape)
         # save_tensor_as_image(clip_chunk[0].numpy(),'scale.png')
         # log.info(clip_chunk[0])
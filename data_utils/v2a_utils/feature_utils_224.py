@@ -1,4 +1,4 @@
-from typing import Literal, Optional
+from typing import Literal, Optional, Tuple
 import json
 import open_clip
 import torch
@@ -59,8 +59,13 @@ class FeaturesUtils(nn.Module):
         synchformer_ckpt: Optional[str] = None,
         enable_conditions: bool = True,
         need_vae_encoder: bool = True,
+        use_half: bool = False,
     ):
         super().__init__()
+        self.use_half = use_half
+        # Synchformer micro-batch size in segments, measured on the first call when None
+        self.sync_segments_per_batch = None
+        self.sync_memory_fraction = 0.5
 
         if enable_conditions:
             self.clip_model = AutoModel.from_pretrained("facebook/metaclip-h14-fullcc2.5b")
@@ -90,6 +95,9 @@ class FeaturesUtils(nn.Module):
         else:
             self.tod = None
 
+        if use_half:
+            self.half()
+
     def compile(self):
         if self.clip_model is not None:
             self.clip_model.encode_image = torch.compile(self.clip_model.encode_image)
@@ -108,6 +116,7 @@ class FeaturesUtils(nn.Module):
         b, t, c, h, w = x.shape
         
         assert c == 3 and h == 224 and w == 224
+        x = x.to(self.clip_model.device, self.clip_model.dtype, non_blocking=True)
         # x = self.clip_preprocess(x)
         x = rearrange(x, 'b t c h w -> (b t) c h w')
         outputs = []
@@ -122,38 +131,89 @@ class FeaturesUtils(nn.Module):
 
     @torch.inference_mode()
     def encode_video_with_sync(self, x: torch.Tensor, batch_size: int = -1) -> torch.Tensor:
+        """
+        Synchformer features of (B, T, C, H, W) 25 fps clips, from 16 frame segments with stride 8.
+
+        The segments are strided views of x (unfold), only the segments of one micro-batch are copied into a
+        contiguous input. batch_size is the number of segments per Synchformer call, by default as many as fit
+        in the free device memory (see sync_segments_per_batch).
+        """
         assert self.synchformer is not None, 'Synchformer is not loaded'
         # x: (B, T, C, H, W) H/W: 384
         b, t, c, h, w = x.shape
-        # import ipdb
-        # ipdb.set_trace()
         assert c == 3 and h == 224 and w == 224
+        sync_param = next(self.synchformer.parameters())
+        x = x.to(sync_param.device, sync_param.dtype, non_blocking=True)
 
         # partition the video
         segment_size = 16
         step_size = 8
-        num_segments = (t - segment_size) // step_size + 1
-        segments = []
-        for i in range(num_segments):
-            segments.append(x[:, i * step_size:i * step_size + segment_size])
-        x = torch.stack(segments, dim=1)  # (B, S, T, C, H, W)
+        segments = x.unfold(1, segment_size, step_size)  # (B, S, C, H, W, T) view, no copy
+        num_segments = segments.shape[1]
+        segments = segments.permute(0, 1, 5, 2, 3, 4)  # (B, S, T, C, H, W) view
+        total = b * num_segments
 
         outputs = []
-        if batch_size < 0:
-            batch_size = b
-        x = rearrange(x, 'b s t c h w -> (b s) 1 t c h w')
-        for i in range(0, b * num_segments, batch_size):
-            outputs.append(self.synchformer(x[i:i + batch_size]))
+        calibrated = None  # this call's estimate when the measurement was not kept, see _calibrate_sync_batch
+        i = 0
+        while i < total:
+            if batch_size > 0:
+                n = batch_size
+            elif self.sync_segments_per_batch is not None:
+                n = self.sync_segments_per_batch
+            elif calibrated is not None:
+                n = calibrated
+            else:
+                n = 1  # measured below to size the following micro-batches
+            end = min(i + n, total)
+            # (n, 1, T, C, H, W), the only copy of this micro-batch: written straight into a contiguous buffer
+            # (an advanced-index gather would keep the view's T-innermost layout and Synchformer copy it again)
+            chunk = x.new_empty((end - i, 1, segment_size, c, h, w))
+            for j, k in enumerate(range(i, end)):
+                chunk[j, 0].copy_(segments[k // num_segments, k % num_segments])
+            if batch_size <= 0 and self.sync_segments_per_batch is None and calibrated is None:
+                output, calibrated = self._calibrate_sync_batch(chunk)
+                outputs.append(output)
+            else:
+                outputs.append(self.synchformer(chunk))
+            i = end
         x = torch.cat(outputs, dim=0)
         x = rearrange(x, '(b s) 1 t d -> b (s t) d', b=b)
         return x
 
+    def _calibrate_sync_batch(self, segment: torch.Tensor) -> Tuple[torch.Tensor, int]:
+        """
+        Runs one segment and estimates the segments per micro-batch from its peak activation memory and the free
+        device memory (keeping sync_memory_fraction of it). On CPU the default of 32 segments is used.
+
+        The global peak counter is not reset (the --offload per-stage report reads it), so when the segment stays
+        under an earlier peak only that bound is known: the estimate is then used for this call only and the next
+        call measures again. Otherwise it is kept in sync_segments_per_batch.
+        """
+        device = segment.device
+        if device.type != 'cuda':
+            self.sync_segments_per_batch = 32
+            return self.synchformer(segment), self.sync_segments_per_batch
+        torch.cuda.synchronize(device)
+        baseline = torch.cuda.memory_allocated(device)
+        prior_peak = torch.cuda.max_memory_allocated(device)
+        output = self.synchformer(segment)
+        peak = torch.cuda.max_memory_allocated(device)
+        per_segment = max(peak - baseline, 1)
+        free, _ = torch.cuda.mem_get_info(device)
+        segments_per_batch = max(1, int(free * self.sync_memory_fraction // per_segment))
+        if peak > prior_peak:
+            self.sync_segments_per_batch = segments_per_batch
+            log.info(f'Synchformer: {per_segment / 2**20:.0f} MB per segment, '
+                     f'{segments_per_batch} segments per micro-batch')
+        return output, segments_per_batch
+
     @torch.inference_mode()
     def encode_text(self, text: list[str]) -> torch.Tensor:
         assert self.clip_model is not None, 'CLIP is not loaded'
         # assert self.tokenizer is not None, 'Tokenizer is not loaded'
         # x: (B, L)
-        tokens = self.clip_processor(text=text, truncation=True, max_length=77, padding="max_length",return_tensors="pt").to(self.device)
+        tokens = self.clip_processor(text=text, truncation=True, max_length=77, padding="max_length",return_tensors="pt").to(self.clip_model.device)
         return self.clip_model.get_text_features(**tokens)
 
     @torch.inference_mode()
@@ -165,7 +225,7 @@ class FeaturesUtils(nn.Module):
             truncation=True,
             max_length=77,
             padding="max_length",
-            return_tensors="pt").to(self.device)
+            return_tensors="pt").to(self.t5_model.device)
         return self.t5_model(**inputs).last_hidden_state
 
     @torch.inference_mode()
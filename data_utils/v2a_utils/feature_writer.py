@@ -0,0 +1,105 @@
+import logging
+import os
+import queue
+import threading
+from typing import Dict, Optional, Union
+
+import numpy as np
+import torch
+
+from data_utils.v2a_utils.journal import ExtractionJournal
+from ThinkSound.data.dataset import BFLOAT16_KEYS
+
+log = logging.getLogger()
+
+# numpy has no bfloat16: such features are stored as their raw bits (int16) and listed in the BFLOAT16_KEYS
+# member, ThinkSound.data.dataset.restore_feature_dtypes reads them back
+STORAGE_DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+def to_storage(features: Dict[str, Union[torch.Tensor, str]], dtype: torch.dtype) -> Dict[str, Union[np.ndarray, str]]:
+    """Floating point tensors cast to the storage dtype, as numpy arrays np.savez can write."""
+    stored, bfloat16_keys = {}, []
+    for key, value in features.items():
+        if isinstance(value, torch.Tensor):
+            value = value.detach().cpu()
+            if value.is_floating_point():
+                value = value.to(dtype)
+            if value.dtype == torch.bfloat16:
+                value = value.view(torch.int16)
+                bfloat16_keys.append(key)
+            value = value.numpy()
+        stored[key] = value
+    if bfloat16_keys:
+        stored[BFLOAT16_KEYS] = np.array(bfloat16_keys)
+    return stored
+
+
+class FeatureWriter:
+    """
+    Writes the per-sample feature npz files of extraction on background threads, so the GPU loop never
+    waits on disk.
+
+    put() hands a sample to the writer threads through a queue of at most max_pending samples: when the
+    disk cannot keep up the loop blocks there instead of buffering features without bound. Every file is
+    written under a temporary name and renamed into place, then its id is added to the journal. A sample
+    that fails to write is logged and left out of the journal, so a resumed run extracts it again.
+    """
+    def __init__(self, save_dir: str, dtype: torch.dtype = torch.float32, journal: Optional[ExtractionJournal] = None,
+                 num_threads: int = 2, max_pending: int = 64):
+        self.save_dir = save_dir
+        self.dtype = dtype
+        self.journal = journal
+        self.queue = queue.Queue(max_pending)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.threads = [threading.Thread(target=self._run, name=f"feature-writer-{i}", daemon=True)
+                        for i in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, sample_id: str, features: Dict[str, Union[torch.Tensor, str]]) -> None:
+        """Queues the features of a sample. Tensors must not be modified afterwards (batch slices are fine)."""
+        self.queue.put((sample_id, features))
+
+    def _write(self, sample_id: str, features: dict) -> None:
+        path = os.path.join(self.save_dir, f"{sample_id}.npz")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **to_storage(features, self.dtype))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if self.journal is not None:
+            self.journal.add(sample_id)
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            sample_id, features = item
+            try:
+                self._write(sample_id, features)
+                with self.lock:
+                    self.written += 1
+            except Exception as e:
+                log.error(f"Error writing the features of {sample_id}: {e}")
+                with self.lock:
+                    self.failed += 1
+
+    def close(self) -> None:
+        """Waits for the queued samples to be written."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,64 @@
+import glob
+import logging
+import os
+import threading
+from typing import Set
+
+log = logging.getLogger()
+
+# Feature extraction records every id whose features are stored in an append-only journal, one file per
+# rank under {save_dir}/.journal, so a restarted job (with any number of ranks) skips finished clips with a
+# set lookup instead of a stat per output file. An id is appended only after its file is written, and a line
+# cut short by a crash has no newline and is ignored, so the journal never lists a clip that is not stored.
+
+JOURNAL_DIR = ".journal"
+
+
+def read_journal(save_dir: str) -> Set[str]:
+    """Ids recorded by every rank's journal under save_dir."""
+    completed = set()
+    for path in glob.glob(os.path.join(save_dir, JOURNAL_DIR, "*.txt")):
+        with open(path) as f:
+            for line in f:
+                if line.endswith("\n"):
+                    completed.add(line[:-1])
+    return completed
+
+
+class ExtractionJournal:
+    """
+    Append-only journal of the ids this rank has stored.
+
+    A new journal file is seeded from the .npz files already in save_dir (one directory listing), so output
+    written before journals existed is not extracted again.
+    """
+    def __init__(self, save_dir: str, rank: int = 0):
+        self.dir = os.path.join(save_dir, JOURNAL_DIR)
+        self.path = os.path.join(self.dir, f"rank{rank:05d}.txt")
+        os.makedirs(self.dir, exist_ok=True)
+        seed = not os.path.exists(self.path)
+        # line buffered, every id is flushed as soon as it is added
+        self.file = open(self.path, "a", buffering=1)
+        self.lock = threading.Lock()
+        if seed:
+            stored = [entry.name[:-len(".npz")] for entry in os.scandir(save_dir) if entry.name.endswith(".npz")]
+            if stored:
+                log.info(f"Seeding the journal with {len(stored)} feature files already in {save_dir}")
+                self.file.writelines(f"{sample_id}\n" for sample_id in stored)
+
+    def completed(self) -> Set[str]:
+        return read_journal(os.path.dirname(self.dir))
+
+    def add(self, sample_id: str) -> None:
+        # called from the writer threads of FeatureWriter
+        with self.lock:
+            self.file.write(f"{sample_id}\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
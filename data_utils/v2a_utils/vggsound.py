@@ -8,7 +8,7 @@ import torch
 import torchaudio
 from torch.utils.data.dataset import Dataset
 from torchvision.transforms import v2
-from torio.io import StreamingMediaDecoder
+from data_utils.v2a_utils.video_utils import read_clip_and_sync_frames
 from torchvision.utils import save_image
 
 log = logging.getLogger()
@@ -101,25 +101,8 @@ class VGGSound(Dataset):
         video_id = self.videos[idx]
         label = self.labels[idx]
 
-        reader = StreamingMediaDecoder(self.root / (video_id + '.mp4'))
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_CLIP_FPS * self.duration_sec),
-            frame_rate=_CLIP_FPS,
-            format='rgb24',
-        )
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_SYNC_FPS * self.duration_sec),
-            frame_rate=_SYNC_FPS,
-            format='rgb24',
-        ) 
-        reader.add_basic_audio_stream(frames_per_chunk=2**30,)
-
-        reader.fill_buffer()
-        data_chunk = reader.pop_chunks()
-
-        clip_chunk = data_chunk[0]
-        sync_chunk = data_chunk[1]
-        audio_chunk = data_chunk[2]
+        clip_chunk, sync_chunk, audio_chunk, sample_rate = read_clip_and_sync_frames(
+            self.root / (video_id + '.mp4'), self.duration_sec, _CLIP_FPS, _SYNC_FPS, audio=True)
         if len(audio_chunk.shape) != 2:
             raise RuntimeError(f'error audio shape {video_id}')
         if clip_chunk is None:
@@ -138,7 +121,6 @@ class VGGSound(Dataset):
         # import ipdb
         # ipdb.set_trace()
         # process audio
-        sample_rate = int(reader.get_out_stream_info(2).sample_rate)
         audio_chunk = audio_chunk.transpose(0, 1)
         abs_max = audio_chunk[0].abs().max()
         # audio_chunk = audio_chunk.mean(dim=0)  # mono
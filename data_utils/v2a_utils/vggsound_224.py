@@ -8,9 +8,8 @@ import torch
 import torchaudio
 from torch.utils.data.dataset import Dataset
 from torchvision.transforms import v2
-from torio.io import StreamingMediaDecoder
+from data_utils.v2a_utils.video_utils import CLIPFrameTransform, read_clip_and_sync_frames
 from torchvision.utils import save_image
-from transformers import AutoProcessor
 import torch.nn.functional as F
 import numpy as np
 
@@ -138,7 +137,7 @@ class VGGSound(Dataset):
             v2.ToImage(),
             v2.ToDtype(torch.float32, scale=True),
         ])
-        self.clip_processor = AutoProcessor.from_pretrained("facebook/metaclip-h14-fullcc2.5b")
+        self.clip_processor = CLIPFrameTransform.from_pretrained("facebook/metaclip-h14-fullcc2.5b")
         self.sync_transform = v2.Compose([
             v2.Resize(_SYNC_SIZE, interpolation=v2.InterpolationMode.BICUBIC),
             v2.CenterCrop(_SYNC_SIZE),
@@ -153,25 +152,8 @@ class VGGSound(Dataset):
         video_id = self.videos[idx]
         label = self.labels[idx]
 
-        reader = StreamingMediaDecoder(self.root / (video_id + '.mp4'))
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_CLIP_FPS * self.duration_sec),
-            frame_rate=_CLIP_FPS,
-            format='rgb24',
-        )
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_SYNC_FPS * self.duration_sec),
-            frame_rate=_SYNC_FPS,
-            format='rgb24',
-        ) 
-        reader.add_basic_audio_stream(frames_per_chunk=2**30,)
-
-        reader.fill_buffer()
-        data_chunk = reader.pop_chunks()
-
-        clip_chunk = data_chunk[0]
-        sync_chunk = data_chunk[1]
-        audio_chunk = data_chunk[2]
+        clip_chunk, sync_chunk, audio_chunk, sample_rate = read_clip_and_sync_frames(
+            self.root / (video_id + '.mp4'), self.duration_sec, _CLIP_FPS, _SYNC_FPS, audio=True)
         if len(audio_chunk.shape) != 2:
             raise RuntimeError(f'error audio shape {video_id}')
         if clip_chunk is None:
@@ -192,7 +174,6 @@ class VGGSound(Dataset):
         # process audio
         # import ipdb
         # ipdb.set_trace()
-        sample_rate = int(reader.get_out_stream_info(2).sample_rate)
         audio_chunk = audio_chunk.transpose(0, 1)
         abs_max = audio_chunk[0].abs().max()
         # audio_chunk = audio_chunk.mean(dim=0)  # mono
@@ -262,7 +243,7 @@ class VGGSound(Dataset):
         # clip_chunk = self.clip_transform(clip_chunk)
         # import ipdb
         # ipdb.set_trace()
-        clip_chunk = self.clip_processor(images=clip_chunk, return_tensors="pt")["pixel_values"]
+        clip_chunk = self.clip_processor(clip_chunk)
         # log.info(clip_chunk.shape)
         # save_tensor_as_image(clip_chunk[0].numpy(),'scale.png')
         # log.info(clip_chunk[0])
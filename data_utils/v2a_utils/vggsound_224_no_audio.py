@@ -1,4 +1,3 @@
-import os
 from pathlib import Path
 from typing import Optional, Union
 from PIL import Image
@@ -8,9 +7,8 @@ import torch
 import torchaudio
 from torch.utils.data.dataset import Dataset
 from torchvision.transforms import v2
-from torio.io import StreamingMediaDecoder
+from data_utils.v2a_utils.video_utils import CLIPFrameTransform, read_clip_and_sync_frames
 from torchvision.utils import save_image
-from transformers import AutoProcessor
 import torch.nn.functional as F
 import numpy as np
 
@@ -84,7 +82,9 @@ class VGGSound(Dataset):
         normalize_audio: bool = False,
         start_row: Optional[int] = None,
         end_row: Optional[int] = None,
-        save_dir: str = 'data/vggsound/video_latents_text/train'
+        rank: int = 0,
+        world_size: int = 1,
+        completed_ids: Optional[set] = None,
     ):
         self.root = Path(root)
         self.normalize_audio = normalize_audio
@@ -108,12 +108,17 @@ class VGGSound(Dataset):
         df_list = pd.read_csv(tsv_path, sep=',', dtype={'id': str}).to_dict('records')
         
         # 控制处理的行范围
-        if start_row is not None and end_row is not None:
-            df_list = df_list[start_row:end_row]
+        df_list = df_list[start_row:end_row]
+        # every rank extracts an interleaved shard of the rows
+        df_list = df_list[rank::world_size]
+        completed_ids = completed_ids or set()
+        num_completed = 0
         
         for record in df_list:
             id = record['id']
-            if os.path.exists(f'{save_dir}/{id}.pth'): continue
+            if id in completed_ids:
+                num_completed += 1
+                continue
             label = record['caption']
             caption_cot = record['caption_cot']
             # if id in videos:
@@ -125,7 +130,8 @@ class VGGSound(Dataset):
             #     missing_videos.append(id)
 
         log.info(f'{len(videos)} videos found in {root}')
-        log.info(f'{len(self.videos)} videos found in {tsv_path}')
+        log.info(f'{len(self.videos)} videos found in {tsv_path} (shard {rank}/{world_size}), '
+                 f'{num_completed} already extracted')
         log.info(f'{len(missing_videos)} videos missing in {root}')
 
         self.sample_rate = sample_rate
@@ -141,7 +147,7 @@ class VGGSound(Dataset):
             v2.ToImage(),
             v2.ToDtype(torch.float32, scale=True),
         ])
-        self.clip_processor = AutoProcessor.from_pretrained("facebook/metaclip-h14-fullcc2.5b")
+        self.clip_processor = CLIPFrameTransform.from_pretrained("facebook/metaclip-h14-fullcc2.5b")
         self.sync_transform = v2.Compose([
             v2.Resize(_SYNC_SIZE, interpolation=v2.InterpolationMode.BICUBIC),
             v2.CenterCrop(_SYNC_SIZE),
@@ -157,24 +163,7 @@ class VGGSound(Dataset):
         label = self.labels[idx]
         caption_cot = self.caption_cot[idx]
 
-        reader = StreamingMediaDecoder(self.root / (video_id + '.mp4'))
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_CLIP_FPS * self.duration_sec),
-            frame_rate=_CLIP_FPS,
-            format='rgb24',
-        )
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_SYNC_FPS * self.duration_sec),
-            frame_rate=_SYNC_FPS,
-            format='rgb24',
-        ) 
-        # reader.add_basic_audio_stream(frames_per_chunk=2**30,)
-
-        reader.fill_buffer()
-        data_chunk = reader.pop_chunks()
-
-        clip_chunk = data_chunk[0]
-        sync_chunk = data_chunk[1]
+        clip_chunk, sync_chunk, _, _ = read_clip_and_sync_frames(self.root / (video_id + '.mp4'), self.duration_sec, _CLIP_FPS, _SYNC_FPS)
         # audio_chunk = data_chunk[2]
         # if len(audio_chunk.shape) != 2:
         #     raise RuntimeError(f'error audio shape {video_id}')
@@ -216,7 +205,7 @@ class VGGSound(Dataset):
         # clip_chunk = self.clip_transform(clip_chunk)
         # import ipdb
         # ipdb.set_trace()
-        clip_chunk = self.clip_processor(images=clip_chunk, return_tensors="pt")["pixel_values"]
+        clip_chunk = self.clip_processor(clip_chunk)
         # log.info(clip_chunk.shape)
         # save_tensor_as_image(clip_chunk[0].numpy(),'scale.png')
         # log.info(clip_chunk[0])
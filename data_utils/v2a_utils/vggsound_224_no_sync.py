@@ -10,7 +10,7 @@ from torch.utils.data.dataset import Dataset
 from torchvision.transforms import v2
 from torio.io import StreamingMediaDecoder
 from torchvision.utils import save_image
-from transformers import AutoProcessor
+from data_utils.v2a_utils.video_utils import CLIPFrameTransform
 import torch.nn.functional as F
 import numpy as np
 
@@ -138,7 +138,7 @@ class VGGSound(Dataset):
             v2.ToImage(),
             v2.ToDtype(torch.float32, scale=True),
         ])
-        self.clip_processor = AutoProcessor.from_pretrained("useful_ckpts/metaclip-huge")
+        self.clip_processor = CLIPFrameTransform.from_pretrained("useful_ckpts/metaclip-huge")
 
         self.resampler = {}
 
@@ -189,7 +189,7 @@ class VGGSound(Dataset):
         # clip_chunk = self.clip_transform(clip_chunk)
         # import ipdb
         # ipdb.set_trace()
-        clip_chunk = self.clip_processor(images=clip_chunk, return_tensors="pt")["pixel_values"]
+        clip_chunk = self.clip_processor(clip_chunk)
         
         data = {
             'id': video_id,
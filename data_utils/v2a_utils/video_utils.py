@@ -0,0 +1,117 @@
+import math
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+
+import torch
+import torch.nn.functional as F
+from torio.io import StreamingMediaDecoder
+
+_CLIP_FPS = 8.0
+_SYNC_FPS = 25.0
+
+# CLIPImageProcessor defaults, also used by MetaCLIP
+_CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+_CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class DecodedVideo(NamedTuple):
+    clip_chunk: torch.Tensor  # (T_clip, C, H, W) uint8 at clip_fps
+    sync_chunk: torch.Tensor  # (T_sync, C, H, W) uint8 at sync_fps
+    audio_chunk: Optional[torch.Tensor] = None  # (samples, channels), only with audio=True
+    sample_rate: Optional[int] = None
+
+
+def resampled_frame_indices(num_frames: int, src_fps: float, dst_fps: float) -> torch.Tensor:
+    """
+    Indices of the src_fps frames a dst_fps stream of the same span would show: for every dst timestamp k / dst_fps,
+    the nearest src frame (ties round up, like the rounding of the FFmpeg fps filter).
+    """
+    num_out = math.ceil(num_frames * dst_fps / src_fps)
+    indices = torch.floor(torch.arange(num_out, dtype=torch.float64) * (src_fps / dst_fps) + 0.5).long()
+    return indices.clamp_(max=num_frames - 1)
+
+
+def read_clip_and_sync_frames(video_path: Union[str, Path], duration_sec: float, clip_fps: float = _CLIP_FPS,
+                              sync_fps: float = _SYNC_FPS, audio: bool = False) -> DecodedVideo:
+    """
+    Decodes the first duration_sec of a video once, at sync_fps, and takes the clip_fps frames from it by timestamp.
+
+    Registering one stream per frame rate makes FFmpeg decode and filter the container twice. The CLIP frames
+    picked here are those an 8 fps stream resampled from the 25 fps one would show; against resampling the
+    source directly they can differ by at most one source frame. With audio=True the audio stream is decoded
+    in the same pass.
+    """
+    reader = StreamingMediaDecoder(str(video_path))
+    reader.add_basic_video_stream(
+        frames_per_chunk=int(sync_fps * duration_sec),
+        frame_rate=sync_fps,
+        format='rgb24',
+    )
+    if audio:
+        reader.add_basic_audio_stream(frames_per_chunk=2**30,)
+
+    reader.fill_buffer()
+    data_chunk = reader.pop_chunks()
+
+    sync_chunk = data_chunk[0]
+    if sync_chunk is None or sync_chunk.shape[0] == 0:
+        raise RuntimeError(f'Video returned no frames {video_path}')
+    clip_chunk = sync_chunk[resampled_frame_indices(sync_chunk.shape[0], sync_fps, clip_fps)]
+
+    if not audio:
+        return DecodedVideo(clip_chunk, sync_chunk)
+    sample_rate = int(reader.get_out_stream_info(1).sample_rate)
+    return DecodedVideo(clip_chunk, sync_chunk, data_chunk[1], sample_rate)
+
+
+class CLIPFrameTransform:
+    """
+    Tensor-native replacement for the image part of the Hugging Face CLIP processor, processor(images=frames,
+    return_tensors="pt")["pixel_values"], applied to a whole (T, C, H, W) uint8 frame stack.
+
+    The HF processor converts every frame to PIL, resizes and normalizes it one at a time. Here the shortest
+    edge is resized with antialiased bicubic interpolation (which follows PIL's kernel), rounded back to uint8
+    levels as PIL does, center cropped and normalized, chunk_size frames per batched op to bound the float
+    copies of full resolution frames. With device set, the frames are processed (and returned) there.
+    Outputs stay within one uint8 level (~0.015 after normalization) of the processor's, which
+    benchmarks/bench_clip_transform.py checks with its default tolerances.
+    """
+    def __init__(self, size: int = 224, crop_size: Union[int, tuple] = 224, mean: tuple = _CLIP_MEAN,
+                 std: tuple = _CLIP_STD, device: Optional[Union[str, torch.device]] = None, chunk_size: int = 16):
+        self.size = size
+        self.crop_size = (crop_size, crop_size) if isinstance(crop_size, int) else tuple(crop_size)
+        self.device = device
+        self.chunk_size = chunk_size
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+    @classmethod
+    def from_pretrained(cls, name_or_path: str, **kwargs) -> "CLIPFrameTransform":
+        """Reads size, crop size, mean and std from the preprocessor config of a CLIP checkpoint."""
+        from transformers import CLIPImageProcessor
+        processor = CLIPImageProcessor.from_pretrained(name_or_path)
+        return cls(size=processor.size["shortest_edge"],
+                   crop_size=(processor.crop_size["height"], processor.crop_size["width"]),
+                   mean=tuple(processor.image_mean), std=tuple(processor.image_std), **kwargs)
+
+    def resized_size(self, height: int, width: int) -> tuple:
+        # as transformers' get_resize_output_image_size with default_to_square=False
+        if height <= width:
+            return self.size, int(self.size * width / height)
+        return int(self.size * height / width), self.size
+
+    def __call__(self, frames: torch.Tensor) -> torch.Tensor:
+        height, width = frames.shape[-2:]
+        resized = self.resized_size(height, width)
+        top = (resized[0] - self.crop_size[0]) // 2
+        left = (resized[1] - self.crop_size[1]) // 2
+        device = self.device if self.device is not None else frames.device
+        mean, std = self.mean.to(device), self.std.to(device)
+        outputs = []
+        for chunk in frames.split(self.chunk_size):
+            chunk = chunk.to(device, non_blocking=True).float()
+            chunk = F.interpolate(chunk, size=resized, mode='bicubic', align_corners=False, antialias=True)
+            chunk = chunk.round_().clamp_(0, 255)
+            chunk = chunk[..., top:top + self.crop_size[0], left:left + self.crop_size[1]]
+            outputs.append((chunk / 255 - mean) / std)
+        return torch.cat(outputs)
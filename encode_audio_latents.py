@@ -0,0 +1,204 @@
+import argparse
+import json
+import logging
+import math
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import torch
+import torch.multiprocessing as mp
+import torchaudio
+from torch.utils.data import DataLoader, Dataset
+from torch.utils.data.dataloader import default_collate
+from tqdm import tqdm
+
+from ThinkSound.data.packed import PackedShardWriter, completed_ids
+from ThinkSound.inference.device import DevicePolicy
+from ThinkSound.models.factory import create_pretransform_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTS = ('.mp4', '.mkv', '.webm', '.mov', '.avi')
+AUDIO_EXTS = ('.wav', '.flac', '.mp3', '.ogg', '.m4a', '.opus')
+
+
+def error_avoidance_collate(batch):
+    batch = list(filter(lambda x: x is not None, batch))
+    if len(batch) == 0:
+        return None
+    return default_collate(batch)
+
+
+def list_media(root, tsv_path=None):
+    """Maps sample ids to media files, from the id column of tsv_path or every media file under root."""
+    exts = VIDEO_EXTS + AUDIO_EXTS
+    if tsv_path:
+        ids = pd.read_csv(tsv_path, sep=',', dtype={'id': str})['id'].tolist()
+        media = {}
+        for sample_id in ids:
+            for ext in exts:
+                path = os.path.join(root, sample_id + ext)
+                if os.path.exists(path):
+                    media[sample_id] = path
+                    break
+            else:
+                logger.warning(f"No media file for {sample_id} in {root}")
+        return media
+    return {Path(f).stem: os.path.join(root, f) for f in sorted(os.listdir(root)) if f.lower().endswith(exts)}
+
+
+class AudioClips(Dataset):
+    """Stereo audio at sample_rate, padded or cropped to audio_samples, from video or audio files."""
+    def __init__(self, items, sample_rate=44100, audio_samples=397312):
+        self.items = items
+        self.sample_rate = sample_rate
+        self.audio_samples = audio_samples
+        self.resampler = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def load(self, path):
+        if path.lower().endswith(VIDEO_EXTS):
+            from torio.io import StreamingMediaDecoder
+            reader = StreamingMediaDecoder(path)
+            reader.add_basic_audio_stream(frames_per_chunk=2**30)
+            reader.fill_buffer()
+            audio = reader.pop_chunks()[0].transpose(0, 1)
+            sample_rate = int(reader.get_out_stream_info(0).sample_rate)
+        else:
+            audio, sample_rate = torchaudio.load(path)
+        return audio, sample_rate
+
+    def __getitem__(self, idx):
+        sample_id, path = self.items[idx]
+        try:
+            audio, sample_rate = self.load(path)
+        except Exception as e:
+            logger.error(f"Error loading {path}: {e}")
+            return None
+
+        if sample_rate != self.sample_rate:
+            if sample_rate not in self.resampler:
+                # https://pytorch.org/audio/stable/tutorials/audio_resampling_tutorial.html#kaiser-best
+                self.resampler[sample_rate] = torchaudio.transforms.Resample(
+                    sample_rate,
+                    self.sample_rate,
+                    lowpass_filter_width=64,
+                    rolloff=0.9475937167399596,
+                    resampling_method='sinc_interp_kaiser',
+                    beta=14.769656459379492,
+                )
+            audio = self.resampler[sample_rate](audio)
+
+        # ensure stereo
+        if audio.shape[0] < 2:
+            audio = audio.repeat(2, 1)
+        audio = audio[:2]
+
+        num_samples = min(audio.shape[1], self.audio_samples)
+        audio = audio[:, :self.audio_samples]
+        if audio.shape[1] < self.audio_samples:
+            audio = torch.cat([audio, audio.new_zeros(2, self.audio_samples - audio.shape[1])], dim=1)
+        return {'id': sample_id, 'audio': audio.float(), 'num_samples': num_samples}
+
+
+def create_pretransform(args, device_policy):
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+    pretransform_config = model_config["model"]["pretransform"]
+    pretransform_config["chunked"] = True
+    if args.precision:
+        pretransform_config["precision"] = args.precision
+    pretransform = create_pretransform_from_config(pretransform_config, model_config["sample_rate"])
+    pretransform.load_state_dict(load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.'))
+    return pretransform.to(device_policy.device).eval()
+
+
+def encode_rank(rank, world_size, args):
+    if world_size > 1 and args.device in ('', 'auto', 'cuda') and torch.cuda.is_available():
+        device = f"cuda:{rank % torch.cuda.device_count()}"
+    else:
+        device = args.device
+    device_policy = DevicePolicy.create(device, num_threads=args.num_threads).apply()
+
+    media = list_media(args.root, args.tsv_path)
+    done = completed_ids(args.save_dir)
+    # every rank takes a fixed slice of the sorted ids, so a resumed run assigns the same work
+    items = sorted(media.items())[rank::world_size]
+    items = [item for item in items if item[0] not in done]
+    logger.info(f"[rank {rank}] {len(items)} clips to encode on {device_policy.device} ({len(done)} already done)")
+    if not items:
+        return
+
+    pretransform = create_pretransform(args, device_policy)
+    samples_per_latent = pretransform.downsampling_ratio
+    # same latent length as training, round(sample_rate / downsampling_ratio * duration)
+    audio_samples = round(args.sample_rate * args.duration_sec / samples_per_latent) * samples_per_latent
+    latent_dtype = {'fp32': torch.float32, 'fp16': torch.float16}[args.latent_dtype]
+
+    dataset = AudioClips(items, sample_rate=args.sample_rate, audio_samples=audio_samples)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        pin_memory=device_policy.is_cuda,
+        collate_fn=error_avoidance_collate,
+    )
+    start = time.perf_counter()
+    encoded = 0
+    with PackedShardWriter(args.save_dir, prefix=f"rank{rank:03d}", shard_size=args.shard_size) as writer:
+        for batch in tqdm(dataloader, desc=f"rank {rank}", unit="batch", position=rank):
+            if batch is None:
+                continue
+            with torch.no_grad():
+                latents = pretransform.encode(device_policy.to(batch['audio']),
+                                              chunk_size=args.chunk_size, overlap=args.overlap)
+            latents = latents.to(latent_dtype).cpu().numpy()
+            for sample_id, latent, num_samples in zip(batch['id'], latents, batch['num_samples'].tolist()):
+                # latent frames that cover at least one sample of the original audio
+                padding_mask = torch.zeros(latent.shape[-1], dtype=torch.bool)
+                padding_mask[:math.ceil(num_samples / samples_per_latent)] = True
+                writer.add(sample_id, latent=latent, padding_mask=padding_mask.numpy())
+            encoded += len(batch['id'])
+    elapsed = time.perf_counter() - start
+    logger.info(f"[rank {rank}] encoded {encoded} clips in {elapsed:.1f}s ({encoded / max(elapsed, 1e-6):.2f} clips/s)")
+
+
+def main(args):
+    os.makedirs(args.save_dir, exist_ok=True)
+    if 'WORLD_SIZE' in os.environ:
+        # launched with torchrun, one process per rank
+        encode_rank(int(os.environ['RANK']), int(os.environ['WORLD_SIZE']), args)
+    elif args.num_procs > 1:
+        mp.spawn(encode_rank, args=(args.num_procs, args), nprocs=args.num_procs)
+    else:
+        encode_rank(0, 1, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Encode the audio of videos or audio files into packed VAE latent shards for pre_encoded training')
+    parser.add_argument('--root', default='videos', help='Directory with the video or audio files')
+    parser.add_argument('--tsv_path', default=None, help='CSV with an id column (default: every media file under root)')
+    parser.add_argument('--save-dir', default='latents')
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--pretransform_ckpt_path', default='ckpts/vae.ckpt')
+    parser.add_argument('--sample_rate', type=int, default=44100)
+    parser.add_argument('--duration_sec', type=float, default=9.0)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_workers', type=int, default=4, help='Audio decoding workers per process')
+    parser.add_argument('--num_procs', type=int, default=1, help='Encoding processes, one per GPU (ignored under torchrun)')
+    parser.add_argument('--chunk_size', type=int, default=128, help='VAE chunk size in latents')
+    parser.add_argument('--overlap', type=int, default=None, help='VAE chunk overlap in latents (default: the calibrated encode_overlap of the model config)')
+    parser.add_argument('--precision', default=None, choices=['fp32', 'fp16', 'bf16'], help='VAE compute precision (default: model config)')
+    parser.add_argument('--latent_dtype', default='fp32', choices=['fp32', 'fp16'], help='Storage dtype of the latents')
+    parser.add_argument('--shard_size', type=int, default=1024, help='Clips per shard')
+    parser.add_argument('--device', default='', help="Compute device, e.g. 'cuda:0' or 'cpu' (default: CUDA when available)")
+    parser.add_argument('--num_threads', type=int, default=0, help='CPU intra-op threads (0 uses the CPU affinity mask)')
+
+    args = parser.parse_args()
+    main(args)
@@ -2,6 +2,8 @@ from prefigure.prefigure import get_all_args, push_wandb_config
 import json
 import os
 import re
+import time
+from contextlib import nullcontext
 import torch
 import torchaudio
 from lightning.pytorch import seed_everything
@@ -10,25 +12,45 @@ from datetime import datetime
 import numpy as np
 
 from ThinkSound.data.datamodule import DataModule
+from ThinkSound.data.batch import stack_metadata
 from ThinkSound.models import create_model_from_config
 from ThinkSound.models.utils import load_ckpt_state_dict, remove_weight_norm_from_model
+from ThinkSound.models.conditioners import get_conditioning_keys
 from ThinkSound.inference.sampling import sample, sample_discrete_euler
+from ThinkSound.inference.device import DevicePolicy, get_device_policy
+from ThinkSound.inference.compile import compile_model
+from ThinkSound.inference.offload import OffloadScheduler, create_offload_scheduler
+from ThinkSound.inference.preview import load_preview_decoder
 from pathlib import Path
 from tqdm import tqdm
 
 
-def predict_step(diffusion, batch, diffusion_objective, device='cuda:0'):
-    diffusion = diffusion.to(device)
+def predict_step(diffusion, batch, diffusion_objective, device_policy: DevicePolicy = None, offload: OffloadScheduler = None, decoder=None):
+    device_policy = get_device_policy(device_policy)
+    device = device_policy.device
+    # decoder: replaces the VAE pretransform for decoding, e.g. a preview decoder (see load_preview_decoder)
+    decoder = decoder if decoder is not None else diffusion.pretransform
+    if offload is None:
+        diffusion = diffusion.to(device)
+        if decoder is not None:
+            decoder = decoder.to(device)
+
+    def stage(name, *modules):
+        return offload.stage(name, *modules) if offload is not None else nullcontext()
 
     reals, metadata = batch
     ids = [item['id'] for item in metadata]
     batch_size, length = reals.shape[0], reals.shape[2]
-    with torch.amp.autocast('cuda'):
+    stage_start = time.perf_counter()
+    with stage("conditioning", diffusion.conditioner), device_policy.autocast():
         conditioning = diffusion.conditioner(metadata, device)
     
-    video_exist = torch.stack([item['video_exist'] for item in metadata],dim=0)
-    conditioning['metaclip_features'][~video_exist] = diffusion.model.model.empty_clip_feat
-    conditioning['sync_features'][~video_exist] = diffusion.model.model.empty_sync_feat
+    video_exist = stack_metadata(metadata, 'video_exist').to(device)
+    conditioning['metaclip_features'][~video_exist] = diffusion.model.model.empty_clip_feat.to(device)
+    conditioning['sync_features'][~video_exist] = diffusion.model.model.empty_sync_feat.to(device)
+    # duration-bucketed batches (bucket_by_duration) change the sequence lengths from batch to batch
+    diffusion.model.model.match_seq_lengths(length, conditioning['metaclip_features'].shape[1],
+                                            conditioning['sync_features'].shape[1])
 
     cond_inputs = diffusion.get_conditioning_inputs(conditioning)
     if batch_size > 1:
@@ -40,15 +62,31 @@ def predict_step(diffusion, batch, diffusion_objective, device='cuda:0'):
     else:
         noise = torch.randn([batch_size, diffusion.io_channels, length]).to(device)
 
-    with torch.amp.autocast('cuda'):
+    device_policy.synchronize()
+    timings = {"conditioning": time.perf_counter() - stage_start}
+
+    with device_policy.autocast():
 
         model = diffusion.model
-        if diffusion_objective == "v":
-            fakes = sample(model, noise, 24, 0, **cond_inputs, cfg_scale=5, batch_cfg=True)
-        elif diffusion_objective == "rectified_flow":
-            fakes = sample_discrete_euler(model, noise, 24, **cond_inputs, cfg_scale=5, batch_cfg=True)
-        if diffusion.pretransform is not None:
-            fakes = diffusion.pretransform.decode(fakes)
+        stage_start = time.perf_counter()
+        with stage("sampling", model):
+            if diffusion_objective == "v":
+                fakes = sample(model, noise, 24, 0, device_policy=device_policy, **cond_inputs, cfg_scale=5, batch_cfg=True)
+            elif diffusion_objective == "rectified_flow":
+                fakes = sample_discrete_euler(model, noise, 24, **cond_inputs, cfg_scale=5, batch_cfg=True)
+        device_policy.synchronize()
+        timings["sampling"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        if decoder is not None:
+            with stage("decode", decoder):
+                fakes = decoder.decode(fakes)
+        device_policy.synchronize()
+        timings["decode"] = time.perf_counter() - stage_start
+
+    print("Stage timings on {}: {}".format(device, ", ".join(f"{k} {v:.2f}s" for k, v in timings.items())))
+    if offload is not None:
+        print(offload.report())
 
     audios = fakes.to(torch.float32).div(torch.max(torch.abs(fakes))).clamp(-1, 1).mul(32767).to(torch.int16).cpu()
     return audios
@@ -81,13 +119,35 @@ def main():
     model_config["model"]["diffusion"]["config"]["clip_seq_len"] = 8 * int(duration)
     model_config["model"]["diffusion"]["config"]["latent_seq_len"] = latent_length
 
-    model = create_model_from_config(model_config)
-    if args.compile:
-        model = torch.compile(model)
+    device_policy = DevicePolicy.create(args.device, num_threads=args.num_threads).apply()
 
-    model.load_state_dict(torch.load(args.ckpt_dir))
+    model = create_model_from_config(model_config)
+    if args.offload:
+        # memory-map the checkpoint and adopt its tensors instead of copying them into the model
+        model.load_state_dict(torch.load(args.ckpt_dir, map_location='cpu', mmap=True), assign=True)
+    else:
+        model.load_state_dict(torch.load(args.ckpt_dir, map_location='cpu'))
     vae_state = load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.')
     model.pretransform.load_state_dict(vae_state)
+    # bake weight norm and precompute the Snake activations of the VAE, inference only
+    model.pretransform.prepare_for_inference()
+
+    # a distilled low sample rate decoder for quick previews instead of the full VAE
+    preview_decoder = None
+    if args.preview_decoder_config:
+        preview_decoder = load_preview_decoder(args.preview_decoder_config, args.preview_decoder_ckpt_path)
+    output_sample_rate = preview_decoder.decoder_sample_rate if preview_decoder is not None else 44100
+
+    if args.clip_merge_ratio > 0 or args.text_merge_ratio > 0:
+        model.model.model.set_token_merge(args.clip_merge_ratio, args.text_merge_ratio)
+
+    offload = None
+    if args.offload:
+        offload = create_offload_scheduler(model, device_policy, pin_memory=args.offload_pin_memory)
+        if args.compile:
+            print("Skipping torch.compile: not supported together with offload")
+    elif args.compile:
+        model = compile_model(model, strategy=args.compile_mode, cache_dir=args.compile_cache_dir)
 
 
     if args.dataset_config == '':
@@ -107,6 +167,7 @@ def main():
         sample_size=(float)(args.duration_sec) * model_config["sample_rate"],
         audio_channels=model_config.get("audio_channels", 2),
         latent_length=round(44100/64/32*duration),
+        keys=get_conditioning_keys(model_config["model"]),
     )
     dm.setup('predict')
     dl = dm.predict_dataloader()
@@ -122,7 +183,9 @@ def main():
             model,
             batch=batch,
             diffusion_objective=model_config["model"]["diffusion"]["diffusion_objective"],
-            device='cuda:0'
+            device_policy=device_policy,
+            offload=offload,
+            decoder=preview_decoder
         )
 
         _, metadata = batch
@@ -130,7 +193,7 @@ def main():
 
         for i in range(audio.size(0)):
             id_str = ids[i] if i < len(ids) else f"unknown_{i}"
-            torchaudio.save(os.path.join(audio_dir, f"{id_str}.wav"), audio[i], 44100)
+            torchaudio.save(os.path.join(audio_dir, f"{id_str}.wav"), audio[i], output_sample_rate)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import argparse
+import json
+import logging
+
+import torch
+
+from ThinkSound.models.factory import create_pretransform_from_config
+from ThinkSound.models.utils import load_ckpt_state_dict
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Maximum abs difference (audio in [-1, 1]) allowed between the training-form VAE and the prepared one, in fp32.
+# Baking weight norm and precomputing exp(alpha), exp(beta) and the reciprocal reproduce the same fp32 ops,
+# so they are exact up to reassociation in the conv kernels. Only the addcmul fusion in the Snake activations
+# changes rounding (one fused multiply-add instead of a multiply and an add, <= 1 ulp per activation), which
+# stays far below the tolerance over the decoder. fp16/bf16 exports round the weights and get looser tolerances.
+DECODE_ATOL = {torch.float32: 1e-4, torch.float16: 1e-2, torch.bfloat16: 5e-2}
+
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def create_pretransform(model_config):
+    return create_pretransform_from_config(model_config["model"]["pretransform"], model_config["sample_rate"])
+
+
+@torch.no_grad()
+def max_decode_diff(reference, candidate, latents):
+    return (reference.model.decode(latents) - candidate.model.decode(latents)).abs().max().item()
+
+
+def main(args):
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+    # Export the full precision weights, the precision is chosen at load time
+    model_config["model"]["pretransform"].pop("model_half", None)
+    model_config["model"]["pretransform"]["precision"] = "fp32"
+    dtype = DTYPES[args.dtype]
+
+    state_dict = load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.')
+    reference = create_pretransform(model_config).eval()
+    reference.load_state_dict(state_dict)
+
+    pretransform = create_pretransform(model_config).eval()
+    pretransform.load_state_dict(state_dict)
+    pretransform.prepare_for_inference()
+    pretransform.save_inference_checkpoint(args.output, decoder_only=args.decoder_only, dtype=dtype if dtype != torch.float32 else None)
+    logger.info(f"Saved inference checkpoint to {args.output}")
+
+    if args.skip_verify:
+        return
+
+    # Reload through the regular loading path and compare against the training-form model
+    exported = create_pretransform(model_config).eval()
+    # weights stored in fp16/bf16 are upcast on load, so the comparison runs in fp32 with rounded weights
+    exported.load_state_dict(load_ckpt_state_dict(args.output, prefix='autoencoder.'))
+
+    torch.manual_seed(0)
+    latents = torch.randn(1, reference.encoded_channels, args.latent_length)
+    diff = max_decode_diff(reference, exported, latents)
+    logger.info(f"Max abs decode difference: {diff:.3e} (tolerance {DECODE_ATOL[dtype]:.0e})")
+    if diff > DECODE_ATOL[dtype]:
+        raise RuntimeError(f"Exported VAE differs from the original by {diff:.3e} > {DECODE_ATOL[dtype]:.0e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bake weight norm and Snake activations of the VAE into a compact inference checkpoint')
+    parser.add_argument('--model_config', default='ThinkSound/configs/model_configs/thinksound.json')
+    parser.add_argument('--pretransform_ckpt_path', default='ckpts/vae.ckpt')
+    parser.add_argument('--output', default='ckpts/vae_inference.safetensors')
+    parser.add_argument('--decoder_only', action='store_true', help='Drop the encoder (enough for generation)')
+    parser.add_argument('--dtype', default='fp32', choices=list(DTYPES), help='Storage dtype of the floating point weights')
+    parser.add_argument('--latent_length', type=int, default=194, help='Latent length used for verification')
+    parser.add_argument('--skip_verify', action='store_true')
+    main(parser.parse_args())
@@ -1,27 +1,115 @@
 import argparse
 import os
 import torch
-import torch.distributed as dist
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 torch.backends.cudnn.benchmark = True
 from tqdm import tqdm
 import logging
 from data_utils.v2a_utils.vggsound_224_no_audio import VGGSound
 from data_utils.v2a_utils.feature_utils_224 import FeaturesUtils as OriginalFeatures
-import numpy as np
+from data_utils.v2a_utils.feature_writer import STORAGE_DTYPES, FeatureWriter
+from data_utils.v2a_utils.journal import ExtractionJournal
 from huggingface_hub import hf_hub_download
 from torch.utils.data.dataloader import default_collate
 import time
-import gc
+from ThinkSound.inference.device import DevicePolicy
+from ThinkSound.inference.offload import OffloadScheduler
+from contextlib import nullcontext
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# the fast tokenizers' thread pool does not survive forking and is not needed with one process per loader worker
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
 def error_avoidance_collate(batch):
+    # samples that failed to load are None (VGGSound logs the error), a batch of failures is skipped whole
     batch = list(filter(lambda x: x is not None, batch))
+    if not batch:
+        return None
     return default_collate(batch)
 
+def worker_init_fn(worker_id):
+    # every worker decodes and preprocesses its own clips, intra-op threads would only oversubscribe the CPUs
+    torch.set_num_threads(1)
+
+def build_dataloader(dataset, args, pin_memory):
+    """
+    Loader whose workers decode and preprocess the next batches while the encoders run on the current one.
+
+    Workers are spawned, not forked: forking after CUDA, OpenMP or tokenizer threads exist is what used to
+    hang extraction. A sample that fails to load is dropped from its batch; a worker stuck on one clip makes
+    the loader raise after loader_timeout seconds instead of hanging the job (see iterate_batches).
+    """
+    if args.num_workers == 0:
+        return DataLoader(dataset, batch_size=args.batch_size, pin_memory=pin_memory, drop_last=False,
+                          collate_fn=error_avoidance_collate)
+    return DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        prefetch_factor=args.prefetch_factor,
+        multiprocessing_context=args.mp_context,
+        worker_init_fn=worker_init_fn,
+        pin_memory=pin_memory,
+        drop_last=False,
+        collate_fn=error_avoidance_collate,
+        timeout=args.loader_timeout,
+    )
+
+def iterate_batches(dataset, args, pin_memory):
+    """
+    The batches of build_dataloader in order, with the workers started right away so they decode the first
+    batches while the encoders load.
+
+    A loader error while waiting for a batch (a worker stuck past loader_timeout or killed by a pathological
+    clip) skips that batch's clips and restarts the workers on the clips after it, so one bad clip does not
+    abort the shard. Skipped clips are not journaled and are retried by a --resume run. After more than
+    max_skipped_batches skips the error is raised.
+    """
+    batches = iter(build_dataloader(dataset, args, pin_memory))
+
+    def generate(batches):
+        start, skipped = 0, 0
+        while True:
+            try:
+                data = next(batches)
+            except StopIteration:
+                return
+            except RuntimeError as e:
+                if args.num_workers == 0:
+                    raise
+                # batches arrive in order, the failed one holds the next batch_size clips
+                failed = range(start, min(start + args.batch_size, len(dataset)))
+                skipped += 1
+                logger.error(f"Loader failed on clips {[dataset.videos[k] for k in failed]}: {e}")
+                if skipped > args.max_skipped_batches:
+                    raise RuntimeError(f"Skipped more than {args.max_skipped_batches} batches, rerun with --resume "
+                                       "to retry the clips that were not extracted") from e
+                start = failed.stop
+                del batches  # shuts the workers down, a stuck one is terminated
+                if start >= len(dataset):
+                    return
+                batches = iter(build_dataloader(Subset(dataset, range(start, len(dataset))), args, pin_memory))
+                continue
+            start += args.batch_size
+            yield data
+
+    return generate(batches)
+
+def get_shard(args):
+    """
+    (rank, world_size, local_rank) of this process: --rank / --world_size, else the torchrun or SLURM environment.
+    One process per GPU, e.g. torchrun --nnodes 2 --nproc_per_node 8 extract_latents.py ...
+    """
+    rank = args.rank if args.rank is not None else int(os.environ.get("RANK", os.environ.get("SLURM_PROCID", 0)))
+    world_size = args.world_size if args.world_size is not None else int(os.environ.get("WORLD_SIZE", os.environ.get("SLURM_NTASKS", 1)))
+    local_rank = int(os.environ.get("LOCAL_RANK", os.environ.get("SLURM_LOCALID", 0)))
+    if not 0 <= rank < world_size:
+        raise ValueError(f"Rank {rank} is outside a world size of {world_size}")
+    return rank, world_size, local_rank
+
 # GPU memory print helper
 def print_gpu(stage=""):
     if torch.cuda.is_available():
@@ -31,44 +119,49 @@ def print_gpu(stage=""):
     else:
         logger.info(f"[{stage}] CUDA not available")
 
-def warmup_models(extractor):
+def warmup_models(extractor, device_policy, stage):
     """Warm up models with dummy data to prevent hanging"""
-    logger.info("Warming up models...")
-    
-    if torch.cuda.is_available():
-        device = torch.device('cuda')
-        dtype = torch.float16 if extractor.use_half else torch.float32
-        
-        # Warm up CLIP
-        dummy_clip = torch.randn(1, 3, 224, 224, device=device, dtype=dtype)
-        _ = extractor.encode_video_with_clip(dummy_clip)
-        torch.cuda.empty_cache()
-        
-        # Warm up Synchformer
-        dummy_sync = torch.randn(1, 3, 16, 224, 224, device=device, dtype=dtype)
-        _ = extractor.encode_video_with_sync(dummy_sync)
-        torch.cuda.empty_cache()
-        
-        # Warm up text encoders
+    logger.info(f"Warming up models on {device_policy.device}...")
+
+    with device_policy.autocast():
+        # Warm up CLIP: (B, T, C, H, W)
+        dummy_clip = torch.randn(1, 8, 3, 224, 224)
         dummy_text = ["test caption"]
-        _ = extractor.encode_text(dummy_text)
-        _ = extractor.encode_t5_text(dummy_text)
-        torch.cuda.empty_cache()
-        
-        logger.info("✅ Models warmed up successfully")
-    else:
-        logger.info("⚠️  CUDA not available, skipping warmup")
+        with stage("clip", extractor.clip_model):
+            _ = extractor.encode_video_with_clip(dummy_clip)
+            _ = extractor.encode_text(dummy_text)
+
+        # Warm up Synchformer: one 16-frame segment
+        dummy_sync = torch.randn(1, 16, 3, 224, 224)
+        with stage("synchformer", extractor.synchformer):
+            _ = extractor.encode_video_with_sync(dummy_sync)
+
+        # Warm up T5
+        with stage("t5", extractor.t5_model):
+            _ = extractor.encode_t5_text(dummy_text)
+    device_policy.empty_cache()
+
+    logger.info("✅ Models warmed up successfully")
 
 def main(args):
     logger.info("Starting extract_latents.py...")
     logger.info(f"Arguments: {args}")
     
-    # Check CUDA availability
-    if torch.cuda.is_available():
-        logger.info(f"CUDA available: {torch.cuda.get_device_name(0)}")
+    rank, world_size, local_rank = get_shard(args)
+    device = args.device
+    if not device and world_size > 1 and torch.cuda.is_available():
+        device = f"cuda:{local_rank % torch.cuda.device_count()}"
+    device_policy = DevicePolicy.create(device, num_threads=args.num_threads).apply()
+    if device_policy.is_cuda:
+        logger.info(f"CUDA available: {torch.cuda.get_device_name(device_policy.device)}")
     else:
         logger.warning("CUDA not available, using CPU")
     
+    # ids are journaled as their features are stored, --resume skips the ids every rank has journaled
+    os.makedirs(args.save_dir, exist_ok=True)
+    journal = ExtractionJournal(args.save_dir, rank)
+    completed_ids = journal.completed() if args.resume else set()
+
     # Dataset
     logger.info("Loading dataset...")
     dataset = VGGSound(
@@ -79,26 +172,26 @@ def main(args):
         audio_samples=args.audio_samples,
         start_row=args.start_row,
         end_row=args.end_row,
-        save_dir=args.save_dir
+        rank=rank,
+        world_size=world_size,
+        completed_ids=completed_ids,
     )
     
     if len(dataset) == 0:
-        logger.error("Dataset is empty! Check your TSV file and root directory.")
+        if completed_ids:
+            logger.info(f"Shard {rank}/{world_size} is already extracted")
+        else:
+            logger.error("Dataset is empty! Check your TSV file and root directory.")
+        journal.close()
         return
     
-    logger.info(f"Dataset loaded with {len(dataset)} samples")
-    os.makedirs(args.save_dir, exist_ok=True)
+    logger.info(f"Dataset loaded with {len(dataset)} samples (shard {rank}/{world_size})")
 
-    # DataLoader with timeout to prevent hanging
-    dataloader = DataLoader(
-        dataset,
-        batch_size=2,
-        num_workers=0,  # Use 0 to prevent multiprocessing issues
-        pin_memory=False,
-        drop_last=False,
-        collate_fn=error_avoidance_collate,
-        timeout=300  # 5 minute timeout
-    )
+    num_batches = (len(dataset) + args.batch_size - 1) // args.batch_size
+    logger.info(f"DataLoader: batch size {args.batch_size}, {args.num_workers} workers, "
+                f"prefetch factor {args.prefetch_factor if args.num_workers else 0}")
+    # start the workers now, they decode the first batches while the encoders load and warm up
+    batches = iterate_batches(dataset, args, pin_memory=device_policy.is_cuda)
 
     # Initialize feature extractor
     logger.info("Initializing feature extractor...")
@@ -107,90 +200,104 @@ def main(args):
         vae_config=None,
         enable_conditions=True,
         synchformer_ckpt=args.synchformer_ckpt,
-        use_half=args.use_half
+        use_half=args.use_half and device_policy.is_cuda
     )
+
+    # With --offload only one encoder is resident on the device at a time
+    offload = None
+    if args.offload:
+        offload = OffloadScheduler(device_policy)
+        offload.register(extractor)
+    else:
+        extractor = extractor.to(device_policy.device)
+
+    def stage(name, module):
+        return offload.stage(name, module) if offload is not None else nullcontext()
     
     # Warm up models
-    warmup_models(extractor)
+    warmup_models(extractor, device_policy, stage)
     
     logger.info("Starting processing...")
     processed_count = 0
+    start_time = time.perf_counter()
+    # npz files are written by background threads, the loop only waits when max_pending samples are queued
+    writer = FeatureWriter(args.save_dir, STORAGE_DTYPES[args.storage_dtype], journal,
+                           num_threads=args.write_threads, max_pending=args.write_queue)
     
     try:
-        for i, data in enumerate(tqdm(dataloader, desc="Processing", unit="batch")):
+        for i, data in enumerate(tqdm(batches, total=num_batches, desc="Processing", unit="batch")):
+            if data is None:
+                continue
             ids = data['id']
             
             try:
-                with torch.no_grad():
-                    output = {
-                        'caption': str(data['caption']),
-                        'caption_cot': str(data['caption_cot'])
-                    }
+                with torch.no_grad(), device_policy.autocast():
+                    output = {}
 
-                    # Process CLIP features
+                    # Process CLIP image and text features (one CLIP stage per batch)
                     clip_video = data['clip_video']
-                    clip_features = extractor.encode_video_with_clip(clip_video)
+                    caption = data['caption']
+                    with stage("clip", extractor.clip_model):
+                        clip_features = extractor.encode_video_with_clip(clip_video)
+                        metaclip_global_text_features, metaclip_text_features = extractor.encode_text(caption)
                     output['metaclip_features'] = clip_features
+                    output['metaclip_global_text_features'] = metaclip_global_text_features
+                    output['metaclip_text_features'] = metaclip_text_features
 
                     # Process Synchformer features
                     sync_video = data['sync_video']
-                    sync_features = extractor.encode_video_with_sync(sync_video)
+                    with stage("synchformer", extractor.synchformer):
+                        sync_features = extractor.encode_video_with_sync(sync_video)
                     output['sync_features'] = sync_features
 
-                    # Process text features
-                    caption = data['caption']
-                    metaclip_global_text_features, metaclip_text_features = extractor.encode_text(caption)
-                    output['metaclip_global_text_features'] = metaclip_global_text_features
-                    output['metaclip_text_features'] = metaclip_text_features
-
                     # Process T5 features
                     caption_cot = data['caption_cot']
-                    t5_features = extractor.encode_t5_text(caption_cot)
+                    with stage("t5", extractor.t5_model):
+                        t5_features = extractor.encode_t5_text(caption_cot)
                     output['t5_features'] = t5_features
 
-                    # Save each sample
-                    for j in range(len(ids)):
-                        sample_output = {
-                            'id': ids[j],
-                            'caption': output['caption'][j] if isinstance(output['caption'], list) else str(output['caption']),
-                            'caption_cot': output['caption_cot'][j] if isinstance(output['caption_cot'], list) else str(output['caption_cot']),
-                            'metaclip_features': output['metaclip_features'][j],
-                            'sync_features': output['sync_features'][j],
-                            'metaclip_global_text_features': output['metaclip_global_text_features'][j],
-                            'metaclip_text_features': output['metaclip_text_features'][j],
-                            't5_features': output['t5_features'][j],
-                        }
-                        
-                        # Convert tensors to numpy arrays
-                        for k, v in sample_output.items():
-                            if isinstance(v, torch.Tensor):
-                                sample_output[k] = v.float().cpu().numpy()
-                        
-                        np.savez(f'{args.save_dir}/{ids[j]}.npz', **sample_output)
-                        processed_count += 1
-                        
-                        # Log progress every 10 samples
-                        if processed_count % 10 == 0:
-                            logger.info(f"Processed {processed_count} samples")
-                            print_gpu(f"batch_{i}_sample_{j}")
+                # One cast (on the device, halving the copy for 16 bit storage) and device to host copy per
+                # feature and batch, the writer threads convert and write the samples
+                output = {k: v.to(STORAGE_DTYPES[args.storage_dtype]).cpu() for k, v in output.items()}
+
+                # Save each sample
+                for j in range(len(ids)):
+                    sample_output = {
+                        'id': ids[j],
+                        'caption': data['caption'][j],
+                        'caption_cot': data['caption_cot'][j],
+                        **{k: v[j] for k, v in output.items()},
+                    }
+                    writer.put(ids[j], sample_output)
+                    processed_count += 1
+
+                    # Log progress every 10 samples
+                    if processed_count % 10 == 0:
+                        logger.info(f"Processed {processed_count} samples "
+                                    f"({processed_count / (time.perf_counter() - start_time):.2f} clips/s)")
+                        print_gpu(f"batch_{i}_sample_{j}")
                 
             except Exception as e:
                 logger.error(f"Error processing batch {i}: {str(e)}")
                 logger.error(f"IDs in failed batch: {ids}")
                 continue
-            
-            # Force garbage collection
-            gc.collect()
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
     
     except KeyboardInterrupt:
         logger.info("Processing interrupted by user")
     except Exception as e:
         logger.error(f"Fatal error during processing: {str(e)}")
         raise
+    finally:
+        writer.close()
+        journal.close()
     
-    logger.info(f"Processing complete! Total samples processed: {processed_count}")
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"Processing complete! Total samples processed: {writer.written}"
+                + (f", {writer.failed} failed to write" if writer.failed else ""))
+    logger.info(f"Shard {rank}/{world_size}: {writer.written} clips in {elapsed:.1f}s "
+                f"({writer.written / elapsed:.2f} clips/s)")
+    if offload is not None:
+        logger.info(offload.report())
     print_gpu("finished")
 
 if __name__ == '__main__':
@@ -203,7 +310,26 @@ if __name__ == '__main__':
     parser.add_argument('--synchformer_ckpt', default='ckpts/synchformer_state_dict.pth')
     parser.add_argument('--start-row', type=int, default=0)
     parser.add_argument('--end-row', type=int, default=None)
+    parser.add_argument('--rank', type=int, default=None, help='Shard of the CSV rows to extract (default: RANK or SLURM_PROCID)')
+    parser.add_argument('--world_size', type=int, default=None, help='Number of shards (default: WORLD_SIZE or SLURM_NTASKS)')
+    parser.add_argument('--storage_dtype', default='float32', choices=list(STORAGE_DTYPES),
+                        help='dtype of the stored features, 16 bit halves disk space and read bandwidth')
+    parser.add_argument('--write_threads', type=int, default=2, help='Background threads writing feature files')
+    parser.add_argument('--write_queue', type=int, default=64, help='Samples queued for writing before the loop waits')
+    parser.add_argument('--resume', action='store_true', help='Skip the ids already recorded in the journal under --save-dir')
     parser.add_argument('--use_half', action='store_true', help='Use half precision for models to save memory')
+    parser.add_argument('--device', default='', help="Compute device, e.g. 'cuda:0' or 'cpu' (default: CUDA when available)")
+    parser.add_argument('--num_threads', type=int, default=0, help='CPU intra-op threads (0 uses the CPU affinity mask)')
+    parser.add_argument('--offload', action='store_true', help='Keep encoders in host memory and load one at a time per stage')
+    parser.add_argument('--batch_size', type=int, default=2, help='Clips per encoder batch')
+    parser.add_argument('--num_workers', type=int, default=min(8, os.cpu_count() or 1),
+                        help='DataLoader worker processes decoding and preprocessing clips (0 loads in the main process)')
+    parser.add_argument('--prefetch_factor', type=int, default=2, help='Batches each worker prepares ahead')
+    parser.add_argument('--mp_context', default='spawn', choices=['spawn', 'forkserver', 'fork'], help='How DataLoader workers are started')
+    parser.add_argument('--loader_timeout', type=float, default=300,
+                        help='Seconds to wait for a batch from the workers before skipping its clips and restarting them')
+    parser.add_argument('--max_skipped_batches', type=int, default=16,
+                        help='Loader failures tolerated before the job aborts; rerun with --resume to retry skipped clips')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
     
     args = parser.parse_args()
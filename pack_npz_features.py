@@ -0,0 +1,107 @@
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import webdataset as wds
+from tqdm import tqdm
+
+from ThinkSound.data.packed import PackedShardWriter, completed_ids
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Packs a directory of per-sample feature npz files (as written by extract_latents.py) into shards.
+# --format packed: memory-mapped shards (ThinkSound/data/packed.py). Point the "path" of a latent_dir / video_dataset
+#   config at the output directory, the datasets detect the packed layout and the existing split files keep working.
+# --format wds: tar shards for streaming with the video_feature_wds dataset type, {key}.{field}.npy per array and
+#   {key}.json with the id and the strings of each sample. Upload the directory to object storage or use it locally.
+
+
+def list_npz(npz_dir, split_path=None):
+    if split_path:
+        with open(split_path) as f:
+            names = [line.strip() for line in f if line.strip()]
+    else:
+        names = sorted(f for f in os.listdir(npz_dir) if f.endswith('.npz'))
+    return [(Path(name).stem, os.path.join(npz_dir, Path(name).stem + '.npz')) for name in names]
+
+
+def read_npz(item):
+    sample_id, path = item
+    try:
+        with np.load(path, allow_pickle=True) as npz:
+            # the sample id is stored by the shard index
+            return sample_id, {key: npz[key] for key in npz.files if key != 'id'}
+    except Exception as e:
+        logger.error(f"Error loading {path}: {e}")
+        return sample_id, None
+
+
+class TarShardWriter:
+    """Writes samples as webdataset tar shards, with the add / context manager interface of PackedShardWriter."""
+    def __init__(self, root, prefix="shard", shard_size=1024):
+        os.makedirs(root, exist_ok=True)
+        if glob.glob(os.path.join(root, f"{prefix}-*.tar")):
+            raise FileExistsError(f"{root} already holds {prefix}-*.tar shards, tar output cannot be resumed, use another --prefix")
+        self.writer = wds.ShardWriter(os.path.join(root, f"{prefix}-%06d.tar"), maxcount=shard_size, verbose=0)
+
+    def add(self, sample_id, **fields):
+        # webdataset splits keys from field names at the first dot
+        sample = {"__key__": sample_id.replace(".", "_")}
+        metadata = {"id": sample_id}
+        for name, value in fields.items():
+            if value.dtype.kind in "biufc":
+                buffer = io.BytesIO()
+                np.save(buffer, value)
+                sample[f"{name}.npy"] = buffer.getvalue()
+            else:
+                metadata[name] = value.tolist()
+        sample["json"] = json.dumps(metadata).encode()
+        self.writer.write(sample)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.writer.close()
+
+
+def main(args):
+    items = list_npz(args.npz_dir, args.split_path)
+    done = completed_ids(args.save_dir) if args.format == 'packed' and os.path.isdir(args.save_dir) else set()
+    items = [item for item in items if item[0] not in done]
+    logger.info(f"{len(items)} npz files to pack ({len(done)} already packed)")
+
+    start = time.perf_counter()
+    packed = 0
+    writer_class = PackedShardWriter if args.format == 'packed' else TarShardWriter
+    with Pool(args.num_workers) as pool, writer_class(args.save_dir, prefix=args.prefix, shard_size=args.shard_size) as writer:
+        # imap keeps the order of the split, so shards follow it and reads stay sequential
+        for sample_id, fields in tqdm(pool.imap(read_npz, items, chunksize=16), total=len(items), unit="file"):
+            if fields is None:
+                continue
+            writer.add(sample_id, **fields)
+            packed += 1
+    elapsed = time.perf_counter() - start
+    logger.info(f"Packed {packed} samples in {elapsed:.1f}s into {args.save_dir}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack per-sample feature npz files into memory-mapped or tar shards')
+    parser.add_argument('--npz_dir', required=True, help='Directory with the npz files')
+    parser.add_argument('--split_path', default=None, help='Split file listing the npz names to pack (default: every npz under npz_dir)')
+    parser.add_argument('--save_dir', required=True, help='Directory the shards are written to')
+    parser.add_argument('--format', default='packed', choices=['packed', 'wds'], help='Memory-mapped shards or webdataset tar shards')
+    parser.add_argument('--prefix', default='shard', help='Shard name prefix, use one per concurrent run into the same directory')
+    parser.add_argument('--shard_size', type=int, default=1024, help='Samples per shard (aim for a few hundred MB per tar shard)')
+    parser.add_argument('--num_workers', type=int, default=8, help='Processes reading the npz files')
+
+    args = parser.parse_args()
+    main(args)
@@ -2,32 +2,50 @@ from prefigure.prefigure import get_all_args, push_wandb_config
 import json
 import os
 import re
+import time
+from contextlib import nullcontext
 import torch
 import torchaudio
 from lightning.pytorch import seed_everything
 import random
 from datetime import datetime
-import numpy as np
+from ThinkSound.data.batch import stack_metadata
+from ThinkSound.data.dataset import load_npz
 from ThinkSound.models import create_model_from_config
 from ThinkSound.models.utils import load_ckpt_state_dict, remove_weight_norm_from_model
 from ThinkSound.inference.sampling import sample, sample_discrete_euler
+from ThinkSound.inference.device import DevicePolicy, get_device_policy
+from ThinkSound.inference.compile import compile_model
+from ThinkSound.inference.offload import OffloadScheduler, create_offload_scheduler
+from ThinkSound.inference.preview import load_preview_decoder
 from pathlib import Path
 
 
 
-def predict_step(diffusion, batch, diffusion_objective, device='cuda:0'):
-    diffusion = diffusion.to(device)
+def predict_step(diffusion, batch, diffusion_objective, device_policy: DevicePolicy = None, offload: OffloadScheduler = None, decoder=None):
+    device_policy = get_device_policy(device_policy)
+    device = device_policy.device
+    # decoder: replaces the VAE pretransform for decoding, e.g. a preview decoder (see load_preview_decoder)
+    decoder = decoder if decoder is not None else diffusion.pretransform
+    if offload is None:
+        diffusion = diffusion.to(device)
+        if decoder is not None:
+            decoder = decoder.to(device)
+
+    def stage(name, *modules):
+        return offload.stage(name, *modules) if offload is not None else nullcontext()
 
     reals, metadata = batch
     ids = [item['id'] for item in metadata]
     batch_size, length = reals.shape[0], reals.shape[2]
     print(f"Predicting {batch_size} samples with length {length} for ids: {ids}")
-    with torch.amp.autocast('cuda'):
+    stage_start = time.perf_counter()
+    with stage("conditioning", diffusion.conditioner), device_policy.autocast():
         conditioning = diffusion.conditioner(metadata, device)
     
-    video_exist = torch.stack([item['video_exist'] for item in metadata],dim=0)
-    conditioning['metaclip_features'][~video_exist] = diffusion.model.model.empty_clip_feat
-    conditioning['sync_features'][~video_exist] = diffusion.model.model.empty_sync_feat
+    video_exist = stack_metadata(metadata, 'video_exist').to(device)
+    conditioning['metaclip_features'][~video_exist] = diffusion.model.model.empty_clip_feat.to(device)
+    conditioning['sync_features'][~video_exist] = diffusion.model.model.empty_sync_feat.to(device)
 
     cond_inputs = diffusion.get_conditioning_inputs(conditioning)
     if batch_size > 1:
@@ -39,20 +57,31 @@ def predict_step(diffusion, batch, diffusion_objective, device='cuda:0'):
     else:
         noise = torch.randn([batch_size, diffusion.io_channels, length]).to(device)
 
-    with torch.amp.autocast('cuda'):
+    device_policy.synchronize()
+    timings = {"conditioning": time.perf_counter() - stage_start}
+
+    with device_policy.autocast():
 
         model = diffusion.model
-        if diffusion_objective == "v":
-            fakes = sample(model, noise, 24, 0, **cond_inputs, cfg_scale=5, batch_cfg=True)
-        elif diffusion_objective == "rectified_flow":
-            import time
-            start_time = time.time()
-            fakes = sample_discrete_euler(model, noise, 24, **cond_inputs, cfg_scale=5, batch_cfg=True)
-            end_time = time.time()
-            execution_time = end_time - start_time
-            print(f"执行时间: {execution_time:.2f} 秒")
-        if diffusion.pretransform is not None:
-            fakes = diffusion.pretransform.decode(fakes)
+        stage_start = time.perf_counter()
+        with stage("sampling", model):
+            if diffusion_objective == "v":
+                fakes = sample(model, noise, 24, 0, device_policy=device_policy, **cond_inputs, cfg_scale=5, batch_cfg=True)
+            elif diffusion_objective == "rectified_flow":
+                fakes = sample_discrete_euler(model, noise, 24, **cond_inputs, cfg_scale=5, batch_cfg=True)
+        device_policy.synchronize()
+        timings["sampling"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        if decoder is not None:
+            with stage("decode", decoder):
+                fakes = decoder.decode(fakes)
+        device_policy.synchronize()
+        timings["decode"] = time.perf_counter() - stage_start
+
+    print("Stage timings on {}: {}".format(device, ", ".join(f"{k} {v:.2f}s" for k, v in timings.items())))
+    if offload is not None:
+        print(offload.report())
 
     audios = fakes.to(torch.float32).div(torch.max(torch.abs(fakes))).clamp(-1, 1).mul(32767).to(torch.int16).cpu()
     return audios
@@ -64,12 +93,8 @@ def load_file(filename, info, latent_length):
     npz_file = filename
     if os.path.exists(npz_file): 
         # print(filename)
-        npz_data = np.load(npz_file,allow_pickle=True)
-        data = {key: npz_data[key] for key in npz_data.files}
-        # print("data.keys()",data.keys())
-        for key in data.keys():
-            if isinstance(data[key], np.ndarray) and np.issubdtype(data[key].dtype, np.number):
-                data[key] = torch.from_numpy(data[key])
+        # features may be stored in 16 bit (extract_latents.py --storage_dtype), load_npz restores float32
+        data = load_npz(npz_file)
     else:
         raise ValueError(f'error load file: {filename}')
     info.update(data)
@@ -122,29 +147,52 @@ def main():
     model_config["model"]["diffusion"]["config"]["clip_seq_len"] = 8*int(duration)
     model_config["model"]["diffusion"]["config"]["latent_seq_len"] = round(44100/64/32*duration)
 
-    model = create_model_from_config(model_config)
+    device_policy = DevicePolicy.create(args.device, num_threads=args.num_threads).apply()
 
-    ## speed by torch.compile
-    if args.compile:
-        model = torch.compile(model)
-        
+    model = create_model_from_config(model_config)
 
-    model.load_state_dict(torch.load(args.ckpt_dir))
+    if args.offload:
+        # memory-map the checkpoint and adopt its tensors instead of copying them into the model
+        model.load_state_dict(torch.load(args.ckpt_dir, map_location='cpu', mmap=True), assign=True)
+    else:
+        model.load_state_dict(torch.load(args.ckpt_dir, map_location='cpu'))
 
 
     load_vae_state = load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.') 
     model.pretransform.load_state_dict(load_vae_state)
+    # bake weight norm and precompute the Snake activations of the VAE, inference only
+    model.pretransform.prepare_for_inference()
+
+    # a distilled low sample rate decoder for quick previews instead of the full VAE
+    preview_decoder = None
+    if args.preview_decoder_config:
+        preview_decoder = load_preview_decoder(args.preview_decoder_config, args.preview_decoder_ckpt_path)
+    output_sample_rate = preview_decoder.decoder_sample_rate if preview_decoder is not None else 44100
+
+    if args.clip_merge_ratio > 0 or args.text_merge_ratio > 0:
+        model.model.model.set_token_merge(args.clip_merge_ratio, args.text_merge_ratio)
+
+    offload = None
+    if args.offload:
+        offload = create_offload_scheduler(model, device_policy, pin_memory=args.offload_pin_memory)
+        if args.compile:
+            print("Skipping torch.compile: not supported together with offload")
+    ## speed by torch.compile (after loading, so state dict keys are not prefixed by the wrapper)
+    elif args.compile:
+        model = compile_model(model, strategy=args.compile_mode, cache_dir=args.compile_cache_dir)
 
     audio,meta=load(os.path.join(args.results_dir, "demo.npz") , duration)
     
     for k, v in meta.items():
         if isinstance(v, torch.Tensor):
-            meta[k] = v.to('cuda:0')
+            meta[k] = device_policy.to(v)
 
     audio=predict_step(model, 
         batch=[audio,(meta,)],
         diffusion_objective=model_config["model"]["diffusion"]["diffusion_objective"], 
-        device='cuda:0'
+        device_policy=device_policy,
+        offload=offload,
+        decoder=preview_decoder
     )
 
     current_date = datetime.now()
@@ -152,7 +200,7 @@ def main():
     
     audio_dir = os.path.join(args.save_dir,f'{formatted_date}_batch_size'+str(args.test_batch_size))
     os.makedirs(audio_dir,exist_ok=True)
-    torchaudio.save(os.path.join(audio_dir,"demo.wav"), audio[0], 44100)
+    torchaudio.save(os.path.join(audio_dir,"demo.wav"), audio[0], output_sample_rate)
     
 
     #trainer.predict(training_wrapper, dm, return_predictions=False)